@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# arc_flags.py : Arc-flags over a region partition of the road network
+#
+# Cities are split into REGIONS regions by the same recursive median cuts of city
+# positions as the overlay partition (overlay.build_partition), so every region is a
+# compact block of the map. Every edge gets a bitmask with bit r set when the edge starts
+# a shortest route to some city of region r: all edges into r, plus every edge u->v with
+# cost(u, b) == w(u, v) + cost(v, b) in a Dijkstra from each boundary city b of r (roads
+# run both ways, so the search from b gives the costs to b). A search towards a city of
+# region r may skip every edge without bit r and still finds an optimal route, because
+# an optimal route enters r through some boundary city and the edges of every shortest
+# route to that city are flagged.
+#
+# One flag file per cost function, road-graph-arcflags-<cost>-<regions>.bin, built on
+# first use or ahead of time with python arc_flags.py (one Dijkstra per boundary city).
+# UNIFORM and ASTAR use it through find_route(..., arc_flags=True) / --arc-flags.
+
+import sys
+import time
+import numpy as np
+from road_graph import load_index, load_graph
+from overlay import build_partition
+from landmarks import one_to_all
+
+# a power of two up to 64, one bit of a uint64 per region
+REGIONS = 64
+
+
+# region of every city: the median cuts stop once ranges fit ceil(n / regions) cities
+def build_regions(graph, regions=REGIONS):
+	assert 0 < regions <= 64 and regions & (regions - 1) == 0, 'regions must be a power of two up to 64'
+	return build_partition(graph, [max(1, -(-len(graph) // regions))])[0]
+
+
+# (meta, arrays) of the region of every city and the flags of every edge under cost_func
+def build_flags(graph, cost_func, regions=REGIONS):
+	region = build_regions(graph, regions)
+	weights = graph.weights(cost_func)
+	sources = np.repeat(np.arange(len(graph)), np.diff(graph.offsets))
+	targets = np.asarray(graph.targets)
+	bit = np.left_shift(np.uint64(1), region.astype(np.uint64))
+	# edges into a region lead to it
+	flags = bit[targets].copy()
+	boundary = np.unique(sources[region[sources] != region[targets]])
+	# ties within rounding are flagged too, an extra flag only costs speed
+	tolerance = 1e-9 * max(float(weights.max()) if len(weights) else 1.0, 1.0)
+	for b in boundary.tolist():
+		dist = np.asarray(one_to_all(graph, b, cost_func)[0])
+		on_route = (dist[sources] >= weights + dist[targets] - tolerance) & np.isfinite(dist[sources])
+		flags[on_route] |= bit[b]
+	return [('region', region), ('flags', flags)]
+
+
+class ArcFlags:
+	def __init__(self, graph, cost_func, region, flags):
+		self.graph = graph
+		self.cost_func = cost_func
+		self.region = region
+		self.flags = flags
+		# region -> CSR lists of the flagged edges, built on first use
+		self._adjacency = {}
+
+	@property
+	def regions(self):
+		return int(self.region.max()) + 1 if len(self.region) else 0
+
+	# share of the edges a search towards each region may use
+	def flagged_share(self):
+		return [float(np.count_nonzero(self.flags & np.uint64(1 << r))) / max(len(self.flags), 1)
+			for r in range(self.regions)]
+
+	# (offsets, targets, weights) lists like graph.adjacency() with only the edges flagged
+	# for the region of end_city
+	def adjacency(self, end_city):
+		r = int(self.region[end_city])
+		if r not in self._adjacency:
+			keep = (self.flags & np.uint64(1 << r)) != 0
+			sources = np.repeat(np.arange(len(self.graph)), np.diff(self.graph.offsets))
+			offsets = np.zeros(len(self.graph) + 1, dtype=np.int64)
+			offsets[1:] = np.cumsum(np.bincount(sources[keep], minlength=len(self.graph)))
+			self._adjacency[r] = (offsets.tolist(), np.asarray(self.graph.targets)[keep].tolist(),
+				self.graph.weights(self.cost_func)[keep].tolist())
+		return self._adjacency[r]
+
+
+def load_arc_flags(graph, cost_func, regions=REGIONS):
+	key = ('arcflags', cost_func, regions)
+	if key not in graph.indexes:
+		_, arrays = load_index(graph, 'arcflags-%s-%d' % (cost_func, regions),
+			lambda: ({'cost_func': cost_func, 'regions': regions}, build_flags(graph, cost_func, regions)))
+		graph.indexes[key] = ArcFlags(graph, cost_func, arrays['region'], arrays['flags'])
+	return graph.indexes[key]
+
+
+if __name__ == '__main__':
+	# preprocessing step: python arc_flags.py [regions]
+	regions = int(sys.argv[1]) if len(sys.argv) > 1 else REGIONS
+	graph = load_graph()
+	for cost_func in ['distance', 'time']:
+		start = time.time()
+		flags = load_arc_flags(graph, cost_func, regions)
+		share = flags.flagged_share()
+		print('%s: %d regions, %.0f%% of the edges flagged per region on average, %.1fs' % (cost_func,
+			flags.regions, 100 * sum(share) / len(share), time.time() - start))
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# benchmark_route.py : Route benchmark suite, successor of the timing table in route.py
+#
+# Generates seeded random origin/destination pairs stratified by great-circle distance
+# (plus the two city pairs of the original table), runs every algorithm / cost function
+# (/ heuristic for the A* variants) combination on them and records wall time, nodes
+# expanded, heap peak and process RSS. Results are written as JSON and can be compared
+# against a stored baseline, e.g. the one checked in next to this file:
+#
+#   python benchmark_route.py --output bench.json --baseline
+#
+# Timings are the fastest of --repeat runs and are scaled by a fixed calibration
+# workload. Only the deterministic counters (nodes expanded, heap peak) fail the
+# comparison by default; pass --time-threshold to gate on time as well.
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import numpy as np
+from road_graph import load_graph
+from route import find_route, ROUTE_ALGORITHMS, COST_FUNCTIONS, HEURISTICS
+from search_stats import SearchStats
+
+# great-circle distance bands in miles
+BANDS = [(0, 100), (100, 300), (300, 1000), (1000, float('inf'))]
+README_PAIRS = [('Bloomington,_Indiana', 'Chicago,_Illinois'), ('Columbus,_Ohio', 'Chicago,_Illinois')]
+BASELINE_NAME = 'benchmark-baseline.json'
+# relative growth of nodes expanded / heap peak reported as a regression
+REGRESSION_THRESHOLD = 0.1
+# single rows slower than this (and by more than MIN_DELTA_MS) are marked; with
+# --time-threshold an algorithm's summed median times count as a regression too
+SLOW_THRESHOLD = 0.5
+MIN_DELTA_MS = 0.2
+# every query is timed this many times and the fastest run is kept
+DEFAULT_REPEAT = 3
+
+
+def band_name(band):
+	lo, hi = band
+	return '%d+mi' % lo if hi == float('inf') else '%d-%dmi' % (lo, hi)
+
+
+def rss_kb():
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * resource.getpagesize() // 1024
+	except (IOError, OSError):
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# cities with coordinates in the largest connected component
+def routable_cities(graph):
+	largest = int(np.argmax(np.bincount(graph.component)))
+	return (np.asarray(graph.component) == largest) & ~np.isnan(graph.lat)
+
+
+# pairs_per_band seeded random (start, end, band) triples for every band
+def sample_pairs(graph, pairs_per_band, seed=0):
+	rng = random.Random(seed)
+	ok = routable_cities(graph)
+	cities = np.flatnonzero(ok).tolist()
+	pairs = [(graph.city_id(s), graph.city_id(e), 'readme') for s, e in README_PAIRS]
+	for band in BANDS:
+		found = 0
+		while found < pairs_per_band:
+			start = rng.choice(cities)
+			miles = graph.great_circle_to(start)
+			candidates = np.flatnonzero(ok & (miles >= band[0]) & (miles < band[1])).tolist()
+			candidates = [c for c in candidates if c != start]
+			if not candidates:
+				continue
+			pairs.append((start, rng.choice(candidates), band_name(band)))
+			found += 1
+	return pairs
+
+
+def combinations():
+	for alg in ROUTE_ALGORITHMS:
+		for cost_func in COST_FUNCTIONS:
+			for heuristic in (HEURISTICS if 'astar' in alg else ['gps']):
+				yield alg, cost_func, heuristic
+
+
+# fixed pure-python workload (UNIFORM over the README pairs), fastest of repeat runs in ms;
+# comparisons divide by it so a slower or busier machine is not reported as a regression
+def calibrate(graph, repeat=5):
+	pairs = [(graph.city_id(s), graph.city_id(e)) for s, e in README_PAIRS]
+	best = float('inf')
+	for _ in range(repeat):
+		t = time.perf_counter()
+		for start, end in pairs:
+			for cost_func in ['distance', 'time']:
+				find_route(graph, start, end, 'uniform', cost_func)
+		best = min(best, (time.perf_counter() - t) * 1000)
+	return best
+
+
+def run_benchmark(graph, pairs, repeat=DEFAULT_REPEAT):
+	results = []
+	for alg, cost_func, heuristic in combinations():
+		# untimed warm-up builds any index the combination needs (CH, landmarks)
+		find_route(graph, pairs[0][0], pairs[0][1], alg, cost_func, heuristic)
+		per_band = {}
+		for start, end, band in pairs:
+			elapsed = float('inf')
+			for _ in range(repeat):
+				stats = SearchStats()
+				t = time.perf_counter()
+				find_route(graph, start, end, alg, cost_func, heuristic, stats=stats)
+				elapsed = min(elapsed, (time.perf_counter() - t) * 1000)
+			per_band.setdefault(band, []).append((elapsed, stats))
+		for band, runs in per_band.items():
+			times = np.array([r[0] for r in runs])
+			# searches without counters (bidirectional, ch) leave stats empty
+			expanded = [r[1].expanded for r in runs if r[1].pushes]
+			peaks = [r[1].peak for r in runs if r[1].pushes]
+			results.append({'algorithm': alg, 'cost': cost_func, 'heuristic': heuristic, 'band': band,
+				'queries': len(runs),
+				'mean_ms': float(times.mean()), 'median_ms': float(np.median(times)),
+				'p95_ms': float(np.percentile(times, 95)), 'max_ms': float(times.max()),
+				'mean_expanded': float(np.mean(expanded)) if expanded else None,
+				'max_heap': int(max(peaks)) if peaks else None,
+				'rss_kb': rss_kb()})
+	return results
+
+
+def result_key(r):
+	return (r['algorithm'], r['cost'], r['heuristic'], r['band'])
+
+
+# one line per combination and band. Node expansions and heap peaks are deterministic,
+# any growth beyond threshold is a REGRESSION. Timings on a shared machine are not, so
+# slow rows are only marked unless time_threshold is given, which is then applied to
+# every algorithm's times summed over all its rows
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD, time_threshold=None):
+	old = dict((result_key(r), r) for r in baseline['results'])
+	# scale baseline times to this machine's speed
+	scale = current.get('calibration_ms', 1.0) / baseline.get('calibration_ms', 1.0)
+	lines = ['%-22s %-8s %-4s %-10s %9s %9s %7s %9s %9s' % ('algorithm', 'cost', 'heur', 'band',
+		'base_med', 'now_med', 'ratio', 'base_exp', 'now_exp')]
+	if baseline.get('pairs') != current.get('pairs'):
+		lines.insert(0, 'warning: query pairs differ from the baseline (seed, --pairs or data changed)')
+	regressions = 0
+	totals = {}
+	for r in current['results']:
+		b = old.get(result_key(r))
+		if b is None:
+			lines.append('%-22s %-8s %-4s %-10s %9s %9.3f %7s' % (r['algorithm'], r['cost'],
+				r['heuristic'], r['band'], '-', r['median_ms'], 'new'))
+			continue
+		expected = b['median_ms'] * scale
+		ratio = r['median_ms'] / expected if expected > 0 else float('inf')
+		total = totals.setdefault(r['algorithm'], [0.0, 0.0])
+		total[0] += expected
+		total[1] += r['median_ms']
+		flag = ''
+		for field in ['mean_expanded', 'max_heap']:
+			if r[field] is not None and b[field] is not None and r[field] > b[field] * (1 + threshold):
+				flag = ' REGRESSION (%s)' % field
+				regressions += 1
+				break
+		if not flag and ratio > 1 + SLOW_THRESHOLD and r['median_ms'] - expected > MIN_DELTA_MS:
+			flag = ' slower'
+		lines.append('%-22s %-8s %-4s %-10s %9.3f %9.3f %7.2f %9s %9s%s' % (r['algorithm'], r['cost'],
+			r['heuristic'], r['band'], expected, r['median_ms'], ratio,
+			'-' if b['mean_expanded'] is None else '%.0f' % b['mean_expanded'],
+			'-' if r['mean_expanded'] is None else '%.0f' % r['mean_expanded'], flag))
+	lines.append('baseline times scaled by %.2f (calibration)' % scale)
+	for alg, (expected, now) in totals.items():
+		if time_threshold is not None and expected > 0 and now > expected * (1 + time_threshold):
+			lines.append('REGRESSION %s: %.1f ms over all queries, %.1f ms expected' % (alg, now, expected))
+			regressions += 1
+	lines.append('%d regression(s)' % regressions)
+	return '\n'.join(lines), regressions
+
+
+def report(current):
+	lines = ['%-22s %-8s %-4s %-10s %9s %9s %10s %8s' % ('algorithm', 'cost', 'heur', 'band',
+		'median_ms', 'p95_ms', 'expanded', 'max_heap')]
+	for r in current['results']:
+		lines.append('%-22s %-8s %-4s %-10s %9.3f %9.3f %10s %8s' % (r['algorithm'], r['cost'],
+			r['heuristic'], r['band'], r['median_ms'], r['p95_ms'],
+			'-' if r['mean_expanded'] is None else '%.0f' % r['mean_expanded'],
+			'-' if r['max_heap'] is None else r['max_heap']))
+	return '\n'.join(lines)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmark every routing algorithm and cost function')
+	parser.add_argument('--pairs', type=int, default=10, help='random pairs per distance band')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='timed runs per query, fastest kept')
+	parser.add_argument('--output', metavar='FILE', help='write the results as JSON')
+	parser.add_argument('--baseline', metavar='FILE', nargs='?',
+		const=os.path.join(os.path.dirname(os.path.abspath(__file__)), BASELINE_NAME),
+		help='compare against a previous JSON result (default: the stored %s)' % BASELINE_NAME)
+	parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+		help='relative growth of nodes expanded or heap peak flagged as a regression')
+	parser.add_argument('--time-threshold', type=float,
+		help='also flag an algorithm whose total time grew by this fraction (off by default, timings are noisy)')
+	args = parser.parse_args(argv)
+
+	t = time.perf_counter()
+	graph = load_graph()
+	load_ms = (time.perf_counter() - t) * 1000
+	pairs = sample_pairs(graph, args.pairs, args.seed)
+	# before and after the run, the faster one is the least disturbed
+	calibration_ms = calibrate(graph)
+	results = run_benchmark(graph, pairs, args.repeat)
+	calibration_ms = min(calibration_ms, calibrate(graph))
+	current = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+		'machine': platform.machine(), 'seed': args.seed, 'pairs_per_band': args.pairs, 'repeat': args.repeat,
+		'load_ms': load_ms, 'calibration_ms': calibration_ms,
+		'pairs': [[graph.names[s], graph.names[e], band] for s, e, band in pairs],
+		'results': results}
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(current, f, indent=1)
+	if args.baseline:
+		with open(args.baseline) as f:
+			text, regressions = compare(current, json.load(f), args.threshold, args.time_threshold)
+		print(text)
+		return 1 if regressions else 0
+	print(report(current))
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
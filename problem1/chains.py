@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# chains.py : Degree-2 chain compression of the road network
+#
+# A city with exactly two distinct neighbors is a pass-through: a route through it comes
+# in from one neighbor and leaves to the other. Every maximal run of such cities is
+# replaced by one edge between the cities at its two ends (the "core" cities), weighted
+# with the summed cost of its roads (the cheapest road where two cities are joined by
+# several), and the run is kept to unpack routes. A ring made only of pass-through
+# cities gets one of them promoted to core.
+#
+# Searches run on the core cities only. A route starting inside a run enters the core
+# through the two ends of its run, one ending inside a run leaves through them, and two
+# cities on the same run are also joined directly along it; that keeps UNIFORM and ASTAR
+# exact. Routes are unpacked to the full city list before they are returned.
+
+import sys
+import time
+import random
+from heapq import heappush, heappop
+from road_graph import load_graph
+
+INF = float('inf')
+
+
+class ChainGraph:
+	def __init__(self, graph):
+		n = len(graph)
+		self.graph = graph
+		offsets, targets = graph.offsets.tolist(), graph.targets.tolist()
+		length, time_ = graph.length.tolist(), graph.time.tolist()
+		# cheapest length and time to every distinct neighbor
+		hop = [dict() for _ in range(n)]
+		for u in range(n):
+			for e in range(offsets[u], offsets[u + 1]):
+				v = targets[e]
+				if v != u:
+					best = hop[u].get(v, (INF, INF))
+					hop[u][v] = (min(best[0], length[e]), min(best[1], time_[e]))
+		self.core = [len(hop[u]) != 2 for u in range(n)]
+		# run and position (1-based, 0 is the tail) of every pass-through city
+		self.chain_of = [-1] * n
+		self.position = [0] * n
+		# per run: tail, head, cities in between, and for every position the
+		# cumulative cost from the tail under each cost function
+		self.chains = []
+		edges = []
+
+		def walk(u):
+			for v, (l, t) in hop[u].items():
+				if self.core[v]:
+					# direct road, the other direction is added from v
+					edges.append((u, v, l, t, 1, -1))
+					continue
+				if self.chain_of[v] >= 0:
+					continue
+				c = len(self.chains)
+				cities = []
+				cost = {'distance': [0.0, l], 'time': [0.0, t], 'segments': [0, 1]}
+				prev, cur = u, v
+				while not self.core[cur]:
+					self.chain_of[cur] = c
+					self.position[cur] = len(cities) + 1
+					cities.append(cur)
+					nxt = [x for x in hop[cur] if x != prev][0]
+					dl, dt = hop[cur][nxt]
+					cost['distance'].append(cost['distance'][-1] + dl)
+					cost['time'].append(cost['time'][-1] + dt)
+					cost['segments'].append(cost['segments'][-1] + 1)
+					prev, cur = cur, nxt
+				self.chains.append((u, cur, cities, cost))
+				# a run from a city back to itself is never on a shortest route
+				if cur != u:
+					edges.append((u, cur, cost['distance'][-1], cost['time'][-1], len(cities) + 1, c))
+					edges.append((cur, u, cost['distance'][-1], cost['time'][-1], len(cities) + 1, c))
+
+		for u in range(n):
+			if self.core[u]:
+				walk(u)
+		for u in range(n):
+			if not self.core[u] and self.chain_of[u] < 0:
+				self.core[u] = True
+				walk(u)
+
+		edges.sort(key=lambda edge: edge[0])
+		self.offsets = [0] * (n + 1)
+		for edge in edges:
+			self.offsets[edge[0] + 1] += 1
+		for u in range(n):
+			self.offsets[u + 1] += self.offsets[u]
+		self.targets = [edge[1] for edge in edges]
+		self.edge_weights = {'distance': [edge[2] for edge in edges], 'time': [edge[3] for edge in edges],
+			'segments': [edge[4] for edge in edges]}
+		self.edge_chain = [edge[5] for edge in edges]
+
+	def __len__(self):
+		return len(self.core)
+
+	@property
+	def num_core(self):
+		return sum(self.core)
+
+	@property
+	def num_edges(self):
+		return len(self.targets)
+
+	def adjacency(self, cost_func):
+		return self.offsets, self.targets, self.edge_weights[cost_func]
+
+	# (core city, cost) pairs through which city enters or leaves the core, cheapest
+	# direction only when both ends of its run are the same city
+	def ends(self, city, cost_func):
+		if self.core[city]:
+			return [(city, 0)]
+		tail, head, cities, cost = self.chains[self.chain_of[city]]
+		cum = cost[cost_func]
+		p = self.position[city]
+		if tail == head:
+			return [(tail, min(cum[p], cum[-1] - cum[p]))]
+		return [(tail, cum[p]), (head, cum[-1] - cum[p])]
+
+	# cities of run c after position a up to and including position b
+	def along(self, c, a, b):
+		tail, head, cities, _ = self.chains[c]
+		stops = [tail] + cities + [head]
+		return stops[a + 1:b + 1] if a < b else stops[b:a][::-1]
+
+	# cities from a pass-through city to one end of its run (excluding city itself)
+	def _to_end(self, city, end, cost_func):
+		c = self.chain_of[city]
+		tail, head, cities, cost = self.chains[c]
+		p = self.position[city]
+		cum = cost[cost_func]
+		if end == tail and (end != head or cum[p] <= cum[-1] - cum[p]):
+			return self.along(c, p, 0)
+		return self.along(c, p, len(cities) + 1)
+
+	# expand consecutive core cities into the full city list, through the cheapest edge
+	def unpack(self, path, cost_func):
+		weights = self.edge_weights[cost_func]
+		result = [path[0]]
+		for u, v in zip(path, path[1:]):
+			best = None
+			for e in range(self.offsets[u], self.offsets[u + 1]):
+				if self.targets[e] == v and (best is None or weights[e] < weights[best]):
+					best = e
+			c = self.edge_chain[best]
+			if c < 0:
+				result.append(v)
+			else:
+				tail, head, cities, _ = self.chains[c]
+				result.extend(cities if u == tail else cities[::-1])
+				result.append(v)
+		return result
+
+	# best-first search (h = 0: UNIFORM) between any two cities over the core graph,
+	# returns the full city-id route or None
+	def search(self, start_city, end_city, cost_func, h, stats=None):
+		if start_city == end_city:
+			return [start_city]
+		if not self.graph.connected(start_city, end_city):
+			return None
+		offsets, targets, weights = self.adjacency(cost_func)
+		n = len(self)
+		# a core end city is the goal itself, otherwise a virtual goal n is reached from
+		# the ends of its run
+		goal = end_city if self.core[end_city] else n
+		exits = {} if goal == end_city else dict(self.ends(end_city, cost_func))
+		g_value = [INF] * (n + 1)
+		parent = [-1] * (n + 1)
+		fringe = []
+		for city, cost in self.ends(start_city, cost_func):
+			if cost < g_value[city]:
+				g_value[city] = cost
+				heappush(fringe, (cost + h[city], cost, city))
+		# both on one run: straight along it, parent -2 marks that
+		direct = self.chain_of[start_city]
+		if goal == n and direct >= 0 and direct == self.chain_of[end_city]:
+			cum = self.chains[direct][3][cost_func]
+			cost = abs(cum[self.position[end_city]] - cum[self.position[start_city]])
+			if cost < g_value[goal]:
+				g_value[goal] = cost
+				parent[goal] = -2
+				heappush(fringe, (cost, cost, goal))
+
+		pops = stale = peak = generated = 0
+		found = False
+		while fringe:
+			if len(fringe) > peak:
+				peak = len(fringe)
+			_, g, city = heappop(fringe)
+			pops += 1
+			if g > g_value[city]:
+				stale += 1
+				continue
+			if city == goal:
+				found = True
+				break
+			generated += offsets[city + 1] - offsets[city]
+			for e in range(offsets[city], offsets[city + 1]):
+				nxt = targets[e]
+				tmp = g + weights[e]
+				if tmp < g_value[nxt]:
+					g_value[nxt] = tmp
+					parent[nxt] = city
+					heappush(fringe, (tmp + h[nxt], tmp, nxt))
+			if exits and city in exits:
+				tmp = g + exits[city]
+				if tmp < g_value[goal]:
+					g_value[goal] = tmp
+					parent[goal] = city
+					heappush(fringe, (tmp, tmp, goal))
+		if stats is not None:
+			stats.add(expanded=pops - stale, generated=generated, pushes=pops + len(fringe), peak=peak)
+		if not found:
+			return None
+		if parent[goal] == -2:
+			return [start_city] + self._to_city(start_city, end_city)
+
+		core_path = [goal] if goal == end_city else []
+		city = parent[goal]
+		while city >= 0:
+			core_path.append(city)
+			city = parent[city]
+		core_path.reverse()
+		route = self.unpack(core_path, cost_func)
+		if not self.core[start_city]:
+			route = [start_city] + self._to_end(start_city, route[0], cost_func)[:-1] + route
+		if goal == n:
+			route = route + self._to_end(end_city, route[-1], cost_func)[::-1][1:] + [end_city]
+		return route
+
+	# cities after a up to b on their shared run
+	def _to_city(self, a, b):
+		return self.along(self.chain_of[a], self.position[a], self.position[b])
+
+
+# built in a few tens of milliseconds, so kept in memory only
+def load_chains(graph):
+	if 'chains' not in graph.indexes:
+		graph.indexes['chains'] = ChainGraph(graph)
+	return graph.indexes['chains']
+
+
+if __name__ == '__main__':
+	# python chains.py [queries] : size of the core graph and UNIFORM expansions on it
+	from route import UNIFORM
+	from search_stats import SearchStats
+	queries = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+	graph = load_graph()
+	start = time.time()
+	chains = load_chains(graph)
+	print('%d of %d cities in the core, %d of %d edges, %d runs, built in %.3fs' % (chains.num_core,
+		len(graph), chains.num_edges, graph.num_edges, len(chains.chains), time.time() - start))
+	rng = random.Random(0)
+	pairs = [(rng.randrange(len(graph)), rng.randrange(len(graph))) for _ in range(queries)]
+	zeros = [0] * (len(graph) + 1)
+	for name, run in [('full', lambda s, t, st: UNIFORM(graph, s, t, 'distance', stats=st)),
+			('core', lambda s, t, st: chains.search(s, t, 'distance', zeros, st))]:
+		stats = SearchStats()
+		start = time.time()
+		for s, t in pairs:
+			run(s, t, stats)
+		print('%s: %.3fs, %d expanded, %d pushes' % (name, time.time() - start, stats.expanded, stats.pushes))
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# contraction.py : Contraction Hierarchies over the road network
+#
+# Preprocessing contracts cities one at a time, cheapest first by edge difference
+# (shortcuts added minus edges removed, plus the number of already contracted
+# neighbors so the order stays spread out). A shortcut u-w via v is only added when a
+# bounded witness search cannot find a path from u to w avoiding v that is no longer
+# than u-v-w. Every city keeps the edges to neighbors contracted after it ("upward"
+# edges); a query is a bidirectional Dijkstra over upward edges only, and shortcuts
+# are unpacked through their middle city afterwards.
+#
+# One hierarchy is built per cost function and stored as road-graph-ch-<cost>.bin.
+
+import sys
+import numpy as np
+from heapq import heappush, heappop, heapify
+from road_graph import load_index, load_graph
+
+INF = float('inf')
+
+# settled-city budget of one witness search; a larger budget means fewer redundant shortcuts
+WITNESS_SETTLE_LIMIT = 60
+
+
+# distances from source in the remaining graph without passing through skip
+def witness_search(adj, source, skip, max_cost):
+	dist = {source: 0}
+	fringe = [(0, source)]
+	settled = 0
+	while fringe and settled < WITNESS_SETTLE_LIMIT:
+		d, city = heappop(fringe)
+		if d > dist[city]:
+			continue
+		if d > max_cost:
+			break
+		settled += 1
+		for nxt, (w, _) in adj[city].items():
+			if nxt == skip:
+				continue
+			tmp = d + w
+			if tmp < dist.get(nxt, INF):
+				dist[nxt] = tmp
+				heappush(fringe, (tmp, nxt))
+	return dist
+
+
+# shortcuts (u, w, cost) needed to contract city, each neighbor pair once
+def shortcuts_for(adj, city):
+	neighbors = list(adj[city].items())
+	shortcuts = []
+	for i, (u, (wu, _)) in enumerate(neighbors):
+		others = neighbors[i + 1:]
+		if not others:
+			continue
+		dist = witness_search(adj, u, city, wu + max(wx for _, (wx, _) in others))
+		for x, (wx, _) in others:
+			if dist.get(x, INF) > wu + wx:
+				shortcuts.append((u, x, wu + wx))
+	return shortcuts
+
+
+# contract every city; returns rank plus the upward edges as CSR arrays
+def build_hierarchy(graph, cost_func):
+	n = len(graph)
+	offsets, targets, weights = graph.adjacency(cost_func)
+	# adj[u][v] = (cost, middle city or -1), parallel roads collapsed to the cheapest
+	adj = [dict() for _ in range(n)]
+	for u in range(n):
+		for e in range(offsets[u], offsets[u + 1]):
+			v = targets[e]
+			if v != u and weights[e] < adj[u].get(v, (INF,))[0]:
+				adj[u][v] = (weights[e], -1)
+
+	contracted_neighbors = [0] * n
+
+	def priority(city):
+		return len(shortcuts_for(adj, city)) - len(adj[city]) + contracted_neighbors[city]
+
+	order = [(priority(city), city) for city in range(n)]
+	heapify(order)
+	rank = [0] * n
+	up = [None] * n
+	next_rank = 0
+	while order:
+		_, city = heappop(order)
+		# lazy update: re-evaluate, put back if it is no longer the cheapest
+		p = priority(city)
+		if order and p > order[0][0]:
+			heappush(order, (p, city))
+			continue
+		shortcuts = shortcuts_for(adj, city)
+		rank[city] = next_rank
+		next_rank += 1
+		up[city] = [(nxt, w, mid) for nxt, (w, mid) in adj[city].items()]
+		for nxt in adj[city]:
+			del adj[nxt][city]
+			contracted_neighbors[nxt] += 1
+		for u, x, w in shortcuts:
+			if w < adj[u].get(x, (INF,))[0]:
+				adj[u][x] = (w, city)
+				adj[x][u] = (w, city)
+		adj[city] = {}
+
+	up_offsets = np.zeros(n + 1, dtype=np.int64)
+	np.cumsum([len(edges) for edges in up], out=up_offsets[1:])
+	flat = [edge for edges in up for edge in edges]
+	return [('rank', np.asarray(rank, dtype=np.int32)),
+		('up_offsets', up_offsets),
+		('up_targets', np.asarray([e[0] for e in flat], dtype=np.int32)),
+		('up_weights', np.asarray([e[1] for e in flat], dtype=np.float64)),
+		('up_middle', np.asarray([e[2] for e in flat], dtype=np.int32))]
+
+
+class ContractionHierarchy:
+	def __init__(self, rank, up_offsets, up_targets, up_weights, up_middle):
+		self.rank = rank.tolist()
+		self.up_offsets = up_offsets.tolist()
+		self.up_targets = up_targets.tolist()
+		self.up_weights = up_weights.tolist()
+		# middle city of every shortcut, keyed by (lower ranked end, higher ranked end)
+		self.middle = {}
+		for city in range(len(self.rank)):
+			for e in range(self.up_offsets[city], self.up_offsets[city + 1]):
+				if up_middle[e] >= 0:
+					self.middle[(city, self.up_targets[e])] = int(up_middle[e])
+
+	@property
+	def num_shortcuts(self):
+		return len(self.middle)
+
+	# upward search from both ends, returns (cost, city-id path) or (INF, None)
+	def query(self, start_city, end_city):
+		if start_city == end_city:
+			return 0, [start_city]
+		up_offsets, up_targets, up_weights = self.up_offsets, self.up_targets, self.up_weights
+		dist = ({start_city: 0}, {end_city: 0})
+		parent = ({start_city: -1}, {end_city: -1})
+		fringe = ([(0, start_city)], [(0, end_city)])
+		best = INF
+		meet = -1
+		while fringe[0] or fringe[1]:
+			# a side is done once its fringe top cannot improve the best meeting
+			for side in (0, 1):
+				if fringe[side] and fringe[side][0][0] >= best:
+					del fringe[side][:]
+			if not fringe[0] and not fringe[1]:
+				break
+			side = 0 if fringe[0] and (not fringe[1] or fringe[0][0][0] <= fringe[1][0][0]) else 1
+			d, city = heappop(fringe[side])
+			if d > dist[side][city]:
+				continue
+			other = dist[1 - side].get(city)
+			if other is not None and d + other < best:
+				best = d + other
+				meet = city
+			own = dist[side]
+			for e in range(up_offsets[city], up_offsets[city + 1]):
+				nxt = up_targets[e]
+				tmp = d + up_weights[e]
+				if tmp < own.get(nxt, INF):
+					own[nxt] = tmp
+					parent[side][nxt] = city
+					heappush(fringe[side], (tmp, nxt))
+
+		if meet < 0:
+			return INF, None
+		forward = [meet]
+		while parent[0][forward[-1]] >= 0:
+			forward.append(parent[0][forward[-1]])
+		forward.reverse()
+		backward = []
+		city = parent[1][meet]
+		while city >= 0:
+			backward.append(city)
+			city = parent[1][city]
+		return best, self.unpack(forward + backward)
+
+	# expand shortcuts back into the original cities
+	def unpack(self, path):
+		result = [path[0]]
+		for u, v in zip(path, path[1:]):
+			stack = [(u, v)]
+			while stack:
+				a, b = stack.pop()
+				key = (a, b) if self.rank[a] < self.rank[b] else (b, a)
+				mid = self.middle.get(key, -1)
+				if mid < 0:
+					result.append(b)
+				else:
+					stack.append((mid, b))
+					stack.append((a, mid))
+		return result
+
+
+def load_hierarchy(graph, cost_func):
+	key = ('ch', cost_func)
+	if key not in graph.indexes:
+		_, arrays = load_index(graph, 'ch-%s' % cost_func,
+			lambda: ({'cost_func': cost_func}, build_hierarchy(graph, cost_func)))
+		graph.indexes[key] = ContractionHierarchy(arrays['rank'], arrays['up_offsets'],
+			arrays['up_targets'], arrays['up_weights'], arrays['up_middle'])
+	return graph.indexes[key]
+
+
+if __name__ == '__main__':
+	# preprocessing step: python contraction.py [cost_func ...]
+	graph = load_graph()
+	for cost_func in sys.argv[1:] or ['distance', 'time']:
+		ch = load_hierarchy(graph, cost_func)
+		print('%s: %d shortcuts' % (cost_func, ch.num_shortcuts))
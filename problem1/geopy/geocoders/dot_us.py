@@ -3,7 +3,10 @@
 """
 
 import csv
-from base64 import encodestring
+try:
+    from base64 import encodebytes as encodestring
+except ImportError: # py2
+    from base64 import encodestring
 from geopy.compat import urlencode, py3k, Request
 from geopy.geocoders.base import (
     Geocoder,
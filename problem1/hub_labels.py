@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# hub_labels.py : Hub labeling distance oracle, built by pruned landmark labeling
+#
+# Every city u gets a label: a list of (hub, cost from u to hub) such that any two
+# connected cities share a hub on one of their shortest routes, so
+#     cost(s, t) = min over hubs h in both labels of cost(s, h) + cost(h, t)
+# Labels come from pruned landmark labeling (Akiba et al.): cities are taken in order of
+# decreasing degree and a Dijkstra from each one adds it as a hub to every city it
+# settles, except that a city whose cost is already answered by the labels so far is
+# neither labeled nor expanded. Hubs are numbered by that order, so appending keeps
+# every label sorted.
+#
+# Labels are stored flat in road-graph-hub-<cost>.bin (offsets, hubs, costs), memory
+# mapped on load, so every process answering queries shares one copy. Only costs are
+# answered, there is no route:
+#
+#   labels = load_hub_labels(graph, 'time')
+#   labels.distance(start, end)              # one pair, ~20 microseconds
+#   labels.distances(start, ends)            # one row, vectorized
+
+import sys
+import time
+import random
+import numpy as np
+from heapq import heappush, heappop
+from road_graph import load_index, load_graph
+
+INF = float('inf')
+
+
+# (meta, arrays) of the labels of every city under cost_func
+def build_labels(graph, cost_func):
+	offsets, targets, weights = graph.adjacency(cost_func)
+	n = len(graph)
+	degree = np.diff(graph.offsets)
+	order = sorted(range(n), key=lambda u: -degree[u])
+	hubs = [[] for _ in range(n)]
+	costs = [[] for _ in range(n)]
+	# cost from the current root to each hub of its own label, by hub number
+	root_cost = [INF] * n
+	dist = [INF] * n
+	for rank, root in enumerate(order):
+		for h, c in zip(hubs[root], costs[root]):
+			root_cost[h] = c
+		dist[root] = 0
+		touched = [root]
+		fringe = [(0, root)]
+		while fringe:
+			d, city = heappop(fringe)
+			if d > dist[city]:
+				continue
+			# pruned: a hub found earlier already covers root-city at no higher cost
+			if min([root_cost[h] + c for h, c in zip(hubs[city], costs[city])], default=INF) <= d:
+				continue
+			hubs[city].append(rank)
+			costs[city].append(d)
+			for e in range(offsets[city], offsets[city + 1]):
+				nxt = targets[e]
+				tmp = d + weights[e]
+				if tmp < dist[nxt]:
+					if dist[nxt] == INF:
+						touched.append(nxt)
+					dist[nxt] = tmp
+					heappush(fringe, (tmp, nxt))
+		for city in touched:
+			dist[city] = INF
+		for h in hubs[root]:
+			root_cost[h] = INF
+	label_offsets = np.zeros(n + 1, dtype=np.int64)
+	label_offsets[1:] = np.cumsum([len(label) for label in hubs])
+	return [('order', np.asarray(order, dtype=np.int32)), ('label_offsets', label_offsets),
+		('label_hubs', np.asarray([h for label in hubs for h in label], dtype=np.int32)),
+		('label_costs', np.asarray([c for label in costs for c in label], dtype=np.float64))]
+
+
+class HubLabels:
+	def __init__(self, order, label_offsets, label_hubs, label_costs):
+		self.order = order
+		self.offsets = label_offsets
+		# plain-list copy, indexed once per label in distance()
+		self.label_start = label_offsets.tolist()
+		self.hubs = label_hubs
+		self.costs = label_costs
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	@property
+	def average_label(self):
+		return len(self.hubs) / max(len(self), 1)
+
+	# cost from start_city to end_city, INF if they are not connected; both labels are
+	# sorted by hub, so the common hubs are found with one binary search per end hub
+	def distance(self, start_city, end_city):
+		a, b = self.label_start[start_city], self.label_start[start_city + 1]
+		c, d = self.label_start[end_city], self.label_start[end_city + 1]
+		own, other = self.hubs[a:b], self.hubs[c:d]
+		at = np.searchsorted(own, other)
+		at[at == len(own)] = 0
+		common = own[at] == other
+		if not common.any():
+			return INF
+		return float((self.costs[a:b][at[common]] + self.costs[c:d][common]).min())
+
+	# costs from start_city to every end city, as an array
+	def distances(self, start_city, end_cities):
+		a, b = int(self.offsets[start_city]), int(self.offsets[start_city + 1])
+		own = np.full(len(self), INF)
+		own[self.hubs[a:b]] = self.costs[a:b]
+		ends = np.asarray(end_cities, dtype=np.int64)
+		starts = self.offsets[ends]
+		sizes = self.offsets[ends + 1] - starts
+		# label entries of all end cities, concatenated, then the minimum per city
+		entries = np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(int(sizes.sum()))
+		sums = own[self.hubs[entries]] + self.costs[entries]
+		result = np.full(len(ends), INF)
+		nonempty = sizes > 0
+		if nonempty.any():
+			result[nonempty] = np.minimum.reduceat(sums, (np.cumsum(sizes) - sizes)[nonempty])
+		return result
+
+
+def load_hub_labels(graph, cost_func):
+	key = ('hub', cost_func)
+	if key not in graph.indexes:
+		_, arrays = load_index(graph, 'hub-%s' % cost_func,
+			lambda: ({'cost_func': cost_func}, build_labels(graph, cost_func)))
+		graph.indexes[key] = HubLabels(arrays['order'], arrays['label_offsets'], arrays['label_hubs'],
+			arrays['label_costs'])
+	return graph.indexes[key]
+
+
+if __name__ == '__main__':
+	# preprocessing step: python hub_labels.py [queries]
+	from landmarks import one_to_all
+	queries = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+	graph = load_graph()
+	rng = random.Random(0)
+	pairs = [(rng.randrange(len(graph)), rng.randrange(len(graph))) for _ in range(queries)]
+	for cost_func in ['distance', 'time']:
+		start = time.time()
+		labels = load_hub_labels(graph, cost_func)
+		print('%s: %.1f hubs per city, loaded in %.2fs' % (cost_func, labels.average_label, time.time() - start))
+		start = time.time()
+		for s, t in pairs:
+			labels.distance(s, t)
+		print('  %.1f us per distance()' % ((time.time() - start) * 1e6 / len(pairs)))
+		start = time.time()
+		row = labels.distances(pairs[0][0], range(len(graph)))
+		print('  %.2f us per city in distances()' % ((time.time() - start) * 1e6 / len(graph)))
+		expected = one_to_all(graph, pairs[0][0], cost_func)[0]
+		print('  matches Dijkstra: %s' % np.allclose(row, expected))
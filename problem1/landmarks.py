@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# landmarks.py : ALT (A*, landmarks, triangle inequality) heuristic
+#
+# For a handful of landmark cities L the exact distance d(L, v) to every city is
+# precomputed. Roads are bidirectional, so by the triangle inequality
+#     d(v, t) >= |d(L, t) - d(L, v)|
+# for every landmark, and the maximum over the landmarks is a consistent lower bound
+# that also works for cities missing from city-gps.txt. Tables are stored per cost
+# function and selection strategy as road-graph-alt-<cost>-<strategy>-<k>.bin.
+#
+# Landmark selection:
+#   farthest : repeatedly add the city farthest from the landmarks chosen so far
+#   avoid    : grow a shortest path tree from a random root and descend into the
+#              subtree where the current bounds are worst (Goldberg & Harrelson)
+
+import sys
+import random
+import numpy as np
+from heapq import heappush, heappop
+from road_graph import load_index, load_graph
+
+INF = float('inf')
+
+DEFAULT_LANDMARKS = 8
+STRATEGIES = ['farthest', 'avoid']
+
+
+# plain Dijkstra to every city; returns distances, parents and settle order
+def one_to_all(graph, source, cost_func):
+	offsets, targets, weights = graph.adjacency(cost_func)
+	dist = [INF] * len(graph)
+	parent = [-1] * len(graph)
+	order = []
+	dist[source] = 0
+	fringe = [(0, source)]
+	while fringe:
+		d, city = heappop(fringe)
+		if d > dist[city]:
+			continue
+		order.append(city)
+		for e in range(offsets[city], offsets[city + 1]):
+			nxt = targets[e]
+			tmp = d + weights[e]
+			if tmp < dist[nxt]:
+				dist[nxt] = tmp
+				parent[nxt] = city
+				heappush(fringe, (tmp, nxt))
+	return dist, parent, order
+
+
+# max over landmarks of |d(L, target) - d(L, v)| for every v, 0 where nothing is known
+def table_bounds(table, target):
+	if len(table) == 0:
+		return np.zeros(table.shape[1])
+	with np.errstate(invalid='ignore'):
+		diff = np.abs(table - table[:, target][:, None])
+	diff[~np.isfinite(diff)] = 0
+	return diff.max(axis=0)
+
+
+def select_farthest(graph, cost_func, k, rng):
+	# seed in the big component: the best connected city
+	seed = int(np.argmax(np.diff(graph.offsets)))
+	dist = one_to_all(graph, seed, cost_func)[0]
+	reachable = np.isfinite(dist)
+	min_dist = np.full(len(graph), INF)
+	min_dist[~reachable] = -1
+	current = np.asarray(dist)
+	landmarks = []
+	rows = []
+	while len(landmarks) < min(k, int(reachable.sum())):
+		# the farthest city from the seed, then from the set chosen so far
+		candidate = current.copy()
+		candidate[~reachable] = -1
+		candidate[landmarks] = -1
+		city = int(np.argmax(candidate))
+		landmarks.append(city)
+		row = np.asarray(one_to_all(graph, city, cost_func)[0])
+		rows.append(row)
+		min_dist = np.minimum(min_dist, row)
+		current = min_dist
+	return landmarks, rows
+
+
+def select_avoid(graph, cost_func, k, rng):
+	seed = int(np.argmax(np.diff(graph.offsets)))
+	component = [v for v, d in enumerate(one_to_all(graph, seed, cost_func)[0]) if d < INF]
+	landmarks = []
+	rows = []
+	while len(landmarks) < min(k, len(component)):
+		root = rng.choice(component)
+		dist, parent, order = one_to_all(graph, root, cost_func)
+		table = np.asarray(rows) if rows else np.zeros((0, len(graph)))
+		# how badly the current landmarks bound each distance from the root
+		weight = np.asarray(dist) - table_bounds(table, root)
+		size = [0.0] * len(graph)
+		has_landmark = [False] * len(graph)
+		for city in landmarks:
+			has_landmark[city] = True
+		# children are settled after their parent, so walk the settle order backwards
+		for city in reversed(order):
+			if not has_landmark[city]:
+				size[city] += weight[city]
+			else:
+				size[city] = 0.0
+			p = parent[city]
+			if p >= 0:
+				if has_landmark[city]:
+					has_landmark[p] = True
+				size[p] += size[city]
+		children = dict((city, []) for city in order)
+		for city in order:
+			if parent[city] >= 0:
+				children[parent[city]].append(city)
+		# descend along the heaviest subtree to a leaf
+		city = root
+		while children[city]:
+			nxt = max(children[city], key=lambda c: size[c])
+			if size[nxt] <= 0:
+				break
+			city = nxt
+		if city in landmarks:
+			city = max(component, key=lambda c: weight[c] if c not in landmarks else -1)
+		landmarks.append(city)
+		rows.append(np.asarray(one_to_all(graph, city, cost_func)[0]))
+	return landmarks, rows
+
+
+def build_landmarks(graph, cost_func, strategy=STRATEGIES[0], k=DEFAULT_LANDMARKS, seed=0):
+	select = select_farthest if strategy == 'farthest' else select_avoid
+	landmarks, rows = select(graph, cost_func, k, random.Random(seed))
+	table = np.asarray(rows, dtype=np.float64).reshape(len(rows), len(graph))
+	return [('landmarks', np.asarray(landmarks, dtype=np.int32)), ('table', table.ravel())]
+
+
+class LandmarkHeuristic:
+	def __init__(self, landmarks, table):
+		self.landmarks = landmarks.tolist()
+		self.table = table.reshape(len(self.landmarks), -1)
+
+	# lower bound on the cost from every city to target, as a list indexed by city id
+	def bounds_to(self, target):
+		return table_bounds(self.table, target).tolist()
+
+
+def load_landmarks(graph, cost_func, strategy=STRATEGIES[0], k=DEFAULT_LANDMARKS):
+	assert strategy in STRATEGIES, 'Landmark strategy %s not defined' % strategy
+	key = ('alt', cost_func, strategy, k)
+	if key not in graph.indexes:
+		_, arrays = load_index(graph, 'alt-%s-%s-%d' % (cost_func, strategy, k),
+			lambda: ({'cost_func': cost_func, 'strategy': strategy},
+				build_landmarks(graph, cost_func, strategy, k)))
+		graph.indexes[key] = LandmarkHeuristic(arrays['landmarks'], arrays['table'])
+	return graph.indexes[key]
+
+
+if __name__ == '__main__':
+	# preprocessing step: python landmarks.py [strategy [k]]
+	strategy = sys.argv[1] if len(sys.argv) > 1 else STRATEGIES[0]
+	k = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_LANDMARKS
+	graph = load_graph()
+	for cost_func in ['distance', 'time']:
+		alt = load_landmarks(graph, cost_func, strategy, k)
+		print('%s: %s' % (cost_func, ' '.join(graph.names[c] for c in alt.landmarks)))
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# overlay.py : Customizable Route Planning, a multilevel partition with per-metric overlays
+#
+# Preprocessing is split in two (Delling et al., "Customizable Route Planning"):
+#
+# Partition (metric-independent, once, stored as road-graph-crp-partition-*.bin): cities
+# are split recursively at the median of the widest axis of their unit vectors, like
+# the KD-tree in spatial.py, and every split range no larger than CELL_SIZES[l] that
+# was not already small enough one split earlier becomes a cell of level l + 1. Cells
+# of a level are unions of cells of the level below. Cities without coordinates get the
+# average position of their neighbors. A city is a boundary city of a level when one
+# of its roads leads into another cell of that level.
+#
+# Customization (per metric, any per-edge cost array): for every cell,
+# bottom-up, a clique of boundary-to-boundary costs, found by Dijkstra inside the cell
+# over the level below (roads for level 1, cliques and roads between cells above).
+# Clique edges that are never cheaper than going through another boundary city of the
+# cell are dropped, which leaves about a quarter of them. It takes about a second per
+# metric, against minutes for a contraction hierarchy, and needs no new partition.
+# The cliques of distance and time are stored as road-graph-crp-<sizes>-<cost>.bin on
+# first use; other metrics stay in memory:
+#
+#   crp = load_overlay(graph)
+#   crp.customize('time-55', capped_time(graph, 55))
+#   crp.query(start, end, 'time-55')
+#
+# Queries are bidirectional Dijkstra where each city uses the highest level at which
+# its cell holds neither end of the query: roads near the ends, cliques and the roads
+# between cells elsewhere. Clique edges are unpacked by a Dijkstra restricted to their
+# cell.
+
+import sys
+import time
+import random
+import numpy as np
+from heapq import heappush, heappop
+from road_graph import load_index, load_graph
+from spatial import unit_vectors
+
+INF = float('inf')
+
+# largest cell of every level, finest first
+CELL_SIZES = [128, 1024]
+
+
+# position of every city on the unit sphere; cities missing from city-gps.txt take the
+# average of their neighbors, repeatedly, and the rest (no located city reachable) 0,0
+def city_positions(graph):
+	lat, lon = graph.lat.copy(), graph.lon.copy()
+	offsets, targets = graph.offsets.tolist(), graph.targets.tolist()
+	missing = np.flatnonzero(np.isnan(lat)).tolist()
+	while missing:
+		left = []
+		for u in missing:
+			located = [v for v in targets[offsets[u]:offsets[u + 1]] if not np.isnan(lat[v])]
+			if located:
+				lat[u] = np.mean(lat[located])
+				lon[u] = np.mean(lon[located])
+			else:
+				left.append(u)
+		if len(left) == len(missing):
+			lat[left] = 0.0
+			lon[left] = 0.0
+			break
+		missing = left
+	return unit_vectors(lat, lon)
+
+
+# cell id of every city at every level, one int32 array per level
+def build_partition(graph, sizes=CELL_SIZES):
+	points = city_positions(graph)
+	order = np.arange(len(graph))
+	cells = [np.zeros(len(graph), dtype=np.int32) for _ in sizes]
+	counts = [0] * len(sizes)
+	ranges = [(0, len(graph), INF)]
+	while ranges:
+		lo, hi, parent_size = ranges.pop()
+		for level, size in enumerate(sizes):
+			if hi - lo <= size < parent_size:
+				cells[level][order[lo:hi]] = counts[level]
+				counts[level] += 1
+		if hi - lo <= sizes[0]:
+			continue
+		mid = (lo + hi) // 2
+		axis = int(np.argmax(np.ptp(points[lo:hi], axis=0)))
+		part = lo + np.argpartition(points[lo:hi, axis], mid - lo)
+		order[lo:hi] = order[part]
+		points[lo:hi] = points[part]
+		ranges.append((lo, mid, hi - lo))
+		ranges.append((mid, hi, hi - lo))
+	return cells
+
+
+# time with every speed limit capped at max_mph, a user-defined metric
+def capped_time(graph, max_mph):
+	return graph.length / np.minimum(graph.speed, max_mph)
+
+
+class Overlay:
+	# index_name, when given, names the stored cliques of the built-in cost functions,
+	# road-graph-<index_name>-<cost>.bin, see metric()
+	def __init__(self, graph, cells, index_name=None):
+		n = len(graph)
+		self.graph = graph
+		self.index_name = index_name
+		self.offsets = graph.offsets.tolist()
+		self.targets = graph.targets.tolist()
+		self.cells = [c.tolist() for c in cells]
+		# per level: cell -> its boundary cities
+		self.boundary = []
+		for cell in self.cells:
+			boundary = {}
+			for u in range(n):
+				for v in self.targets[self.offsets[u]:self.offsets[u + 1]]:
+					if cell[v] != cell[u]:
+						boundary.setdefault(cell[u], []).append(u)
+						break
+			self.boundary.append(boundary)
+		# metric name -> edges of every overlay level, see customize()
+		self.metrics = {}
+
+	@property
+	def levels(self):
+		return len(self.cells)
+
+	# cliques of every cell for one metric, finest level first, kept as the edges of every
+	# overlay level: level 0 is the road network, level l maps each of its boundary cities
+	# to (city, cost, l) for its clique edges plus (city, cost, 0) for roads leaving its cell.
+	# cliques, (sources, targets, costs) of the clique edges per level as returned before,
+	# skips the searches. Returns them as a list of (name, array) for load_index
+	def customize(self, name, weights, cliques=None):
+		weights = weights.tolist() if isinstance(weights, np.ndarray) else list(weights)
+		offsets, targets = self.offsets, self.targets
+		overlay = [[[(targets[e], weights[e], 0) for e in range(offsets[u], offsets[u + 1])]
+			for u in range(len(self.graph))]]
+		arrays = []
+		for level in range(1, self.levels + 1):
+			if cliques is not None:
+				sources, ends, costs = (a.tolist() for a in cliques[level - 1])
+			else:
+				sources, ends, costs = self._cliques(level, overlay[level - 1])
+			cell = self.cells[level - 1]
+			edges = dict((b, []) for members in self.boundary[level - 1].values() for b in members)
+			for u, v, cost in zip(sources, ends, costs):
+				edges[u].append((v, cost, level))
+			for b, out in edges.items():
+				out.extend(edge for edge in overlay[0][b] if cell[edge[0]] != cell[b])
+			overlay.append(edges)
+			arrays += [('clique%d_source' % level, np.asarray(sources, dtype=np.int32)),
+				('clique%d_target' % level, np.asarray(ends, dtype=np.int32)),
+				('clique%d_cost' % level, np.asarray(costs, dtype=np.float64))]
+		self.metrics[name] = overlay
+		return arrays
+
+	# (sources, targets, costs) of the clique edges of every cell of a level, found over the
+	# edges of the level below
+	def _cliques(self, level, below):
+		sources, ends, costs = [], [], []
+		for members in self.boundary[level - 1].values():
+			matrix = np.array([[dist.get(x, INF) for x in members]
+				for dist in [self._cell_search(b, level, below)[0] for b in members]])
+			# i-j is redundant if some k with both legs strictly cheaper is no more expensive
+			# in total; strictly cheaper legs keep zero-length roads from dropping both ways
+			redundant = np.zeros(matrix.shape, dtype=bool)
+			for k in range(len(members)):
+				first, second = matrix[:, k:k + 1], matrix[k:k + 1, :]
+				redundant |= (first + second <= matrix) & (first < matrix) & (second < matrix)
+			keep = ~redundant & np.isfinite(matrix)
+			np.fill_diagonal(keep, False)
+			for i, b in enumerate(members):
+				for j in np.flatnonzero(keep[i]).tolist():
+					sources.append(b)
+					ends.append(members[j])
+					costs.append(float(matrix[i, j]))
+		return sources, ends, costs
+
+	# the metric, customized from graph.weights() on first use for the built-in cost
+	# functions; with an index name their cliques are stored and memory-mapped like the
+	# other indexes, so only the first process pays for the customization
+	def metric(self, name):
+		if name not in self.metrics:
+			weights = self.graph.weights(name)
+			if self.index_name is None:
+				self.customize(name, weights)
+			else:
+				_, arrays = load_index(self.graph, '%s-%s' % (self.index_name, name),
+					lambda: ({'metric': name}, self.customize(name, weights)))
+				if name not in self.metrics:
+					self.customize(name, weights, [tuple(arrays['clique%d_%s' % (level, part)]
+						for part in ['source', 'target', 'cost']) for level in range(1, self.levels + 1)])
+		return self.metrics[name]
+
+	# Dijkstra from source inside its cell of the given level over the overlay edges of the
+	# level below, until target is settled if given; returns (costs, parents)
+	def _cell_search(self, source, level, edges, target=-1):
+		cell = self.cells[level - 1]
+		c = cell[source]
+		dist = {source: 0}
+		parent = {source: (-1, 0)}
+		fringe = [(0, source)]
+		while fringe:
+			d, city = heappop(fringe)
+			if city == target:
+				break
+			if d > dist[city]:
+				continue
+			for nxt, cost, via in edges[city]:
+				tmp = d + cost
+				if cell[nxt] == c and tmp < dist.get(nxt, INF):
+					dist[nxt] = tmp
+					parent[nxt] = (city, via)
+					heappush(fringe, (tmp, nxt))
+		return dist, parent
+
+	# bidirectional search over the overlay, returns (cost, city-id path) or (INF, None)
+	def query(self, start_city, end_city, name):
+		if start_city == end_city:
+			return 0, [start_city]
+		if not self.graph.connected(start_city, end_city):
+			return INF, None
+		overlay = self.metric(name)
+		cells = [(cell, cell[start_city], cell[end_city]) for cell in self.cells]
+		dist = ({start_city: 0}, {end_city: 0})
+		# city -> (previous city, clique level of the edge used, 0 for a road)
+		parent = ({start_city: (-1, 0)}, {end_city: (-1, 0)})
+		fringe = ([(0, start_city)], [(0, end_city)])
+		best = INF
+		meet = -1
+		# all roads run both ways, so the backward search uses the same edges
+		while fringe[0] and fringe[1] and fringe[0][0][0] + fringe[1][0][0] < best:
+			side = 0 if fringe[0][0][0] <= fringe[1][0][0] else 1
+			d, city = heappop(fringe[side])
+			own, other = dist[side], dist[1 - side]
+			if d > own[city]:
+				continue
+			# highest level at which the cell of city holds neither end
+			level = 0
+			for cell, s, t in cells:
+				if cell[city] == s or cell[city] == t:
+					break
+				level += 1
+			for nxt, cost, via in overlay[level][city]:
+				tmp = d + cost
+				if tmp < own.get(nxt, INF):
+					own[nxt] = tmp
+					parent[side][nxt] = (city, via)
+					heappush(fringe[side], (tmp, nxt))
+					if nxt in other and tmp + other[nxt] < best:
+						best = tmp + other[nxt]
+						meet = nxt
+
+		# hops as (from, to, clique level) from start to end
+		hops = []
+		city = meet
+		while parent[0][city][0] >= 0:
+			prev, via = parent[0][city]
+			hops.append((prev, city, via))
+			city = prev
+		hops.reverse()
+		city = meet
+		while parent[1][city][0] >= 0:
+			prev, via = parent[1][city]
+			hops.append((city, prev, via))
+			city = prev
+		path = [start_city]
+		for u, v, via in hops:
+			path.extend(self._unpack(u, v, via, overlay) if via else [v])
+		return best, path
+
+	# cities after u up to v along a clique edge of the given level: the route inside their
+	# cell over the level below, whose clique edges are unpacked in turn
+	def _unpack(self, u, v, level, overlay):
+		parent = self._cell_search(u, level, overlay[level - 1], v)[1]
+		hops = []
+		city = v
+		while city != u:
+			prev, via = parent[city]
+			hops.append((prev, city, via))
+			city = prev
+		path = []
+		for a, b, via in reversed(hops):
+			path.extend(self._unpack(a, b, via, overlay) if via else [b])
+		return path
+
+
+def load_overlay(graph, sizes=CELL_SIZES):
+	key = ('crp', tuple(sizes))
+	if key not in graph.indexes:
+		_, arrays = load_index(graph, 'crp-partition-%s' % '-'.join(str(s) for s in sizes),
+			lambda: ({'sizes': list(sizes)},
+				[('cell%d' % (level + 1), cell) for level, cell in enumerate(build_partition(graph, sizes))]))
+		graph.indexes[key] = Overlay(graph, [arrays['cell%d' % (level + 1)] for level in range(len(sizes))],
+			'crp-%s' % '-'.join(str(s) for s in sizes))
+	return graph.indexes[key]
+
+
+if __name__ == '__main__':
+	# python overlay.py [speed cap in mph] : partition size, customization times and query
+	# speed against UNIFORM, plus time with every speed limit capped as a new metric
+	from route import UNIFORM
+	cap = float(sys.argv[1]) if len(sys.argv) > 1 else 55
+	graph = load_graph()
+	start = time.time()
+	crp = load_overlay(graph)
+	print('partition: %s cells, %s boundary cities, %.2fs' % ([len(set(c)) for c in crp.cells],
+		[sum(len(b) for b in boundary.values()) for boundary in crp.boundary], time.time() - start))
+	name = 'time-%g' % cap
+	for metric, weights in [('distance', graph.length), ('time', graph.time), (name, capped_time(graph, cap))]:
+		start = time.time()
+		crp.customize(metric, weights)
+		print('customize %s: %.2fs' % (metric, time.time() - start))
+	rng = random.Random(0)
+	pairs = [(rng.randrange(len(graph)), rng.randrange(len(graph))) for _ in range(100)]
+	pairs = [(s, t) for s, t in pairs if graph.connected(s, t)]
+	for label, run in [('uniform time', lambda s, t: UNIFORM(graph, s, t, 'time')),
+			('crp time', lambda s, t: crp.query(s, t, 'time')), ('crp ' + name, lambda s, t: crp.query(s, t, name))]:
+		start = time.time()
+		for s, t in pairs:
+			run(s, t)
+		print('%s: %.2f ms per query' % (label, (time.time() - start) * 1000 / len(pairs)))
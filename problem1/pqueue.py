@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# pqueue.py : Priority queues over integer city ids for UNIFORM and ASTAR
+#
+# The default 'heap' queue is heapq with lazy deletion, inlined in route.py: an improved
+# key is pushed as a new entry and stale entries are skipped on pop, so the heap can
+# hold several entries per city. 'dial', also inlined there, is Dial's bucket queue:
+# one bucket per integer key and a cursor that only moves up, O(1) push and amortized
+# O(1) pop. It needs integer keys that never drop below the last key popped, i.e.
+# UNIFORM on road lengths (integer miles) or ASTAR with landmark bounds on them, and
+# lazy deletion like the heap. The queues here are the selectable alternatives and
+# share one interface: push(city, key) inserts a city or lowers its key, pop() returns
+# the (key, city) with the smallest key, and len()/bool() count cities still waiting.
+# peak and pushes record the largest size and the number of pushes.
+#
+#   indexed : binary heap with a position map, an improved key is a decrease-key in
+#             place so the heap never holds more than one entry per city (O(V) memory)
+
+import sys
+import time
+import random
+
+INF = float('inf')
+
+
+class IndexedHeap:
+	def __init__(self, size):
+		self.heap = []
+		self.key = [INF] * size
+		# index of every city in heap, -1 when not queued
+		self.pos = [-1] * size
+		self.peak = 0
+		self.pushes = 0
+
+	def __len__(self):
+		return len(self.heap)
+
+	def push(self, city, key):
+		self.pushes += 1
+		heap, pos = self.heap, self.pos
+		self.key[city] = key
+		if pos[city] < 0:
+			pos[city] = len(heap)
+			heap.append(city)
+			if len(heap) > self.peak:
+				self.peak = len(heap)
+		self._sift_up(pos[city])
+
+	def pop(self):
+		heap, pos = self.heap, self.pos
+		city = heap[0]
+		last = heap.pop()
+		pos[city] = -1
+		if heap:
+			heap[0] = last
+			pos[last] = 0
+			self._sift_down(0)
+		return self.key[city], city
+
+	def _sift_up(self, i):
+		heap, pos, key = self.heap, self.pos, self.key
+		city = heap[i]
+		k = key[city]
+		while i > 0:
+			parent = (i - 1) >> 1
+			above = heap[parent]
+			if key[above] <= k:
+				break
+			heap[i] = above
+			pos[above] = i
+			i = parent
+		heap[i] = city
+		pos[city] = i
+
+	def _sift_down(self, i):
+		heap, pos, key = self.heap, self.pos, self.key
+		n = len(heap)
+		city = heap[i]
+		k = key[city]
+		while True:
+			child = 2 * i + 1
+			if child >= n:
+				break
+			if child + 1 < n and key[heap[child + 1]] < key[heap[child]]:
+				child += 1
+			below = heap[child]
+			if key[below] >= k:
+				break
+			heap[i] = below
+			pos[below] = i
+			i = child
+		heap[i] = city
+		pos[city] = i
+
+
+QUEUES = {'indexed': IndexedHeap}
+QUEUE_NAMES = ['heap', 'dial'] + sorted(QUEUES)
+# queues limited to integer keys
+INTEGER_QUEUES = ['dial']
+
+
+def make_queue(name, size):
+	assert name in QUEUES, 'Priority queue %s not defined' % name
+	return QUEUES[name](size)
+
+
+# run the same random queries with every queue, report runtime and heap sizes;
+# integer-key queues only run UNIFORM on distance
+def benchmark_queues(graph, queries=200, seed=0, algorithms=('uniform', 'astar'), queues=None):
+	from route import UNIFORM, ASTAR
+	from search_stats import SearchStats
+	rng = random.Random(seed)
+	pairs = [(rng.randrange(len(graph)), rng.randrange(len(graph))) for _ in range(queries)]
+	results = []
+	for alg in algorithms:
+		for cost_func in ['distance', 'time']:
+			for name in queues or QUEUE_NAMES:
+				if name in INTEGER_QUEUES and (alg, cost_func) != ('uniform', 'distance'):
+					continue
+				stats = SearchStats()
+				start = time.time()
+				for s, t in pairs:
+					if alg == 'uniform':
+						UNIFORM(graph, s, t, cost_func, queue=name, stats=stats)
+					else:
+						ASTAR(graph, s, t, cost_func, queue=name, stats=stats)
+				results.append({'algorithm': alg, 'cost': cost_func, 'queue': name,
+					'seconds': time.time() - start, 'peak': stats.peak, 'pushes': stats.pushes})
+	return results
+
+
+if __name__ == '__main__':
+	# python pqueue.py [queries]
+	from road_graph import load_graph
+	queries = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+	print('algorithm cost     queue    seconds  max_heap  pushes')
+	for r in benchmark_queues(load_graph(), queries):
+		print('%-9s %-8s %-8s %7.3f %9d %7d' % (r['algorithm'], r['cost'], r['queue'],
+			r['seconds'], r['peak'], r['pushes']))
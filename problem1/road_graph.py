@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# road_graph.py : Compact array-backed (CSR) representation of the road network
+#
+# Cities are interned to integer ids in first-seen order (city-gps.txt first, then
+# road-segments.txt). The adjacency of city u is the slice offsets[u]:offsets[u+1]
+# of the targets/length/speed/time/highway arrays; every road is stored once per
+# direction since all roads are bidirectional.
+#
+# Parsing the text files dominates start-up, so load_graph() compiles them once into
+# a versioned binary cache next to the data (road-graph.bin) and memory-maps that on
+# later runs. The cache records size, mtime and sha1 of both source files and is
+# rebuilt automatically when they change. It also stores the connected component of
+# every city, so a query between two components needs no search at all.
+
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import threading
+import numpy as np
+
+# speed limit used when the field is missing or bogus in road-segments.txt
+DEFAULT_SPEED = 45.0
+
+COST_FUNCTIONS = ['segments', 'distance', 'time']
+
+# mean earth radius used by geopy's great_circle, in miles
+EARTH_RADIUS_MILES = 6371.009 / 1.609344
+
+CACHE_NAME = 'road-graph.bin'
+CACHE_MAGIC = b'RGRAPH\0\0'
+CACHE_VERSION = 2
+SOURCE_FILES = ['city-gps.txt', 'road-segments.txt']
+# arrays stored in the cache, in file order
+CACHE_ARRAYS = ['offsets', 'targets', 'length', 'speed', 'time', 'highway', 'lat', 'lon', 'component']
+
+
+# component id of every city over the undirected CSR arrays, numbered in order of
+# the lowest city id in each component
+def connected_components(offsets, targets):
+	n = len(offsets) - 1
+	offsets = offsets.tolist()
+	targets = targets.tolist()
+	component = [-1] * n
+	count = 0
+	for seed in range(n):
+		if component[seed] >= 0:
+			continue
+		component[seed] = count
+		stack = [seed]
+		while stack:
+			city = stack.pop()
+			for e in range(offsets[city], offsets[city + 1]):
+				nxt = targets[e]
+				if component[nxt] < 0:
+					component[nxt] = count
+					stack.append(nxt)
+		count += 1
+	return np.asarray(component, dtype=np.int32)
+
+
+class RoadGraph:
+	def __init__(self, names, offsets, targets, length, speed, highway, highway_names, lat, lon, time=None,
+			component=None):
+		self.names = names
+		self.ids = dict((name, i) for i, name in enumerate(names))
+		self.offsets = offsets
+		self.targets = targets
+		self.length = length
+		self.speed = speed
+		self.time = length / speed if time is None else time
+		self.highway = highway
+		self.highway_names = highway_names
+		# NaN where the city has no line in city-gps.txt
+		self.lat = lat
+		self.lon = lon
+		self.lat_rad = np.radians(lat)
+		self.lon_rad = np.radians(lon)
+		self.max_speed = float(speed.max()) if len(speed) else DEFAULT_SPEED
+		self.component = connected_components(offsets, targets) if component is None else component
+		# set by load_graph(), derived indexes are persisted next to the data files
+		self.data_dir = None
+		self.source = None
+		self.indexes = {}
+		# held while load_index builds, so server threads build each index once
+		self.index_lock = threading.RLock()
+		self._adjacency = {}
+
+	@classmethod
+	def from_files(cls, gps_path, segments_path):
+		names = []
+		ids = {}
+
+		def intern(name):
+			i = ids.get(name)
+			if i is None:
+				i = ids[name] = len(names)
+				names.append(name)
+			return i
+
+		coords = {}
+		with open(gps_path, 'r') as city_gps_f:
+			for line in city_gps_f:
+				a = line.replace('\n', '').split(" ")
+				if len(a) < 3:
+					continue
+				coords[intern(a[0])] = (float(a[1]), float(a[2]))
+
+		src = []
+		dst = []
+		length = []
+		speed = []
+		highway = []
+		highway_ids = {}
+		highway_names = []
+		with open(segments_path, 'r') as road_seg_f:
+			for line in road_seg_f:
+				a = line.replace('\n', '').split(" ")
+				if len(a) < 3:
+					continue
+				# missing speed limits show up as '' or '0'
+				spd = float(a[3]) if len(a) > 3 and len(a[3]) >= 2 else DEFAULT_SPEED
+				hw_name = a[4] if len(a) > 4 else ''
+				hw = highway_ids.get(hw_name)
+				if hw is None:
+					hw = highway_ids[hw_name] = len(highway_names)
+					highway_names.append(hw_name)
+				u = intern(a[0])
+				v = intern(a[1])
+				src.append(u)
+				dst.append(v)
+				length.append(float(a[2]))
+				speed.append(spd)
+				highway.append(hw)
+
+		n = len(names)
+		lat = np.full(n, np.nan)
+		lon = np.full(n, np.nan)
+		for i, (la, lo) in coords.items():
+			lat[i] = la
+			lon[i] = lo
+
+		return cls.from_segments(names, src, dst, length, speed, highway, highway_names, lat, lon)
+
+	# build the CSR arrays from an undirected segment list
+	@classmethod
+	def from_segments(cls, names, src, dst, length, speed, highway, highway_names, lat, lon):
+		n = len(names)
+		src = np.asarray(src, dtype=np.int32)
+		dst = np.asarray(dst, dtype=np.int32)
+		length = np.asarray(length, dtype=np.float64)
+		speed = np.asarray(speed, dtype=np.float64)
+		highway = np.asarray(highway, dtype=np.int32)
+
+		# both directions, stable-sorted by source so each city keeps file order
+		tail = np.concatenate([src, dst])
+		head = np.concatenate([dst, src])
+		order = np.argsort(tail, kind='stable')
+		counts = np.bincount(tail, minlength=n)
+		offsets = np.zeros(n + 1, dtype=np.int64)
+		np.cumsum(counts, out=offsets[1:])
+		return cls(names, offsets, head[order],
+			np.concatenate([length, length])[order],
+			np.concatenate([speed, speed])[order],
+			np.concatenate([highway, highway])[order],
+			highway_names,
+			np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64))
+
+	def __len__(self):
+		return len(self.names)
+
+	@property
+	def num_edges(self):
+		return len(self.targets)
+
+	# identifies the source data, '' when the graph was not loaded from files
+	@property
+	def version(self):
+		if not self.source:
+			return ''
+		return ','.join(self.source[name]['sha1'] for name in SOURCE_FILES if name in self.source)
+
+	def city_id(self, name):
+		if name not in self.ids:
+			raise KeyError('City %s not found in road network' % name)
+		return self.ids[name]
+
+	# False when no road path joins u and v
+	def connected(self, u, v):
+		return self.component[u] == self.component[v]
+
+	def has_gps(self, u):
+		return not np.isnan(self.lat[u])
+
+	# great-circle miles from every city to target in one haversine pass, NaN without gps
+	def great_circle_to(self, target):
+		lat_t = self.lat_rad[target]
+		a = np.sin((self.lat_rad - lat_t) / 2) ** 2 + \
+			np.cos(self.lat_rad) * np.cos(lat_t) * np.sin((self.lon_rad - self.lon_rad[target]) / 2) ** 2
+		return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+	def weights(self, cost_func):
+		if cost_func == 'segments':
+			return np.ones(len(self.targets))
+		elif cost_func == 'distance':
+			return self.length
+		elif cost_func == 'time':
+			return self.time
+		raise ValueError('Routing option %s not defined' % cost_func)
+
+	# plain-list copies of the CSR arrays, the fastest thing to index from a python loop
+	def adjacency(self, cost_func):
+		if cost_func not in self._adjacency:
+			self._adjacency[cost_func] = (self.offsets.tolist(), self.targets.tolist(),
+				self.weights(cost_func).tolist())
+		return self._adjacency[cost_func]
+
+	# index of the cheapest edge u->v under cost_func, None if they are not adjacent
+	def edge_between(self, u, v, cost_func='distance'):
+		lo, hi = int(self.offsets[u]), int(self.offsets[u + 1])
+		w = self.weights(cost_func)
+		best = None
+		for e in range(lo, hi):
+			if self.targets[e] == v and (best is None or w[e] < w[best]):
+				best = e
+		return best
+
+	# total distance and time along a city-id path
+	def path_totals(self, path, cost_func='distance'):
+		total_distance = 0.0
+		total_time = 0.0
+		for u, v in zip(path, path[1:]):
+			e = self.edge_between(u, v, cost_func)
+			total_distance += float(self.length[e])
+			total_time += float(self.time[e])
+		return total_distance, total_time
+
+
+def _file_sha1(path):
+	h = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			h.update(block)
+	return h.hexdigest()
+
+
+# size/mtime/sha1 of every source file, used to invalidate the cache
+def source_signature(data_dir):
+	sig = {}
+	for name in SOURCE_FILES:
+		st = os.stat(os.path.join(data_dir, name))
+		sig[name] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+			'sha1': _file_sha1(os.path.join(data_dir, name))}
+	return sig
+
+
+def _signature_matches(stored, data_dir):
+	for name in SOURCE_FILES:
+		path = os.path.join(data_dir, name)
+		if name not in stored or not os.path.exists(path):
+			return False
+		st = os.stat(path)
+		if st.st_size != stored[name]['size']:
+			return False
+		# a touched but unchanged file keeps the cache valid
+		if st.st_mtime_ns != stored[name]['mtime_ns'] and _file_sha1(path) != stored[name]['sha1']:
+			return False
+	return True
+
+
+def _align(n):
+	return (n + 7) & ~7
+
+
+# layout: magic, uint32 version, uint32 header length, json header, 8-byte aligned arrays.
+# Used for the graph itself and for every index derived from it.
+def write_array_file(path, arrays, meta):
+	arrays = [(name, np.ascontiguousarray(arr)) for name, arr in arrays]
+	header = dict(meta)
+	header['arrays'] = []
+	pos = 0
+	for name, arr in arrays:
+		header['arrays'].append({'name': name, 'dtype': arr.dtype.str, 'count': len(arr), 'offset': pos})
+		pos = _align(pos + arr.nbytes)
+	blob = json.dumps(header).encode('utf-8')
+	start = _align(len(CACHE_MAGIC) + 8 + len(blob))
+
+	# write to a temp file and rename so a concurrent reader never sees half a cache;
+	# one temp file per process and thread
+	tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+	with open(tmp_path, 'wb') as f:
+		f.write(CACHE_MAGIC)
+		f.write(struct.pack('<II', CACHE_VERSION, len(blob)))
+		f.write(blob)
+		for info, (_, arr) in zip(header['arrays'], arrays):
+			f.seek(start + info['offset'])
+			f.write(arr.tobytes())
+		f.truncate(start + pos)
+	os.replace(tmp_path, path)
+
+
+def _read_cache_header(f):
+	if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+		return None
+	version, blob_len = struct.unpack('<II', f.read(8))
+	if version != CACHE_VERSION:
+		return None
+	header = json.loads(f.read(blob_len).decode('utf-8'))
+	header['start'] = _align(len(CACHE_MAGIC) + 8 + blob_len)
+	return header
+
+
+# memory-map an array file, arrays are read-only views into the mapping
+def read_array_file(path):
+	with open(path, 'rb') as f:
+		header = _read_cache_header(f)
+		if header is None:
+			return None, None
+		buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	arrays = {}
+	for info in header['arrays']:
+		arrays[info['name']] = np.frombuffer(buf, dtype=np.dtype(info['dtype']),
+			count=info['count'], offset=header['start'] + info['offset'])
+	return header, arrays
+
+
+def save_graph(graph, path, signature=None):
+	write_array_file(path, [(name, getattr(graph, name)) for name in CACHE_ARRAYS],
+		{'kind': 'graph', 'names': graph.names, 'highway_names': graph.highway_names,
+		'source': signature or {}})
+
+
+def open_graph(path):
+	header, arrays = read_array_file(path)
+	if header is None:
+		return None
+	graph = RoadGraph(header['names'], arrays['offsets'], arrays['targets'], arrays['length'],
+		arrays['speed'], arrays['highway'], header['highway_names'], arrays['lat'], arrays['lon'],
+		time=arrays['time'], component=arrays['component'])
+	graph.source = header['source']
+	return graph
+
+
+def cache_is_fresh(cache_path, data_dir):
+	try:
+		with open(cache_path, 'rb') as f:
+			header = _read_cache_header(f)
+	except (IOError, OSError, ValueError, struct.error):
+		return False
+	return header is not None and _signature_matches(header['source'], data_dir)
+
+
+def build_cache(data_dir=None, cache_path=None):
+	if data_dir is None:
+		data_dir = os.path.dirname(os.path.abspath(__file__))
+	if cache_path is None:
+		cache_path = os.path.join(data_dir, CACHE_NAME)
+	signature = source_signature(data_dir)
+	graph = RoadGraph.from_files(os.path.join(data_dir, 'city-gps.txt'),
+		os.path.join(data_dir, 'road-segments.txt'))
+	save_graph(graph, cache_path, signature)
+	graph.source = signature
+	return graph
+
+
+def load_graph(data_dir=None, use_cache=True):
+	if data_dir is None:
+		data_dir = os.path.dirname(os.path.abspath(__file__))
+	if not use_cache:
+		return RoadGraph.from_files(os.path.join(data_dir, 'city-gps.txt'),
+			os.path.join(data_dir, 'road-segments.txt'))
+
+	cache_path = os.path.join(data_dir, CACHE_NAME)
+	graph = None
+	if cache_is_fresh(cache_path, data_dir):
+		graph = open_graph(cache_path)
+	if graph is None:
+		try:
+			graph = build_cache(data_dir, cache_path)
+		except (IOError, OSError):
+			# read-only data directory, fall back to parsing every time
+			return load_graph(data_dir, use_cache=False)
+	graph.data_dir = data_dir
+	return graph
+
+
+# Load (or build and persist) an index derived from the graph, such as a contraction
+# hierarchy. build() returns (meta, arrays) where arrays is a list of (name, ndarray);
+# the result is memoized on the graph and returned as (meta, {name: ndarray}).
+# Concurrent callers wait for the first one instead of building the index again.
+def load_index(graph, name, build):
+	if name in graph.indexes:
+		return graph.indexes[name]
+	with graph.index_lock:
+		if name not in graph.indexes:
+			graph.indexes[name] = _load_index(graph, name, build)
+	return graph.indexes[name]
+
+
+def _load_index(graph, name, build):
+	path = None
+	if graph.data_dir is not None:
+		path = os.path.join(graph.data_dir, 'road-graph-%s.bin' % name)
+	result = None
+	if path is not None and cache_is_fresh(path, graph.data_dir):
+		result = read_array_file(path)
+	if result is None or result[0] is None:
+		meta, arrays = build()
+		result = (meta, dict(arrays))
+		if path is not None:
+			try:
+				meta = dict(meta, kind=name, source=source_signature(graph.data_dir))
+				write_array_file(path, arrays, meta)
+			except (IOError, OSError):
+				pass
+	return result
+
+
+if __name__ == '__main__':
+	# one-time compile step: python road_graph.py [data_dir]
+	data_dir = sys.argv[1] if len(sys.argv) > 1 else None
+	graph = build_cache(data_dir)
+	print('%d cities, %d directed edges' % (len(graph), graph.num_edges))
@@ -1,8 +1,9 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Problem 1 Author: Xing Liu
-# Comments: Folder 'geopy' inside problem 1 is the library for calculating great-circle distance, 
-# I found that the department linux server does not have this library installed so I included it. 
+# Comments: great-circle distances come from RoadGraph.great_circle_to (road_graph.py), one
+# vectorized haversine pass from every city to the goal per query. The 'geopy' folder
+# inside problem 1 is only used by the tests now, as a reference for those distances.
 # Thanks Chris and Johny for providing a rough code structure, although I decided to start everything 
 # from scratch later on but I would like to mention their efforts on problem 1.
 
@@ -10,31 +11,12 @@
 # the BFS/UNIFORM/ASTAR are equally good, for routing option requiring minimal total distance and
 # time consuming, the UNIFORM/ASTAR are equally good.
 
-# (2) Testing city pair: Bloomington,_Indiana Chicago,_Illinois
-# algorithm cost_function running_time
-#    BFS        N/A            0.294
-#    DFS        N/A            0.951
-#  UNIFORM    segments         0.294
-#  UNIFORM    distance         0.314
-#  UNIFORM      time           0.317
-#    ASTAR    segments         0.299
-#    ASTAR    distance         0.290
-#    ASTAR      time           0.298
-
-# Testing city pair: Columbus,_Ohio Chicago,_Illinois
-# algorithm cost_function running_time
-#    BFS        N/A            0.317
-#    DFS        N/A            0.910
-#  UNIFORM    segments         0.310
-#  UNIFORM    distance         0.380
-#  UNIFORM      time           0.400
-#    ASTAR    segments         0.309
-#    ASTAR    distance         0.297
-#    ASTAR      time           0.327
-
+# (2) Running times: benchmark_route.py times every algorithm / cost function / heuristic
+# on seeded random city pairs (the two pairs first timed here, Bloomington,_Indiana and
+# Columbus,_Ohio to Chicago,_Illinois, included) and compares them against the baseline
+# checked in as benchmark-baseline.json:
 #
-# Comparing BFS and DFS, BFS only requires 31% of the running time that DFS takes.
-# Comparing UNIFORM and ASTAR, on average ASTAR is faster, and on average it only requires 78% of the running time that UNIFORM takes.
+#   python benchmark_route.py --baseline
 
 # (4) For distance the heuristic function I am using is the great circle distance given longitude and latitude of the two city,
 # this heuristic function is admissible and consistent, it's working good and can find the routing solution with minimal distance, 
@@ -46,241 +28,1195 @@
 # also it will be helpful to take different speed limit into consideration since short path with low speed limit might still take 
 # longer time to travel. 
 
+import os
 import sys
+import json
+import stat
+import time
+import socket
+import argparse
+import socketserver
+import multiprocessing
 import numpy as np
-import copy
-from heapq import heappush, heappop 
-from geopy.distance import great_circle
-
-
-def succ_paths(path):
-	succ = []
-	for s in segments_hash_table[path[-1]]:
-		# avoid revisit
-		if s[0] not in visited_city:
-			tmp = copy.deepcopy(path)
-			tmp.append(s[0])
-			succ.append(tmp)
-			visited_city[s[0]] = 1
-	return succ
-
-def succ_paths_uniform(path, cost_func):
-	succ = []
-	for s in segments_hash_table[path[-1]]:
-		tmp = copy.deepcopy(path)
-		tmp.append(s[0])
-		# update path cost information
-		if cost_func == 'distance':
-			tmp[0] += float(s[1])
-		elif cost_func == 'time':
-			tmp[0] += float(s[1])/float(s[2])
-		# append to path successor, only allow revisit if it decreases the cost
-		if s[0] not in minnow_hash_table:
-			minnow_hash_table[s[0]] = tmp[0]
-			succ.append(tmp)
-		elif s[0] in minnow_hash_table and tmp[0] < minnow_hash_table[s[0]]:
-			minnow_hash_table[s[0]] = tmp[0]
-			succ.append(tmp)
-		
-	return succ
-
-
-def succ_paths_astar(path, cost_func, end_city):
-	succ = []
-	for s in segments_hash_table[path[-1]]:
-		tmp = copy.deepcopy(path)
-		tmp.append(s[0])
-		# update g(s) h(s) information
-		if cost_func == 'distance':
-			tmp[1] += float(s[1])
-			distance_count(tmp, end_city)
-			tmp[0] = tmp[1] + tmp[2]
-		elif cost_func == 'time':
-			tmp[1] += float(s[1])/float(s[2])
-			time_count(tmp, end_city)
-			tmp[0] = tmp[1] + tmp[2]
-		# append to path successor, only allow revisit if it decreases the cost
-		if s[0] not in minnow_hash_table:
-			minnow_hash_table[s[0]] = tmp[0]
-			succ.append(tmp)
-		elif s[0] in minnow_hash_table and tmp[0] < minnow_hash_table[s[0]]:
-			minnow_hash_table[s[0]] = tmp[0]
-			succ.append(tmp)
-	return succ
-
-
-def distance_count(path, end_city):
-	# error handle, city not found in gps database
-	if path[-1] not in gps_hash_table or path[-2] not in gps_hash_table:
-		return
-	# calculate direct distrance in miles
-	pos1 = tuple(gps_hash_table[path[-1]])
-	pos2 = tuple(gps_hash_table[end_city])
-	path[2] = great_circle(pos1, pos2).miles
+from heapq import heappush, heappop, heapify
+from road_graph import load_graph
+from contraction import load_hierarchy
+from landmarks import load_landmarks
+from pqueue import make_queue, QUEUE_NAMES
+from route_cache import RouteCache, DEFAULT_CACHE_SIZE
+from search_stats import SearchStats
+from spatial import load_spatial_index, snap
+from chains import load_chains
+from overlay import load_overlay
+from hub_labels import load_hub_labels
+from arc_flags import load_arc_flags
+from tour import plan_tour
+from tree_cache import TreeCache, DEFAULT_TREE_CACHE_MB
+
+INF = float('inf')
+
+ROUTE_ALGORITHMS = ['bfs', 'uniform', 'dfs', 'astar', 'bidirectional-uniform', 'bidirectional-astar', 'ch',
+	'anytime-astar', 'crp']
+COST_FUNCTIONS = ['segments', 'distance', 'time']
+# great-circle distance (divided by the top speed for time) or landmark bounds
+HEURISTICS = ['gps', 'alt']
+# lower bounds on the true cost, the only ones a suboptimality bound can be proven with;
+# the great-circle heuristic overestimates on roads with bad coordinates or mileage
+ADMISSIBLE_HEURISTICS = ['alt']
+
+# anytime-astar: first weight, how much it drops per round and the default time budget
+ANYTIME_EPSILON = 2.0
+ANYTIME_STEP = 0.5
+ANYTIME_DEADLINE = 0.02
+
+
+# heuristic used when none is given: landmark bounds where a suboptimality bound is
+# reported (anytime-astar and weighted astar) and for bidirectional-astar, whose stopping
+# rule needs a consistent potential; the great-circle distance elsewhere
+def default_heuristic(route_alg, epsilon=None):
+	if route_alg in ['anytime-astar', 'bidirectional-astar'] or (route_alg == 'astar' and epsilon is not None and epsilon != 1):
+		return 'alt'
+	return 'gps'
 
 
-def time_count(path, end_city):
+# walk the parent pointers back from the goal, only done once per search
+def rebuild_path(parent, end_city):
+	path = [end_city]
+	while parent[path[-1]] >= 0:
+		path.append(parent[path[-1]])
+	path.reverse()
+	return path
+
+
+# direct distance in miles from every city to end_city, computed once per query
+def distance_count(graph, end_city):
+	miles = graph.great_circle_to(end_city)
 	# error handle, city not found in gps database
-	if path[-1] not in gps_hash_table or path[-2] not in gps_hash_table:
-		return
-	# calculate direct distrance in miles
-	pos1 = tuple(gps_hash_table[path[-1]])
-	pos2 = tuple(gps_hash_table[end_city])
-	path[2] = great_circle(pos1, pos2).miles/max_speed_lim
+	miles[np.isnan(miles)] = 0
+	return miles
 
 
-# use priority queue
-def ASTAR(start_city, end_city, cost_func):
-	fringe = []
-	# first value is g(s) + h(s), 2nd value is g(s), 3rd value is h(s)
-	heappush(fringe, [0, 0, 0, start_city])
+def time_count(graph, end_city):
+	return distance_count(graph, end_city)/graph.max_speed
 
-	minnow_hash_table[start_city] = 0;
 
-	while len(fringe) > 0:
-		path = heappop(fringe)
-		for s in succ_paths_astar(path, cost_func, end_city):
-			if s[-1] == end_city:
-				return s
-			heappush(fringe, s)
+# h(city) towards end_city for every city, read by city id
+def destination_heuristic(graph, end_city, cost_func, heuristic='gps'):
+	assert heuristic in HEURISTICS, 'Heuristic %s not defined'%heuristic
+	if heuristic == 'alt':
+		return load_landmarks(graph, cost_func).bounds_to(end_city)
+	if cost_func == 'distance':
+		return distance_count(graph, end_city).tolist()
+	return time_count(graph, end_city).tolist()
 
 
-# use priority queue
-def UNIFORM(start_city, end_city, cost_func):
-	fringe = []
-	heappush(fringe, [0, start_city])
+# best-first search shared by UNIFORM (h = 0) and ASTAR, ordered by g(s) + h(s).
+# 'heap' (heapq) and 'dial' (integer buckets, integer costs and h only) use lazy
+# deletion and are inlined here; other queues come from pqueue.py and lower a queued
+# city's key in place. Counters go to stats (a SearchStats) if given. adjacency replaces
+# graph.adjacency(cost_func), e.g. with the edges arc-flagged for end_city's region.
+def best_first(graph, start_city, end_city, cost_func, h, queue='heap', stats=None, adjacency=None):
+	if not graph.connected(start_city, end_city):
+		return None
+	offsets, targets, weights = adjacency or graph.adjacency(cost_func)
+	parent = [-1] * len(graph)
+	g_value = [INF] * len(graph)
+	g_value[start_city] = 0
+	# expanded cities, cleared again when a cheaper path reopens them
+	closed = bytearray(len(graph))
+	path = None
+	generated = reopened = 0
 
-	minnow_hash_table[start_city] = 0;
+	if queue == 'heap':
+		fringe = [(h[start_city], 0, start_city)]
+		pops = stale = peak = 0
+		while fringe:
+			# the heap only grows while a city is expanded, so this catches the peak
+			if len(fringe) > peak:
+				peak = len(fringe)
+			_, g, city = heappop(fringe)
+			pops += 1
+			# stale entry, the city was reached more cheaply since it was pushed
+			if g > g_value[city]:
+				stale += 1
+				continue
+			if city == end_city:
+				path = rebuild_path(parent, end_city)
+				break
+			closed[city] = 1
+			generated += offsets[city + 1] - offsets[city]
+			for e in range(offsets[city], offsets[city + 1]):
+				nxt = targets[e]
+				tmp = g + weights[e]
+				# only allow revisit if it decreases the cost
+				if tmp < g_value[nxt]:
+					if closed[nxt]:
+						closed[nxt] = 0
+						reopened += 1
+					g_value[nxt] = tmp
+					parent[nxt] = city
+					heappush(fringe, (tmp + h[nxt], tmp, nxt))
+		if stats is not None:
+			stats.add(expanded=pops - stale, generated=generated, pushes=pops + len(fringe),
+				reopened=reopened, peak=peak)
+		return path
 
-	while len(fringe) > 0:
-		path = heappop(fringe)
-		for s in succ_paths_uniform(path, cost_func):
-			if s[-1] == end_city:
-				return s
-			heappush(fringe, s)
+	if queue == 'dial':
+		# buckets[k] holds the cities pushed with g + h = k, stale entries included
+		cursor = int(h[start_city])
+		if cursor != h[start_city]:
+			raise ValueError('Priority queue dial needs integer keys, got %r' % h[start_city])
+		buckets = [[] for _ in range(cursor + 1)]
+		buckets[cursor].append(start_city)
+		waiting = 1
+		pops = stale = peak = 0
+		while waiting and path is None:
+			bucket = buckets[cursor]
+			while bucket:
+				if waiting > peak:
+					peak = waiting
+				city = bucket.pop()
+				waiting -= 1
+				pops += 1
+				g = g_value[city]
+				# lowered into an earlier bucket since this entry was pushed
+				if g + h[city] != cursor:
+					stale += 1
+					continue
+				if city == end_city:
+					path = rebuild_path(parent, end_city)
+					break
+				closed[city] = 1
+				generated += offsets[city + 1] - offsets[city]
+				for e in range(offsets[city], offsets[city + 1]):
+					nxt = targets[e]
+					tmp = g + weights[e]
+					if tmp < g_value[nxt]:
+						f = tmp + h[nxt]
+						k = int(f)
+						if k != f or k < cursor:
+							raise ValueError('Priority queue dial needs integer keys no smaller than the last one popped, got %r' % f)
+						if closed[nxt]:
+							closed[nxt] = 0
+							reopened += 1
+						g_value[nxt] = tmp
+						parent[nxt] = city
+						while len(buckets) <= k:
+							buckets.append([])
+						buckets[k].append(nxt)
+						waiting += 1
+			cursor += 1
+		if stats is not None:
+			stats.add(expanded=pops - stale, generated=generated, pushes=pops + waiting,
+				reopened=reopened, peak=peak)
+		return path
 
+	fringe = make_queue(queue, len(graph))
+	fringe.push(start_city, h[start_city])
+	expanded = 0
+	while fringe:
+		_, city = fringe.pop()
+		expanded += 1
+		if city == end_city:
+			path = rebuild_path(parent, end_city)
+			break
+		closed[city] = 1
+		generated += offsets[city + 1] - offsets[city]
+		g = g_value[city]
+		for e in range(offsets[city], offsets[city + 1]):
+			nxt = targets[e]
+			tmp = g + weights[e]
+			if tmp < g_value[nxt]:
+				if closed[nxt]:
+					closed[nxt] = 0
+					reopened += 1
+				g_value[nxt] = tmp
+				parent[nxt] = city
+				fringe.push(nxt, tmp + h[nxt])
+	if stats is not None:
+		stats.add(expanded=expanded, generated=generated, pushes=fringe.pushes,
+			reopened=reopened, peak=fringe.peak)
+	return path
 
-# use FIFO queue
-def BFS(start_city, end_city):
-	visited_city[start_city] = 1
-	fringe = [[start_city]]
-	while len(fringe) > 0:
-		path = fringe.pop(0)
-		for s in succ_paths(path):
-			if s[-1] == end_city:
-				return s
-			fringe.append(s)
 
+# use priority queue; epsilon > 1 is weighted A*, ordered by g(s) + epsilon * h(s), which
+# expands fewer cities and returns a route at most epsilon times the optimal cost
+def ASTAR(graph, start_city, end_city, cost_func, heuristic='gps', queue='heap', stats=None, epsilon=1.0,
+		adjacency=None):
+	h = destination_heuristic(graph, end_city, cost_func, heuristic)
+	if epsilon != 1:
+		h = [epsilon * x for x in h]
+	if stats is not None and heuristic in ADMISSIBLE_HEURISTICS:
+		stats.bound = float(epsilon)
+	return best_first(graph, start_city, end_city, cost_func, h, queue, stats, adjacency)
+
+
+# Anytime A* (ARA*, Likhachev et al.): a weighted A* search with a large epsilon finds a
+# first route quickly, then epsilon is lowered by step and the search resumed, reusing
+# the g-values and only reopening cities whose g improved after they were expanded
+# (kept aside as "inconsistent"). Every finished round proves
+#     cost <= min(epsilon, g(end) / min over open and inconsistent cities of g + h) * optimal
+# for an admissible h. Rounds continue until the bound reaches 1 or deadline seconds
+# have passed; the first round always completes. Returns (path, bound), the bound is
+# None for the great-circle heuristic.
+def anytime_astar(graph, start_city, end_city, cost_func, heuristic='alt', epsilon=ANYTIME_EPSILON,
+		deadline=ANYTIME_DEADLINE, step=ANYTIME_STEP, stats=None):
+	if not graph.connected(start_city, end_city):
+		return None, None
+	stop_at = time.perf_counter() + deadline if deadline is not None else INF
+	h = destination_heuristic(graph, end_city, cost_func, heuristic)
+	offsets, targets, weights = graph.adjacency(cost_func)
+	n = len(graph)
+	parent = [-1] * n
+	g_value = [INF] * n
+	g_value[start_city] = 0
+	# open: on the fringe of this round; closed: expanded this round
+	open_city = bytearray(n)
+	closed = bytearray(n)
+	inconsistent = []
+	open_city[start_city] = 1
+	fringe = [(epsilon * h[start_city], 0, start_city)]
+	bound = INF
+	path = None
+	expanded = generated = reopened = peak = 0
+
+	while True:
+		interrupted = False
+		while fringe:
+			f, g, city = fringe[0]
+			# stale entry, or expanded since it was pushed
+			if g > g_value[city] or not open_city[city]:
+				heappop(fringe)
+				continue
+			if g_value[end_city] <= f:
+				break
+			# only a finished round has a bound, so the first one always runs to the end
+			if bound < INF and not expanded & 31 and time.perf_counter() > stop_at:
+				interrupted = True
+				break
+			if len(fringe) > peak:
+				peak = len(fringe)
+			heappop(fringe)
+			open_city[city] = 0
+			closed[city] = 1
+			expanded += 1
+			generated += offsets[city + 1] - offsets[city]
+			for e in range(offsets[city], offsets[city + 1]):
+				nxt = targets[e]
+				tmp = g + weights[e]
+				if tmp < g_value[nxt]:
+					g_value[nxt] = tmp
+					parent[nxt] = city
+					if closed[nxt]:
+						# expanded this round with a worse g, reopened in the next one
+						inconsistent.append(nxt)
+					else:
+						open_city[nxt] = 1
+						heappush(fringe, (tmp + epsilon * h[nxt], tmp, nxt))
+		if g_value[end_city] < INF:
+			path = rebuild_path(parent, end_city)
+		if interrupted or path is None:
+			break
+		# cities that still matter: valid fringe entries and the inconsistent ones
+		pending = set(c for _, g, c in fringe if open_city[c] and g == g_value[c])
+		pending.update(inconsistent)
+		lower = min([g_value[c] + h[c] for c in pending] or [INF])
+		bound = min(bound, epsilon, g_value[end_city] / lower if lower > 0 else INF)
+		if bound <= 1 or epsilon <= 1 or time.perf_counter() > stop_at:
+			break
+		epsilon = max(1.0, epsilon - step)
+		reopened += len(set(inconsistent))
+		fringe = [(g_value[c] + epsilon * h[c], g_value[c], c) for c in pending]
+		heapify(fringe)
+		open_city = bytearray(n)
+		for c in pending:
+			open_city[c] = 1
+		closed = bytearray(n)
+		inconsistent = []
+
+	if heuristic not in ADMISSIBLE_HEURISTICS or path is None:
+		bound = None
+	elif bound == INF:
+		bound = float(epsilon)
+	if stats is not None:
+		stats.add(expanded=expanded, generated=generated, pushes=expanded + len(fringe),
+			reopened=reopened, peak=peak)
+		stats.bound = bound
+	return path, bound
+
+
+def ANYTIME_ASTAR(graph, start_city, end_city, cost_func, heuristic='alt', stats=None,
+		epsilon=ANYTIME_EPSILON, deadline=ANYTIME_DEADLINE):
+	return anytime_astar(graph, start_city, end_city, cost_func, heuristic, epsilon, deadline, stats=stats)[0]
+
+
+# use priority queue; trees, a TreeCache, keeps the search from start_city for later queries
+def UNIFORM(graph, start_city, end_city, cost_func, queue='heap', stats=None, trees=None, adjacency=None):
+	if trees is not None and queue == 'heap' and adjacency is None:
+		return trees.route(graph, start_city, end_city, cost_func, stats)
+	return best_first(graph, start_city, end_city, cost_func, [0] * len(graph), queue, stats, adjacency)
 
-# use stack
-def DFS(start_city, end_city):
+
+# level-synchronous BFS over the CSR arrays: every round expands the whole frontier with a
+# few NumPy operations instead of popping one city at a time. Returns (hops, parent) arrays,
+# -1 for cities not reached; given end_city it stops after the level that reaches it.
+# A city's parent is the lowest-id city of the previous level joined to it
+def level_bfs(graph, start_city, end_city=None, stats=None):
+	offsets = np.asarray(graph.offsets)
+	targets = np.asarray(graph.targets)
+	hops = np.full(len(graph), -1, dtype=np.int32)
+	parent = np.full(len(graph), -1, dtype=np.int64)
+	hops[start_city] = 0
+	frontier = np.array([start_city])
+	level = expanded = generated = pushes = peak = 0
+	while len(frontier) and (end_city is None or hops[end_city] < 0):
+		peak = max(peak, len(frontier))
+		expanded += len(frontier)
+		# edge ids of all frontier cities, concatenated
+		starts = offsets[frontier]
+		degree = offsets[frontier + 1] - starts
+		total = int(degree.sum())
+		generated += total
+		edges = np.repeat(starts - np.cumsum(degree) + degree, degree) + np.arange(total)
+		nxt = targets[edges]
+		fresh = hops[nxt] < 0
+		# np.unique sorts, and the first occurrence comes from the lowest frontier city
+		reached, first = np.unique(nxt[fresh], return_index=True)
+		level += 1
+		hops[reached] = level
+		parent[reached] = np.repeat(frontier, degree)[fresh][first]
+		pushes += len(reached)
+		frontier = reached
+	if stats is not None:
+		stats.add(expanded=expanded, generated=generated, pushes=pushes + 1, peak=peak)
+	return hops, parent
+
+
+# fewest road segments from source to every city, -1 where there is no route
+def hop_counts(graph, source):
+	return level_bfs(graph, source)[0]
+
+
+# use stack, goal tested when generated
+def DFS(graph, start_city, end_city, stats=None):
+	if not graph.connected(start_city, end_city):
+		return None
+	offsets, targets, _ = graph.adjacency('segments')
+	parent = [-1] * len(graph)
+	visited_city = bytearray(len(graph))
 	visited_city[start_city] = 1
-	fringe = [[start_city]]
-	while len(fringe) > 0:
-		path = fringe.pop()
-		for s in succ_paths(path):
-			if s[-1] == end_city:
-				return s
-			fringe.append(s)
+	fringe = [start_city]
+	path = None
+	expanded = generated = peak = 0
+	while fringe and path is None:
+		if len(fringe) > peak:
+			peak = len(fringe)
+		city = fringe.pop()
+		expanded += 1
+		generated += offsets[city + 1] - offsets[city]
+		for e in range(offsets[city], offsets[city + 1]):
+			nxt = targets[e]
+			# avoid revisit
+			if not visited_city[nxt]:
+				visited_city[nxt] = 1
+				parent[nxt] = city
+				if nxt == end_city:
+					path = rebuild_path(parent, end_city)
+					break
+				fringe.append(nxt)
+	if stats is not None:
+		stats.add(expanded=expanded, generated=generated, pushes=expanded + len(fringe), peak=peak)
+	return path
 
 
-if __name__ == '__main__':
-	visited_city = {}
-	gps_hash_table = {}
-	segments_hash_table = {}
-	minnow_hash_table = {}
-	max_speed_lim = 0
+# fewest segments, one frontier level at a time
+def BFS(graph, start_city, end_city, stats=None):
+	if not graph.connected(start_city, end_city):
+		return None
+	if start_city == end_city:
+		return [start_city]
+	parent = level_bfs(graph, start_city, end_city, stats)[1]
+	return rebuild_path(parent, end_city)
 
-	# load data
-	with open('./city-gps.txt','r') as city_gps_f:
-		for line in city_gps_f:
-			a = line.replace('\n','').split(" ")
-			gps_hash_table[a[0]] = [a[1], a[2]]
-
-	with open('./road-segments.txt','r') as road_seg_f:
-		for line in road_seg_f:
-			a = line.replace('\n','').split(" ")
-			if len(a[3]) < 2:
-				a[3] = 45
-			if float(a[3]) > max_speed_lim:
-				max_speed_lim = float(a[3])
-			if a[0] not in segments_hash_table:
-				segments_hash_table[a[0]] = [ a[1:] ]
-			else:
-				segments_hash_table[a[0]].append(a[1:])
-			if a[1] not in segments_hash_table:
-				segments_hash_table[a[1]] = [ [a[0],a[2],a[3],a[4]] ]
-			else:
-				segments_hash_table[a[1]].append([a[0],a[2],a[3],a[4]])
 
-	# get parameter
-	start_city = sys.argv[1]
-	end_city = sys.argv[2]
-	route_alg = sys.argv[3]
-	assert route_alg in ['bfs','uniform','dfs','astar'], 'Algorithm %s not defined'%route_alg
-	cost_func = sys.argv[4]
-	assert cost_func in ['segments','distance','time'], "Routing option %s not defined"%cost_func
+# meet-in-the-middle search, forward from start_city and backward from end_city on the
+# same (undirected) adjacency. With potential=None this is bidirectional Dijkstra; otherwise
+# both sides run on reduced costs w(u,v) + p(v) - p(u) and -p(v) + p(u), and the search may
+# stop as soon as the two fringe tops sum to at least the best connection found so far.
+def bidirectional_search(graph, start_city, end_city, cost_func, potential=None):
+	offsets, targets, weights = graph.adjacency(cost_func)
+	n = len(graph)
+	g_value = ([INF] * n, [INF] * n)
+	parent = ([-1] * n, [-1] * n)
+	fringe = ([], [])
+	sign = (1, -1)
+	if potential is None:
+		potential = lambda city: 0
+	for side, city in enumerate([start_city, end_city]):
+		g_value[side][city] = 0
+		heappush(fringe[side], (sign[side] * potential(city), 0, city))
+
+	best = INF
+	meet = -1
+	while fringe[0] and fringe[1]:
+		if fringe[0][0][0] + fringe[1][0][0] >= best:
+			break
+		# expand the side whose fringe top is smaller
+		side = 0 if fringe[0][0][0] <= fringe[1][0][0] else 1
+		other = 1 - side
+		_, g, city = heappop(fringe[side])
+		if g > g_value[side][city]:
+			continue
+		for e in range(offsets[city], offsets[city + 1]):
+			nxt = targets[e]
+			tmp = g + weights[e]
+			if tmp < g_value[side][nxt]:
+				g_value[side][nxt] = tmp
+				parent[side][nxt] = city
+				heappush(fringe[side], (tmp + sign[side] * potential(nxt), tmp, nxt))
+				if tmp + g_value[other][nxt] < best:
+					best = tmp + g_value[other][nxt]
+					meet = nxt
+
+	if meet < 0:
+		return None
+	path = rebuild_path(parent[0], meet)
+	city = parent[1][meet]
+	while city >= 0:
+		path.append(city)
+		city = parent[1][city]
+	return path
+
+
+def BIDIRECTIONAL_UNIFORM(graph, start_city, end_city, cost_func):
+	return bidirectional_search(graph, start_city, end_city, cost_func)
+
+
+# average potential p(v) = (h_end(v) - h_start(v)) / 2, consistent for both directions
+# when h is; the great-circle h is not on this data, so the search stops too early on
+# many routes with it, the landmark bounds are the default
+def BIDIRECTIONAL_ASTAR(graph, start_city, end_city, cost_func, heuristic='alt'):
+	to_end = destination_heuristic(graph, end_city, cost_func, heuristic)
+	to_start = destination_heuristic(graph, start_city, cost_func, heuristic)
+	memo = {}
+
+	def potential(city):
+		if city not in memo:
+			memo[city] = (to_end[city] - to_start[city]) / 2
+		return memo[city]
+	return bidirectional_search(graph, start_city, end_city, cost_func, potential)
+
+
+# upward/downward query on the contraction hierarchy for cost_func, built on first use
+def CH(graph, start_city, end_city, cost_func):
+	return load_hierarchy(graph, cost_func).query(start_city, end_city)[1]
+
 
-	# print segments_hash_table[start_city]
+# bidirectional query on the multilevel overlay (overlay.py); the partition is built on
+# first use, cost_func customized on first use
+def CRP(graph, start_city, end_city, cost_func):
+	return load_overlay(graph).query(start_city, end_city, cost_func)[1]
+
+
+# run one query on city ids, returns the list of city ids on the route; stats, a
+# SearchStats, gets the search counters (bfs/dfs/uniform/astar) and the 'search' time
+# epsilon is the A* weight (astar, default 1) or the first weight of anytime-astar, and
+# deadline its time budget in seconds; stats.bound gets the proven suboptimality bound.
+# compress runs uniform/astar on the graph with degree-2 chains contracted (chains.py),
+# always with the heap queue;
+# trees, a TreeCache, answers uniform from shortest-path trees kept per start city;
+# arc_flags makes uniform/astar skip edges not flagged for end_city's region (arc_flags.py)
+def find_route(graph, start_city, end_city, route_alg, cost_func, heuristic=None, queue='heap', stats=None,
+		epsilon=None, deadline=None, compress=False, trees=None, arc_flags=False):
+	assert route_alg in ROUTE_ALGORITHMS, 'Algorithm %s not defined'%route_alg
+	assert cost_func in COST_FUNCTIONS, "Routing option %s not defined"%cost_func
+	assert epsilon is None or epsilon >= 1, 'A* weight %s below 1'%epsilon
+	if heuristic is None:
+		heuristic = default_heuristic(route_alg, epsilon)
+
+	if stats is None:
+		return _find_route(graph, start_city, end_city, route_alg, cost_func, heuristic, queue, None,
+			epsilon, deadline, compress, trees, arc_flags)
+	with stats.phase('search'):
+		return _find_route(graph, start_city, end_city, route_alg, cost_func, heuristic, queue, stats,
+			epsilon, deadline, compress, trees, arc_flags)
+
+
+def _find_route(graph, start_city, end_city, route_alg, cost_func, heuristic, queue, stats=None,
+		epsilon=None, deadline=None, compress=False, trees=None, arc_flags=False):
+	if start_city == end_city:
+		return [start_city]
+
+	# no road joins the two components, answered without searching
+	if not graph.connected(start_city, end_city):
+		return None
 
 	# bfs
 	if route_alg == 'bfs':
-		path = BFS(start_city, end_city)
+		return BFS(graph, start_city, end_city, stats)
 
 	# dfs
 	if route_alg == 'dfs':
-		path = DFS(start_city, end_city)
+		return DFS(graph, start_city, end_city, stats)
+
+	# if cost is number of segments then uniform/astar are the same with BFS
+	if cost_func == 'segments':
+		return BFS(graph, start_city, end_city, stats)
+
+	if compress and route_alg in ['uniform', 'astar']:
+		h = [0] * len(graph)
+		if route_alg == 'astar':
+			h = destination_heuristic(graph, end_city, cost_func, heuristic)
+			if epsilon is not None and epsilon != 1:
+				h = [epsilon * x for x in h]
+			if stats is not None and heuristic in ADMISSIBLE_HEURISTICS:
+				stats.bound = 1.0 if epsilon is None else float(epsilon)
+		return load_chains(graph).search(start_city, end_city, cost_func, h, stats)
+
+	adjacency = None
+	if arc_flags and route_alg in ['uniform', 'astar']:
+		adjacency = load_arc_flags(graph, cost_func).adjacency(end_city)
 
 	# uniform
 	if route_alg == 'uniform':
-		if cost_func == 'segments':
-			# if cost is number of segments then same with BFS
-			path = BFS(start_city, end_city)
-		else:
-			path = UNIFORM(start_city, end_city, cost_func)
-			path = path[1:]
-		
+		return UNIFORM(graph, start_city, end_city, cost_func, queue, stats, trees, adjacency)
+
 	# astar
 	if route_alg == 'astar':
-		if cost_func == 'segments':
-			path = BFS(start_city, end_city)
-		else:
-			path = ASTAR(start_city, end_city, cost_func)
-			path = path[3:]
-
-	# organize output format, cal total distance/time
-	total_distance = 0
-	total_time = 0
-	i = 0
-	
-	for city in path:
-		if i == len(path) - 1:
-			break
+		return ASTAR(graph, start_city, end_city, cost_func, heuristic, queue, stats,
+			1.0 if epsilon is None else epsilon, adjacency)
+
+	if route_alg == 'anytime-astar':
+		return ANYTIME_ASTAR(graph, start_city, end_city, cost_func, heuristic, stats,
+			ANYTIME_EPSILON if epsilon is None else epsilon, ANYTIME_DEADLINE if deadline is None else deadline)
 
-		i += 1
-		nxt_city = path[i]
+	if route_alg == 'bidirectional-uniform':
+		return BIDIRECTIONAL_UNIFORM(graph, start_city, end_city, cost_func)
 
-		tmp_distance = 0
-		tmp_speedlim = 0
+	if route_alg == 'bidirectional-astar':
+		return BIDIRECTIONAL_ASTAR(graph, start_city, end_city, cost_func, heuristic)
 
-		for s in segments_hash_table[city]:
-			if nxt_city == s[0]:
-				tmp_distance = s[1]
-				tmp_speedlim = s[2]
+	if route_alg == 'ch':
+		return CH(graph, start_city, end_city, cost_func)
 
-		total_distance += float(tmp_distance)
-		total_time += float(tmp_distance)/float(tmp_speedlim)
+	if route_alg == 'crp':
+		return CRP(graph, start_city, end_city, cost_func)
 
-	header = []
-	header.append(total_distance)
-	header.append(total_time)	
-	output = header + path
-	output_str = ''
 
-	for item in output:
-		output_str += str(item)
-		output_str += ' '
+# organize output format, cal total distance/time
+def format_route(graph, path, cost_func='distance'):
+	total_distance, total_time = graph.path_totals(path, cost_func)
+	output = [total_distance, total_time] + [graph.names[u] for u in path]
+	return ' '.join(str(item) for item in output)
 
-	new = output_str[:-1]
-	
-	print new
+
+# single-source Dijkstra that stops once every target is settled; returns their costs
+def one_to_many(graph, source, targets, cost_func):
+	offsets, targets_, weights = graph.adjacency(cost_func)
+	g_value = {source: 0}
+	# targets in other components stay at inf
+	remaining = set(t for t in targets if graph.connected(source, t))
+	remaining.discard(source)
+	fringe = [(0, source)]
+	while fringe and remaining:
+		g, city = heappop(fringe)
+		if g > g_value[city]:
+			continue
+		remaining.discard(city)
+		for e in range(offsets[city], offsets[city + 1]):
+			nxt = targets_[e]
+			tmp = g + weights[e]
+			if tmp < g_value.get(nxt, INF):
+				g_value[nxt] = tmp
+				heappush(fringe, (tmp, nxt))
+	return [g_value.get(t, INF) for t in targets]
+
+
+# every city within budget (hours for time, miles for distance) of the closest of sources,
+# a city or a list of cities, as (cost, city, source) in order of cost. One Dijkstra seeded
+# with every source at 0; nothing over budget is ever queued, so it stops at the budget
+def reachable_within(graph, sources, budget, cost_func, stats=None):
+	assert cost_func in COST_FUNCTIONS, "Routing option %s not defined"%cost_func
+	if budget < 0:
+		raise ValueError('budget must be at least 0, got %r' % budget)
+	sources = [sources] if isinstance(sources, (int, np.integer)) else list(sources)
+	offsets, targets, weights = graph.adjacency(cost_func)
+	g_value = {}
+	# city -> the source it is reached from
+	origin = {}
+	for s in sources:
+		g_value[s] = 0
+		origin.setdefault(s, s)
+	fringe = [(0, s) for s in origin]
+	heapify(fringe)
+	reached = []
+	pops = stale = generated = peak = 0
+	while fringe:
+		if len(fringe) > peak:
+			peak = len(fringe)
+		g, city = heappop(fringe)
+		pops += 1
+		if g > g_value[city]:
+			stale += 1
+			continue
+		reached.append((g, city, origin[city]))
+		generated += offsets[city + 1] - offsets[city]
+		for e in range(offsets[city], offsets[city + 1]):
+			nxt = targets[e]
+			tmp = g + weights[e]
+			if tmp <= budget and tmp < g_value.get(nxt, INF):
+				g_value[nxt] = tmp
+				origin[nxt] = origin[city]
+				heappush(fringe, (tmp, nxt))
+	if stats is not None:
+		stats.add(expanded=pops - stale, generated=generated, pushes=pops, peak=peak)
+	return reached
+
+
+# graph inherited by forked matrix workers (copy-on-write), or re-mapped from the cache
+_matrix_graph = None
+
+
+def _init_matrix_worker(data_dir):
+	global _matrix_graph
+	if _matrix_graph is None:
+		_matrix_graph = load_graph(data_dir)
+
+
+def _matrix_rows(job):
+	sources, targets, cost_func = job
+	return [one_to_many(_matrix_graph, s, targets, cost_func) for s in sources]
+
+
+# len(sources) x len(targets) cost matrix (inf where unreachable), one search per source
+# spread over a process pool; workers share the read-only graph instead of loading it.
+# hub_labels answers from the hub labeling of cost_func (hub_labels.py) in this process
+def distance_matrix(graph, sources, targets, cost_func, processes=None, chunk_size=8, hub_labels=False):
+	global _matrix_graph
+	assert cost_func in COST_FUNCTIONS, "Routing option %s not defined"%cost_func
+	sources = list(sources)
+	targets = list(targets)
+	if hub_labels:
+		labels = load_hub_labels(graph, cost_func)
+		return np.array([labels.distances(s, targets) for s in sources],
+			dtype=np.float64).reshape(len(sources), len(targets))
+	if processes is None:
+		processes = multiprocessing.cpu_count()
+	if processes <= 1 or len(sources) <= chunk_size:
+		return np.array([one_to_many(graph, s, targets, cost_func) for s in sources],
+			dtype=np.float64).reshape(len(sources), len(targets))
+
+	jobs = [(sources[i:i + chunk_size], targets, cost_func) for i in range(0, len(sources), chunk_size)]
+	graph.adjacency(cost_func)
+	if 'fork' in multiprocessing.get_all_start_methods():
+		_matrix_graph = graph
+		context = multiprocessing.get_context('fork')
+		initargs = (None,)
+	else:
+		# no fork: every worker memory-maps the same cache file
+		context = multiprocessing.get_context()
+		initargs = (graph.data_dir,)
+	try:
+		with context.Pool(processes, initializer=_init_matrix_worker, initargs=initargs) as pool:
+			rows = [row for chunk in pool.map(_matrix_rows, jobs) for row in chunk]
+	finally:
+		_matrix_graph = None
+	return np.array(rows, dtype=np.float64).reshape(len(sources), len(targets))
+
+
+# (lat, lon) from "lat,lon", None for anything else (city names contain commas too)
+def parse_coordinates(text):
+	fields = text.split(',')
+	if len(fields) != 2:
+		return None
+	try:
+		lat, lon = float(fields[0]), float(fields[1])
+	except ValueError:
+		return None
+	if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+		return None
+	return lat, lon
+
+
+# city id of a city name, or of the closest city to a "lat,lon" point
+def resolve_city(graph, text):
+	if not isinstance(text, str):
+		raise ValueError('expected a city name or "lat,lon", got %r' % (text,))
+	coordinates = parse_coordinates(text)
+	if coordinates is None:
+		return graph.city_id(text)
+	city = snap(graph, *coordinates)
+	if city is None:
+		raise KeyError('No city with coordinates near %s' % text)
+	return city
+
+
+def read_city_list(graph, path):
+	with open(path, 'r') as f:
+		return [resolve_city(graph, line.strip()) for line in f if line.strip()]
+
+
+# message of a KeyError or ValueError raised while reading a query; str() of a KeyError
+# quotes its message
+def error_text(e):
+	if isinstance(e, KeyError) and e.args:
+		return str(e.args[0])
+	return str(e)
+
+
+# resolve_city or read_city_list for the command line: a city that cannot be found ends
+# the run with a usage error instead of a traceback
+def city_argument(parser, graph, text, resolve=resolve_city):
+	try:
+		return resolve(graph, text)
+	except (KeyError, ValueError) as e:
+		parser.error(error_text(e))
+
+
+# Batch and server mode: one query per line, either a JSON object
+#   {"start": ..., "end": ..., "algorithm": ..., "cost": ..., "heuristic": ..., "id": ...,
+#    "epsilon": ..., "deadline": ... (ms)}
+# answered with a JSON object (with "bound" for anytime-astar and epsilon queries, null
+# when none can be proven: the heuristic defaults to alt for them, gps proves nothing),
+# or tab/space separated fields
+#   start end algorithm cost [heuristic]
+# answered with the same line format as a single command line query. start and end
+# are city names or "lat,lon" points, which are snapped to the closest city.
+def parse_query(line):
+	line = line.strip()
+	if line.startswith('{'):
+		return json.loads(line), True
+	fields = line.split('\t') if '\t' in line else line.split()
+	if len(fields) < 4:
+		raise ValueError('expected start, end, algorithm and cost, got %r' % line)
+	query = {'start': fields[0], 'end': fields[1], 'algorithm': fields[2], 'cost': fields[3]}
+	if len(fields) > 4:
+		query['heuristic'] = fields[4]
+	return query, False
+
+
+# multi-stop query: start, waypoints (a list), optional end and cost; the waypoints
+# come back in visiting order with the whole route
+def answer_tour(graph, query, stats=None):
+	result = dict((k, query[k]) for k in ['id', 'start', 'waypoints', 'end', 'cost'] if k in query)
+	missing = [k for k in ['start', 'cost'] if k not in query]
+	if missing:
+		result['error'] = 'Missing query field %s' % ', '.join(missing)
+		return result
+	try:
+		cost_func = query['cost']
+		if cost_func not in COST_FUNCTIONS:
+			raise ValueError('Routing option %s not defined' % cost_func)
+		if not isinstance(query['waypoints'], list):
+			raise ValueError('waypoints must be a list of cities, got %r' % query['waypoints'])
+		start_city = resolve_city(graph, query['start'])
+		waypoints = [resolve_city(graph, w) for w in query['waypoints']]
+		end_city = resolve_city(graph, query['end']) if query.get('end') is not None else None
+	except (KeyError, ValueError) as e:
+		result['error'] = error_text(e)
+		return result
+	if stats is None:
+		stats = SearchStats()
+	with stats.phase('search'):
+		order, path = plan_tour(graph, start_city, waypoints, end_city, cost_func, stats)
+	if path is None:
+		result['error'] = 'No route from %s through all waypoints' % query['start']
+		result['unreachable'] = True
+		return result
+	result['order'] = [graph.names[c] for c in order]
+	result['distance'], result['time'] = graph.path_totals(path, cost_func)
+	result['route'] = [graph.names[u] for u in path]
+	return result
+
+
+# reachability query: start (a city or a list of cities), budget and cost; every city
+# within budget comes back as [city, cost, start city it is reached from], cheapest first
+def answer_reachable(graph, query, stats=None):
+	result = dict((k, query[k]) for k in ['id', 'start', 'budget', 'cost'] if k in query)
+	missing = [k for k in ['start', 'cost'] if k not in query]
+	if missing:
+		result['error'] = 'Missing query field %s' % ', '.join(missing)
+		return result
+	try:
+		cost_func = query['cost']
+		if cost_func not in COST_FUNCTIONS:
+			raise ValueError('Routing option %s not defined' % cost_func)
+		budget = query['budget']
+		if not (isinstance(budget, (int, float)) and budget >= 0):
+			raise ValueError('budget must be a number >= 0, got %r' % budget)
+		starts = query['start'] if isinstance(query['start'], list) else [query['start']]
+		sources = [resolve_city(graph, s) for s in starts]
+	except (KeyError, ValueError) as e:
+		result['error'] = error_text(e)
+		return result
+	if stats is None:
+		stats = SearchStats()
+	with stats.phase('search'):
+		reached = reachable_within(graph, sources, budget, cost_func, stats)
+	result['reachable'] = [[graph.names[city], g, graph.names[source]] for g, city, source in reached]
+	return result
+
+
+# distance-only query: start, end and cost with "hub_labels": true, answered from the
+# hub labeling of cost (hub_labels.py) without a route; the cost comes back under its
+# own name, e.g. "time" for cost time
+def answer_hub_distance(graph, query, stats=None):
+	result = dict((k, query[k]) for k in ['id', 'start', 'end', 'cost'] if k in query)
+	missing = [k for k in ['start', 'end', 'cost'] if k not in query]
+	if missing:
+		result['error'] = 'Missing query field %s' % ', '.join(missing)
+		return result
+	try:
+		cost_func = query['cost']
+		if cost_func not in COST_FUNCTIONS:
+			raise ValueError('Routing option %s not defined' % cost_func)
+		start_city = resolve_city(graph, query['start'])
+		end_city = resolve_city(graph, query['end'])
+	except (KeyError, ValueError) as e:
+		result['error'] = error_text(e)
+		return result
+	if stats is None:
+		stats = SearchStats()
+	with stats.phase('search'):
+		cost = load_hub_labels(graph, cost_func).distance(start_city, end_city)
+	if cost == INF:
+		result['error'] = 'No route from %s to %s' % (query['start'], query['end'])
+		result['unreachable'] = True
+		return result
+	result[cost_func] = cost
+	return result
+
+
+# cache, when given, is a RouteCache consulted before and filled after every exact search
+# (weighted and deadline-bound routes are not cached); stats, a SearchStats, accumulates
+# over the searches actually run; trees, a TreeCache, is passed on to uniform searches.
+# Queries with waypoints are multi-stop routes, see answer_tour, and queries with a
+# budget are reachability queries, see answer_reachable, and "hub_labels" ones
+# distance-only lookups, see answer_hub_distance
+def answer_query(graph, query, cache=None, stats=None, trees=None):
+	if 'waypoints' in query:
+		return answer_tour(graph, query, stats)
+	if 'budget' in query:
+		return answer_reachable(graph, query, stats)
+	if query.get('hub_labels'):
+		return answer_hub_distance(graph, query, stats)
+	result = dict((k, query[k]) for k in ['id', 'start', 'end', 'algorithm', 'cost'] if k in query)
+	missing = [k for k in ['start', 'end', 'algorithm', 'cost'] if k not in query]
+	if missing:
+		result['error'] = 'Missing query field %s' % ', '.join(missing)
+		return result
+	try:
+		route_alg = query['algorithm']
+		cost_func = query['cost']
+		if route_alg not in ROUTE_ALGORITHMS:
+			raise ValueError('Algorithm %s not defined' % route_alg)
+		if cost_func not in COST_FUNCTIONS:
+			raise ValueError('Routing option %s not defined' % cost_func)
+		epsilon = query.get('epsilon')
+		if epsilon is not None and not (isinstance(epsilon, (int, float)) and epsilon >= 1):
+			raise ValueError('epsilon must be a number >= 1, got %r' % epsilon)
+		heuristic = query.get('heuristic', default_heuristic(route_alg, epsilon))
+		if heuristic not in HEURISTICS:
+			raise ValueError('Heuristic %s not defined' % heuristic)
+		deadline = query.get('deadline')
+		if deadline is not None and not (isinstance(deadline, (int, float)) and deadline >= 0):
+			raise ValueError('deadline must be a number of milliseconds, got %r' % deadline)
+		start_city = resolve_city(graph, query['start'])
+		end_city = resolve_city(graph, query['end'])
+	except (KeyError, ValueError) as e:
+		result['error'] = error_text(e)
+		return result
+
+	if route_alg == 'anytime-astar' or epsilon is not None:
+		cache = None
+	cached = None
+	if cache is not None:
+		cached = cache.get(graph.names[start_city], graph.names[end_city], route_alg, cost_func, heuristic)
+	if cached is not None:
+		distance, time, route = cached
+	else:
+		if stats is None:
+			stats = SearchStats()
+		stats.bound = None
+		path = find_route(graph, start_city, end_city, route_alg, cost_func, heuristic, stats=stats,
+			epsilon=epsilon, deadline=None if deadline is None else deadline / 1000.0, trees=trees)
+		if stats.bound is not None:
+			result['bound'] = stats.bound
+		elif (route_alg == 'anytime-astar' or epsilon is not None) and cost_func != 'segments':
+			# asked for, but nothing is proven under the great-circle heuristic
+			result['bound'] = None
+		distance = time = route = None
+		if path is not None:
+			distance, time = graph.path_totals(path, cost_func)
+			route = [graph.names[u] for u in path]
+		if cache is not None:
+			cache.put(graph.names[start_city], graph.names[end_city], route_alg, cost_func, heuristic,
+				distance, time, route)
+	if route is None:
+		result['error'] = 'No route from %s to %s' % (query['start'], query['end'])
+		result['unreachable'] = True
+		return result
+	result['distance'], result['time'] = distance, time
+	result['route'] = route
+	return result
+
+
+# answer one batch/server line, None for blank lines and comments
+def answer_line(graph, line, cache=None, stats=None, trees=None):
+	if not line.strip() or line.lstrip().startswith('#'):
+		return None
+	try:
+		query, as_json = parse_query(line)
+	except ValueError as e:
+		return json.dumps({'error': str(e)}) if line.lstrip().startswith('{') else 'ERROR %s' % e
+	# one bad line must not end a batch run or a server connection
+	try:
+		result = answer_query(graph, query, cache, stats, trees)
+	except Exception as e:
+		result = {'error': '%s: %s' % (type(e).__name__, e)}
+		if isinstance(query, dict) and 'id' in query:
+			result['id'] = query['id']
+	if as_json:
+		return json.dumps(result)
+	if 'error' in result:
+		return 'ERROR %s' % result['error']
+	return ' '.join(str(item) for item in [result['distance'], result['time']] + result['route'])
+
+
+def run_batch(graph, lines, out, cache=None, stats=None, trees=None):
+	for line in lines:
+		answer = answer_line(graph, line, cache, stats, trees)
+		if answer is not None:
+			out.write(answer + '\n')
+	out.flush()
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		for line in self.rfile:
+			answer = answer_line(self.server.graph, line.decode('utf-8'), self.server.cache,
+				trees=self.server.trees)
+			if answer is not None:
+				self.wfile.write((answer + '\n').encode('utf-8'))
+				self.wfile.flush()
+
+
+# long-running server on a unix domain socket, one thread per connection. A socket left
+# behind by a server that is gone is replaced; anything else at socket_path is an error
+def make_server(graph, socket_path, cache=None, trees=None):
+	if os.path.lexists(socket_path):
+		if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+			raise FileExistsError('%s exists and is not a socket' % socket_path)
+		probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			probe.connect(socket_path)
+		except OSError:
+			os.unlink(socket_path)
+		else:
+			raise FileExistsError('a server is already listening on %s' % socket_path)
+		finally:
+			probe.close()
+	server = socketserver.ThreadingUnixStreamServer(socket_path, QueryHandler)
+	server.daemon_threads = True
+	server.graph = graph
+	server.cache = cache
+	server.trees = trees
+	return server
+
+
+def serve(graph, socket_path, cache=None, trees=None):
+	server = make_server(graph, socket_path, cache, trees)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		if os.path.exists(socket_path):
+			os.unlink(socket_path)
+
+
+if __name__ == '__main__':
+	# get parameter
+	parser = argparse.ArgumentParser(description='Find a route between two cities')
+	parser.add_argument('start_city', nargs='?', help='city name, or LAT,LON snapped to the closest city')
+	parser.add_argument('end_city', nargs='?', help='city name, or LAT,LON snapped to the closest city')
+	parser.add_argument('route_alg', nargs='?', choices=ROUTE_ALGORITHMS)
+	parser.add_argument('cost_func', nargs='?', choices=COST_FUNCTIONS)
+	parser.add_argument('--heuristic', choices=HEURISTICS,
+		help='A* heuristic: great-circle distance or landmark (ALT) bounds (default alt for anytime-astar '
+			'and astar with --epsilon, gps otherwise)')
+	parser.add_argument('--epsilon', type=float,
+		help='A* weight >= 1: astar returns a route at most this times the optimal cost, '
+			'anytime-astar starts from it (default %s)' % ANYTIME_EPSILON)
+	parser.add_argument('--deadline', type=float, metavar='MS',
+		help='time budget of anytime-astar in milliseconds (default %d)' % (ANYTIME_DEADLINE * 1000))
+	parser.add_argument('--compress', action='store_true',
+		help='run uniform/astar on the graph with chains of pass-through cities contracted')
+	parser.add_argument('--arc-flags', action='store_true',
+		help='uniform/astar skip edges not on a shortest route into the goal region '
+			'(flags built and stored on first use, or ahead with python arc_flags.py)')
+	parser.add_argument('--queue', choices=QUEUE_NAMES, default='heap',
+		help='UNIFORM/ASTAR priority queue: lazy-deletion heap, Dial buckets (distance, integer keys only) '
+			'or indexed heap with decrease-key')
+	parser.add_argument('--batch', metavar='FILE', nargs='?', const='-',
+		help='answer JSONL or TSV queries from FILE (default stdin), one result per line')
+	parser.add_argument('--serve', metavar='SOCKET',
+		help='answer queries on a unix domain socket until interrupted')
+	parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+		help='routes kept in the in-process LRU cache by --batch/--serve (0 disables it)')
+	parser.add_argument('--tree-cache-mb', type=float, default=DEFAULT_TREE_CACHE_MB,
+		help='memory cap of the uniform shortest-path trees kept per start city by --batch/--serve '
+			'(0 disables them)')
+	parser.add_argument('--cache-db', metavar='FILE',
+		help='sqlite file backing the route cache across runs, single queries included')
+	parser.add_argument('--matrix', metavar='SOURCES',
+		help='print the cost matrix from the cities listed in SOURCES (one per line) as TSV')
+	parser.add_argument('--targets', metavar='TARGETS',
+		help='matrix target cities, one per line (default: the sources)')
+	parser.add_argument('--cost', choices=COST_FUNCTIONS, default='distance',
+		help='cost function for --matrix, --tour and --within')
+	parser.add_argument('--processes', type=int, default=None,
+		help='worker processes for --matrix (default: one per cpu)')
+	parser.add_argument('--hub-labels', action='store_true',
+		help='answer --matrix from the hub labeling index, built and stored on first use '
+			'(--batch/--serve: "hub_labels": true in a JSON query)')
+	parser.add_argument('--tour', metavar='CITY', nargs='+',
+		help='multi-stop route from the first city through the others in the cheapest order found '
+			'(exact up to 15 waypoints), by --cost')
+	parser.add_argument('--end', metavar='CITY',
+		help='with --tour, finish at this city (the start for a round trip)')
+	parser.add_argument('--within', metavar='BUDGET', type=float,
+		help='list every city within BUDGET (hours for time, miles for distance) of --from, by --cost')
+	parser.add_argument('--from', dest='sources', metavar='CITY', nargs='+',
+		help='with --within, the start cities; each city is reached from the closest one')
+	parser.add_argument('--nearest', metavar='LAT,LON',
+		help='list the cities closest to a point instead of routing')
+	parser.add_argument('--k', type=int, default=5,
+		help='number of cities listed by --nearest')
+	parser.add_argument('--radius', type=float,
+		help='with --nearest, list every city within this many miles instead')
+	parser.add_argument('--stats', action='store_true',
+		help='print search counters and load/search/format times as JSON on stderr (--batch: summed)')
+	args = parser.parse_args()
+	if args.batch is None and args.serve is None and args.matrix is None and args.nearest is None \
+			and args.tour is None and args.within is None and args.cost_func is None:
+		parser.error('start_city, end_city, route_alg and cost_func are required')
+	if args.within is not None and (args.within < 0 or not args.sources):
+		parser.error('--within needs a budget of at least 0 and --from CITY [CITY ...]')
+	if args.epsilon is not None and args.epsilon < 1:
+		parser.error('--epsilon must be at least 1')
+	if args.heuristic is None:
+		args.heuristic = default_heuristic(args.route_alg, args.epsilon)
+	if args.compress and args.queue != 'heap':
+		parser.error('--compress searches with the heap queue only')
+	if args.queue == 'dial' and args.route_alg == 'anytime-astar':
+		parser.error('--queue dial does not apply to anytime-astar')
+	if args.queue == 'dial' and (args.cost_func == 'time' or args.epsilon not in (None, 1)
+			or (args.route_alg == 'astar' and args.heuristic == 'gps')):
+		parser.error('--queue dial needs whole-mile keys: distance cost, no --epsilon, '
+			'with --heuristic alt for astar')
+
+	stats = SearchStats()
+	exit_code = 0
+	# load data
+	with stats.phase('load'):
+		graph = load_graph()
+
+	if args.nearest is not None:
+		point = parse_coordinates(args.nearest)
+		if point is None:
+			parser.error('--nearest expects LAT,LON')
+		index = load_spatial_index(graph)
+		if args.radius is not None:
+			found = index.within(point[0], point[1], args.radius)
+		else:
+			found = index.nearest(point[0], point[1], args.k)
+		for miles, city in found:
+			print('%s %s' % (miles, graph.names[city]))
+	elif args.tour is not None:
+		cities = [city_argument(parser, graph, name) for name in args.tour]
+		end_city = city_argument(parser, graph, args.end) if args.end is not None else None
+		with stats.phase('search'):
+			order, path = plan_tour(graph, cities[0], cities[1:], end_city, args.cost, stats)
+		if path is None:
+			sys.stderr.write('No route from %s through all waypoints\n' % args.tour[0])
+			exit_code = 1
+		else:
+			sys.stderr.write('Stop order: %s\n' % ' '.join(graph.names[c] for c in order))
+			with stats.phase('format'):
+				output = format_route(graph, path, args.cost)
+			print(output)
+	elif args.within is not None:
+		sources = [city_argument(parser, graph, name) for name in args.sources]
+		with stats.phase('search'):
+			reached = reachable_within(graph, sources, args.within, args.cost, stats)
+		with stats.phase('format'):
+			for g, city, source in reached:
+				print('%s %s %s' % (g, graph.names[city], graph.names[source]))
+	elif args.matrix is not None:
+		sources = city_argument(parser, graph, args.matrix, read_city_list)
+		targets = city_argument(parser, graph, args.targets, read_city_list) if args.targets else sources
+		matrix = distance_matrix(graph, sources, targets, args.cost, args.processes, hub_labels=args.hub_labels)
+		print('\t'.join([''] + [graph.names[t] for t in targets]))
+		for s, row in zip(sources, matrix):
+			print('\t'.join([graph.names[s]] + [repr(float(c)) for c in row]))
+	elif args.serve is not None or args.batch is not None:
+		cache = None
+		if args.cache_size > 0 or args.cache_db:
+			cache = RouteCache(args.cache_size, args.cache_db, graph.version)
+		trees = TreeCache(int(args.tree_cache_mb * (1 << 20))) if args.tree_cache_mb > 0 else None
+		try:
+			if args.serve is not None:
+				try:
+					serve(graph, args.serve, cache, trees)
+				except FileExistsError as e:
+					parser.error(str(e))
+			elif args.batch == '-':
+				run_batch(graph, sys.stdin, sys.stdout, cache, stats, trees)
+			else:
+				with open(args.batch, 'r') as f:
+					run_batch(graph, f, sys.stdout, cache, stats, trees)
+		finally:
+			if cache is not None:
+				cache.close()
+	else:
+		start_city = city_argument(parser, graph, args.start_city)
+		end_city = city_argument(parser, graph, args.end_city)
+		key = (graph.names[start_city], graph.names[end_city], args.route_alg, args.cost_func, args.heuristic)
+		# exact routes are shared with other runs through --cache-db, like in --batch/--serve
+		cache = None
+		if args.cache_db and args.epsilon is None and args.route_alg != 'anytime-astar':
+			cache = RouteCache(args.cache_size, args.cache_db, graph.version)
+		try:
+			cached = cache.get(*key) if cache is not None else None
+			if cached is not None:
+				distance, hours, route = cached
+				output = None if route is None else ' '.join(str(item) for item in [distance, hours] + route)
+			else:
+				path = find_route(graph, start_city, end_city, args.route_alg, args.cost_func, args.heuristic,
+					args.queue, stats, args.epsilon, None if args.deadline is None else args.deadline / 1000.0,
+					args.compress, arc_flags=args.arc_flags)
+				if stats.bound is not None and stats.bound > 1:
+					sys.stderr.write('Route cost within %.4g times the optimum\n' % stats.bound)
+				elif stats.bound is None and path is not None and args.cost_func != 'segments' \
+						and (args.route_alg == 'anytime-astar' or (args.route_alg == 'astar' and args.epsilon is not None)):
+					sys.stderr.write('No suboptimality bound under the %s heuristic, use --heuristic alt\n' % args.heuristic)
+				output = None
+				if path is not None:
+					with stats.phase('format'):
+						output = format_route(graph, path, args.cost_func)
+				if cache is not None:
+					distance, hours = graph.path_totals(path, args.cost_func) if path is not None else (None, None)
+					cache.put(*(key + (distance, hours, None if path is None else [graph.names[u] for u in path])))
+		finally:
+			if cache is not None:
+				cache.close()
+		if output is None:
+			sys.stderr.write('No route from %s to %s\n' % (args.start_city, args.end_city))
+			exit_code = 1
+		else:
+			print(output)
+	if args.stats:
+		sys.stderr.write(json.dumps(stats.as_dict()) + '\n')
+	sys.exit(exit_code)
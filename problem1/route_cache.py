@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# route_cache.py : LRU cache of finished routes, with an optional sqlite tier on disk
+#
+# Results are keyed by (start_city, end_city, route_alg, cost_func), plus the heuristic
+# for the A* variants since the great-circle one is not exact on this data. All roads
+# are bidirectional, so for exact searches (uniform, bidirectional-uniform, ch, crp and
+# the A* variants with landmark bounds) a pair is stored once with the cities in sorted
+# order and a reversed query is answered from the same entry by reversing the route;
+# distance and time are the same both ways. Other searches (dfs, bfs, great-circle A*)
+# may find another route the other way, so their entries are kept per direction. The
+# sqlite tier is cleared when the road network it was filled from changes.
+
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 4096
+# puts between two sqlite commits
+COMMIT_EVERY = 256
+
+HEURISTIC_ALGORITHMS = ['astar', 'bidirectional-astar']
+# searches that find an optimal route whichever way round they run, the A* variants
+# only with an EXACT_HEURISTICS one
+SYMMETRIC_ALGORITHMS = ['uniform', 'bidirectional-uniform', 'ch', 'crp']
+EXACT_HEURISTICS = ['alt']
+
+
+# canonical key, plus whether the stored route runs end -> start for this query
+def route_key(start_city, end_city, route_alg, cost_func, heuristic='gps'):
+	symmetric = route_alg in SYMMETRIC_ALGORITHMS or \
+		(route_alg in HEURISTIC_ALGORITHMS and heuristic in EXACT_HEURISTICS)
+	if route_alg not in HEURISTIC_ALGORITHMS:
+		heuristic = ''
+	reverse = symmetric and end_city < start_city
+	if reverse:
+		start_city, end_city = end_city, start_city
+	return '%s %s %s %s %s' % (start_city, end_city, route_alg, cost_func, heuristic), reverse
+
+
+class RouteCache:
+	def __init__(self, size=DEFAULT_CACHE_SIZE, path=None, version=''):
+		self.size = size
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+		self.db = None
+		self.pending = 0
+		if path is not None:
+			self.db = sqlite3.connect(path, check_same_thread=False)
+			self.db.execute('CREATE TABLE IF NOT EXISTS routes '
+				'(key TEXT PRIMARY KEY, distance REAL, time REAL, route TEXT)')
+			self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+			row = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+			if row is None or row[0] != version:
+				self.db.execute('DELETE FROM routes')
+				self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+			self.db.commit()
+
+	def __len__(self):
+		return len(self.entries)
+
+	# (distance, time, route names) for the query, ((None, None, None) if the pair has
+	# no route), or None on a miss
+	def get(self, start_city, end_city, route_alg, cost_func, heuristic='gps'):
+		key, reverse = route_key(start_city, end_city, route_alg, cost_func, heuristic)
+		with self.lock:
+			value = self.entries.get(key)
+			if value is not None:
+				self.entries.move_to_end(key)
+			elif self.db is not None:
+				row = self.db.execute('SELECT distance, time, route FROM routes WHERE key = ?',
+					(key,)).fetchone()
+				if row is not None:
+					value = (row[0], row[1], json.loads(row[2]) if row[2] is not None else None)
+					self._remember(key, value)
+			if value is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+		distance, time, route = value
+		if reverse and route is not None:
+			route = route[::-1]
+		return distance, time, route
+
+	def put(self, start_city, end_city, route_alg, cost_func, heuristic, distance, time, route):
+		key, reverse = route_key(start_city, end_city, route_alg, cost_func, heuristic)
+		if reverse and route is not None:
+			route = route[::-1]
+		value = (distance, time, route)
+		with self.lock:
+			self._remember(key, value)
+			if self.db is not None:
+				self.db.execute('INSERT OR REPLACE INTO routes VALUES (?, ?, ?, ?)',
+					(key, distance, time, json.dumps(route) if route is not None else None))
+				self.pending += 1
+				if self.pending >= COMMIT_EVERY:
+					self.db.commit()
+					self.pending = 0
+
+	def _remember(self, key, value):
+		if self.size <= 0:
+			return
+		self.entries[key] = value
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.size:
+			self.entries.popitem(last=False)
+
+	def close(self):
+		with self.lock:
+			if self.db is not None:
+				self.db.commit()
+				self.db.close()
+				self.db = None
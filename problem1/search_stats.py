@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# search_stats.py : Counters and phase timings of one route query
+#
+# BFS, DFS, UNIFORM and ASTAR fill in a SearchStats passed as stats=:
+#   expanded  : cities taken off the fringe and expanded (stale heap entries not counted)
+#   generated : successors looked at while expanding
+#   pushes    : successors put on the fringe
+#   reopened  : already expanded cities put back on the fringe because a cheaper path
+#               was found, only possible with an inconsistent heuristic (gps A*)
+#   peak      : largest fringe size
+#   bound     : proven cost / optimal cost limit of the route found by weighted or
+#               anytime A* with the admissible landmark heuristic, None otherwise
+# and phase('load' | 'search' | 'format') times a block; find_route times 'search' itself.
+#
+#   stats = SearchStats()
+#   path = find_route(graph, s, t, 'astar', 'distance', stats=stats)
+#   stats.as_dict()
+
+import time
+from contextlib import contextmanager
+
+COUNTERS = ['expanded', 'generated', 'pushes', 'reopened', 'peak']
+
+
+class SearchStats:
+	def __init__(self):
+		for name in COUNTERS:
+			setattr(self, name, 0)
+		self.bound = None
+		# phase name -> seconds, in the order the phases ran
+		self.timings = {}
+
+	# add the counters of one search; peak keeps the maximum over searches
+	def add(self, expanded=0, generated=0, pushes=0, reopened=0, peak=0):
+		self.expanded += expanded
+		self.generated += generated
+		self.pushes += pushes
+		self.reopened += reopened
+		self.peak = max(self.peak, peak)
+
+	@contextmanager
+	def phase(self, name):
+		start = time.perf_counter()
+		try:
+			yield self
+		finally:
+			self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+	def as_dict(self):
+		result = dict((name, getattr(self, name)) for name in COUNTERS)
+		if self.bound is not None:
+			result['bound'] = self.bound
+		result['seconds'] = dict(self.timings)
+		return result
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# spatial.py : KD-tree over the cities in city-gps.txt
+#
+# Cities are placed on the unit sphere as (x, y, z); the straight-line (chord) distance
+# between two such points grows with their great-circle distance, so nearest neighbors
+# by chord are nearest by great circle and the tree needs no special case for the
+# poles or the date line. The tree is implicit: order holds the city ids, a node is
+# a range lo:hi of it split at mid = (lo + hi) // 2, with coordinate split[mid] of
+# everything left of mid <= key[mid] and of everything from mid on >= key[mid].
+# Cities missing from city-gps.txt are not indexed.
+#
+#   index = load_spatial_index(graph)
+#   index.nearest(39.17, -86.52, k=3)      # [(miles, city), ...] closest first
+#   index.within(39.17, -86.52, 25)        # every city within 25 miles
+
+import sys
+import numpy as np
+from heapq import heappush, heappushpop
+from road_graph import EARTH_RADIUS_MILES, load_graph
+
+# ranges at most this long are scanned with one vectorized distance computation
+LEAF_SIZE = 16
+
+
+def unit_vectors(lat, lon):
+	lat = np.radians(lat)
+	lon = np.radians(lon)
+	return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_miles(chord):
+	return 2 * EARTH_RADIUS_MILES * np.arcsin(np.minimum(chord / 2, 1.0))
+
+
+def miles_to_chord(miles):
+	return 2 * np.sin(min(miles / (2 * EARTH_RADIUS_MILES), np.pi / 2))
+
+
+class SpatialIndex:
+	def __init__(self, graph):
+		order = np.flatnonzero(~np.isnan(graph.lat))
+		points = unit_vectors(graph.lat[order], graph.lon[order])
+		split = [0] * len(order)
+		key = [0.0] * len(order)
+		# median splits on the widest axis, partitioning order/points in place
+		ranges = [(0, len(order))]
+		while ranges:
+			lo, hi = ranges.pop()
+			if hi - lo <= LEAF_SIZE:
+				continue
+			mid = (lo + hi) // 2
+			axis = int(np.argmax(np.ptp(points[lo:hi], axis=0)))
+			part = lo + np.argpartition(points[lo:hi, axis], mid - lo)
+			order[lo:hi] = order[part]
+			points[lo:hi] = points[part]
+			split[mid] = axis
+			key[mid] = float(points[mid, axis])
+			ranges.append((lo, mid))
+			ranges.append((mid, hi))
+		self.order = order
+		self.points = points
+		self.split = split
+		self.key = key
+
+	def __len__(self):
+		return len(self.order)
+
+	# k closest cities to (lat, lon) as [(miles, city)], closest first
+	def nearest(self, lat, lon, k=1):
+		if k <= 0 or not len(self):
+			return []
+		query = unit_vectors(lat, lon)[0]
+		q = query.tolist()
+		# max-heap of (-squared chord, city) holding the best k so far
+		best = []
+		stack = [(0, len(self.order), 0.0)]
+		while stack:
+			lo, hi, bound = stack.pop()
+			if len(best) == k and bound >= -best[0][0]:
+				continue
+			if hi - lo <= LEAF_SIZE:
+				d2 = ((self.points[lo:hi] - query) ** 2).sum(axis=1)
+				for i in np.argsort(d2)[:k].tolist():
+					entry = (-float(d2[i]), int(self.order[lo + i]))
+					if len(best) < k:
+						heappush(best, entry)
+					elif entry > best[0]:
+						heappushpop(best, entry)
+				continue
+			mid = (lo + hi) // 2
+			diff = q[self.split[mid]] - self.key[mid]
+			near, far = ((lo, mid), (mid, hi)) if diff < 0 else ((mid, hi), (lo, mid))
+			# far side first on the stack so the near side is searched first
+			stack.append((far[0], far[1], max(bound, diff * diff)))
+			stack.append((near[0], near[1], bound))
+		return sorted((float(chord_to_miles(np.sqrt(-d2))), city) for d2, city in best)
+
+	# every city within miles of (lat, lon) as [(miles, city)], closest first
+	def within(self, lat, lon, miles):
+		query = unit_vectors(lat, lon)[0]
+		q = query.tolist()
+		limit = miles_to_chord(miles) ** 2
+		found = []
+		stack = [(0, len(self.order))]
+		while stack:
+			lo, hi = stack.pop()
+			if hi - lo <= LEAF_SIZE:
+				d2 = ((self.points[lo:hi] - query) ** 2).sum(axis=1)
+				for i in np.flatnonzero(d2 <= limit).tolist():
+					found.append((float(chord_to_miles(np.sqrt(d2[i]))), int(self.order[lo + i])))
+				continue
+			mid = (lo + hi) // 2
+			diff = q[self.split[mid]] - self.key[mid]
+			if diff < 0 or diff * diff <= limit:
+				stack.append((lo, mid))
+			if diff >= 0 or diff * diff <= limit:
+				stack.append((mid, hi))
+		return sorted(found)
+
+
+# built in a few milliseconds, so kept in memory only
+def load_spatial_index(graph):
+	if 'spatial' not in graph.indexes:
+		graph.indexes['spatial'] = SpatialIndex(graph)
+	return graph.indexes['spatial']
+
+
+# the city closest to (lat, lon), None if there is none within max_miles
+def snap(graph, lat, lon, max_miles=None):
+	found = load_spatial_index(graph).nearest(lat, lon, 1)
+	if not found or (max_miles is not None and found[0][0] > max_miles):
+		return None
+	return found[0][1]
+
+
+if __name__ == '__main__':
+	# python spatial.py lat lon [k]
+	lat, lon = float(sys.argv[1]), float(sys.argv[2])
+	k = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+	graph = load_graph()
+	for miles, city in load_spatial_index(graph).nearest(lat, lon, k):
+		print('%8.2f %s' % (miles, graph.names[city]))
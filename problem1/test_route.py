@@ -0,0 +1,936 @@
+#!/usr/bin/env python3
+# test_route.py : Test the road graph and routing algorithms
+
+import io
+import os
+import itertools
+import json
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import TestCase
+from geopy.distance import great_circle
+import numpy as np
+
+import benchmark_route
+from contraction import load_hierarchy
+from landmarks import load_landmarks, one_to_all
+from pqueue import IndexedHeap
+from route_cache import RouteCache
+from search_stats import SearchStats
+from spatial import SpatialIndex
+from chains import ChainGraph
+from tree_cache import TreeCache
+from overlay import Overlay, build_partition, capped_time
+from hub_labels import load_hub_labels
+from arc_flags import load_arc_flags
+from tour import plan_tour, held_karp, improve_order, nearest_neighbor, order_cost
+from road_graph import RoadGraph, load_graph, build_cache, cache_is_fresh, open_graph, load_index, \
+	CACHE_NAME
+from route import distance_count, best_first, BFS, DFS, UNIFORM, ASTAR, BIDIRECTIONAL_UNIFORM, BIDIRECTIONAL_ASTAR, CH, CRP, \
+	ROUTE_ALGORITHMS, anytime_astar, hop_counts, find_route, format_route, answer_query, resolve_city, run_batch, make_server, one_to_many, distance_matrix, \
+	reachable_within
+
+# A-B-C-D is a slow chain, A-E-D a fast detour; F/G are their own component
+small_gps = """A 39.0 -86.0
+B 39.5 -86.0
+C 40.0 -86.0
+D 40.5 -86.0
+E 39.8 -85.5
+"""
+small_segments = """A B 35 30 R_1
+B C 35 30 R_1
+C D 35 30 R_1
+A E 60 65 I_1
+E D 60 65 I_1
+F G 10  R_2
+"""
+
+
+# n x n grid with random integer lengths, no coordinates unless lat/lon are given
+def grid_graph(n, seed=0, lat=None, lon=None):
+	rng = random.Random(seed)
+	names = ['c%d' % i for i in range(n * n)]
+	src, dst, length, speed = [], [], [], []
+	for r in range(n):
+		for c in range(n):
+			for dr, dc in [(0, 1), (1, 0)]:
+				if r + dr < n and c + dc < n:
+					src.append(r * n + c)
+					dst.append((r + dr) * n + c + dc)
+					length.append(rng.randint(0, 30))
+					speed.append(rng.choice([30, 45, 65]))
+	nan = [float('nan')] * (n * n)
+	return RoadGraph.from_segments(names, src, dst, length, speed, [0] * len(src), [''],
+		nan if lat is None else lat, nan if lon is None else lon)
+
+
+# grid_graph laid out on a 0.1 degree grid, so partitions cut it into blocks
+def located_grid_graph(n, seed=0):
+	return grid_graph(n, seed, np.repeat(np.arange(n) * 0.1 + 39, n), np.tile(np.arange(n) * 0.1 - 86, n))
+
+
+# grid_graph with every road split into a run of up to three pass-through cities,
+# plus a ring of pass-through cities hanging off city 0
+def chain_graph(n, seed=0):
+	grid = grid_graph(n, seed)
+	rng = random.Random(seed)
+	names = list(grid.names)
+	src, dst, length, speed = [], [], [], []
+
+	def road(u, v, miles, mph):
+		src.append(u)
+		dst.append(v)
+		length.append(miles)
+		speed.append(mph)
+	for u in range(len(grid)):
+		for e in range(grid.offsets[u], grid.offsets[u + 1]):
+			v = int(grid.targets[e])
+			if u > v:
+				continue
+			prev = u
+			for _ in range(rng.randint(0, 3)):
+				names.append('x%d' % len(names))
+				road(prev, len(names) - 1, rng.randint(1, 10), rng.choice([30, 45, 65]))
+				prev = len(names) - 1
+			road(prev, v, float(grid.length[e]), float(grid.speed[e]))
+	ring = list(range(len(names), len(names) + 4))
+	names.extend('r%d' % i for i in range(4))
+	for a, b in zip([0] + ring, ring + [0]):
+		road(a, b, rng.randint(1, 10), 45)
+	nan = [float('nan')] * len(names)
+	return RoadGraph.from_segments(names, src, dst, length, speed, [0] * len(src), [''], nan, nan)
+
+
+def write_small_dataset(data_dir):
+	with open(os.path.join(data_dir, 'city-gps.txt'), 'w') as f:
+		f.write(small_gps)
+	with open(os.path.join(data_dir, 'road-segments.txt'), 'w') as f:
+		f.write(small_segments)
+
+
+# tests on the small dataset, written to a temporary data directory per test
+class SmallDatasetTest(TestCase):
+
+	def setUp(self):
+		self.data_dir = tempfile.mkdtemp()
+		write_small_dataset(self.data_dir)
+		self.graph = load_graph(self.data_dir)
+
+	def tearDown(self):
+		shutil.rmtree(self.data_dir)
+
+	def ids(self, *names):
+		return [self.graph.city_id(n) for n in names]
+
+
+class SmallGraphTest(SmallDatasetTest):
+
+	def test_csr_layout(self):
+		graph = self.graph
+		self.assertEqual(len(graph), 7)
+		self.assertEqual(graph.num_edges, 12)
+		a = graph.city_id('A')
+		neighbors = graph.targets[graph.offsets[a]:graph.offsets[a + 1]].tolist()
+		self.assertEqual(neighbors, self.ids('B', 'E'))
+		self.assertEqual(graph.max_speed, 65)
+
+	def test_missing_speed_defaults(self):
+		f = self.graph.city_id('F')
+		e = self.graph.offsets[f]
+		self.assertEqual(self.graph.speed[e], 45)
+		self.assertEqual(self.graph.highway_names[self.graph.highway[e]], 'R_2')
+		self.assertFalse(self.graph.has_gps(f))
+
+	def test_vectorized_great_circle(self):
+		graph = self.graph
+		d = graph.city_id('D')
+		miles = distance_count(graph, d)
+		for name in ['A', 'B', 'E']:
+			u = graph.city_id(name)
+			expected = great_circle((graph.lat[u], graph.lon[u]), (graph.lat[d], graph.lon[d])).miles
+			self.assertAlmostEqual(miles[u], expected, places=6)
+		self.assertEqual(miles[d], 0)
+		self.assertEqual(miles[graph.city_id('F')], 0)
+
+	def test_bfs_dfs(self):
+		a, d = self.ids('A', 'D')
+		self.assertEqual(BFS(self.graph, a, d), self.ids('A', 'E', 'D'))
+		self.assertEqual(DFS(self.graph, a, d)[-1], d)
+
+	def test_hop_counts(self):
+		a, d, f = self.ids('A', 'D', 'F')
+		hops = hop_counts(self.graph, a)
+		self.assertEqual(hops[d], 2)
+		self.assertEqual(hops[f], -1)
+		graph = grid_graph(9, seed=4)
+		for source in [0, 40, 80]:
+			hops = hop_counts(graph, source)
+			# Dijkstra on unit weights
+			exact = one_to_all(graph, source, 'segments')[0]
+			for target in range(len(graph)):
+				self.assertEqual(hops[target], exact[target])
+				self.assertEqual(len(BFS(graph, source, target)) - 1, exact[target])
+
+	def test_uniform_astar(self):
+		a, d = self.ids('A', 'D')
+		for alg in [UNIFORM, ASTAR, BIDIRECTIONAL_UNIFORM, BIDIRECTIONAL_ASTAR, CH, CRP]:
+			self.assertEqual(alg(self.graph, a, d, 'distance'), self.ids('A', 'B', 'C', 'D'))
+			self.assertEqual(alg(self.graph, a, d, 'time'), self.ids('A', 'E', 'D'))
+
+	def test_unreachable(self):
+		a, f = self.ids('A', 'F')
+		for alg in [UNIFORM, ASTAR, BIDIRECTIONAL_UNIFORM, BIDIRECTIONAL_ASTAR, CH, CRP]:
+			self.assertIsNone(alg(self.graph, a, f, 'distance'))
+		self.assertEqual(one_to_many(self.graph, a, [f], 'distance'), [float('inf')])
+
+	def test_components(self):
+		a, d, f, g = self.ids('A', 'D', 'F', 'G')
+		self.assertTrue(self.graph.connected(a, d))
+		self.assertTrue(self.graph.connected(f, g))
+		self.assertFalse(self.graph.connected(a, f))
+		# rejected before any city is expanded
+		for alg in ['bfs', 'dfs', 'uniform', 'astar']:
+			stats = SearchStats()
+			self.assertIsNone(find_route(self.graph, a, f, alg, 'distance', stats=stats))
+			self.assertEqual(stats.expanded, 0)
+
+	def test_search_stats(self):
+		a, d = self.ids('A', 'D')
+		stats = SearchStats()
+		find_route(self.graph, a, d, 'uniform', 'distance', stats=stats)
+		# A, B, E, C expanded, D popped as the goal
+		self.assertEqual((stats.expanded, stats.generated, stats.reopened), (5, 8, 0))
+		self.assertIn('search', stats.timings)
+		stats = SearchStats()
+		BFS(self.graph, a, d, stats)
+		# A, B, E expanded, D found while generating from E
+		self.assertEqual((stats.expanded, stats.generated, stats.peak), (3, 6, 2))
+
+	def test_stats_count_reopened_cities(self):
+		graph = grid_graph(10, seed=1)
+		rng = random.Random(0)
+		# random h far above the real costs is inconsistent, expanded cities get improved later
+		h = [rng.uniform(0, 200) for _ in range(len(graph))]
+		for queue in ['heap', 'indexed']:
+			stats = SearchStats()
+			best_first(graph, 0, 99, 'distance', h, queue, stats)
+			self.assertGreater(stats.reopened, 0)
+			self.assertEqual(stats.as_dict()['reopened'], stats.reopened)
+		stats = SearchStats()
+		UNIFORM(graph, 0, 99, 'distance', stats=stats)
+		self.assertEqual(stats.reopened, 0)
+
+	def test_format_route(self):
+		path = self.ids('A', 'B', 'C', 'D')
+		self.assertEqual(format_route(self.graph, path), '105.0 3.5 A B C D')
+
+
+class SpatialIndexTest(SmallDatasetTest):
+
+	def test_matches_linear_scan(self):
+		rng = random.Random(5)
+		n = 500
+		lat = [rng.uniform(25, 49) for _ in range(n)]
+		lon = [rng.uniform(-125, -67) for _ in range(n)]
+		# a few cities without coordinates are left out of the index
+		lat[:10] = [float('nan')] * 10
+		graph = RoadGraph.from_segments(['c%d' % i for i in range(n)], [], [], [], [], [], [''], lat, lon)
+		index = SpatialIndex(graph)
+		self.assertEqual(len(index), n - 10)
+		for _ in range(30):
+			point = (rng.uniform(20, 50), rng.uniform(-130, -60))
+			exact = sorted((great_circle(point, (lat[c], lon[c])).miles, c) for c in range(10, n))
+			found = index.nearest(point[0], point[1], 7)
+			self.assertEqual([c for _, c in found], [c for _, c in exact[:7]])
+			for (miles, _), (expected, _) in zip(found, exact):
+				self.assertAlmostEqual(miles, expected, places=6)
+			radius = rng.uniform(0, 300)
+			self.assertEqual([c for _, c in index.within(point[0], point[1], radius)],
+				[c for m, c in exact if m <= radius])
+
+	def test_resolve_coordinates(self):
+		graph = self.graph
+		self.assertEqual(resolve_city(graph, '39.7,-85.65'), graph.city_id('E'))
+		self.assertEqual(resolve_city(graph, 'B'), graph.city_id('B'))
+		self.assertRaises(KeyError, resolve_city, graph, 'X,Y')
+		answer = answer_query(graph, {'start': '39.01,-86.0', 'end': 'D', 'algorithm': 'uniform', 'cost': 'time'})
+		self.assertEqual(answer['route'], ['A', 'E', 'D'])
+
+
+class BatchTest(TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.data_dir = tempfile.mkdtemp()
+		write_small_dataset(cls.data_dir)
+		cls.graph = load_graph(cls.data_dir)
+
+	@classmethod
+	def tearDownClass(cls):
+		shutil.rmtree(cls.data_dir)
+
+	queries = ['A\tD\tuniform\tdistance\n',
+		'\n',
+		'{"id": 1, "start": "A", "end": "D", "algorithm": "astar", "cost": "time"}\n',
+		'A X uniform time\n',
+		'{"start": "A", "end": "D", "algorithm": "astar"}\n']
+
+	def check_answers(self, lines):
+		self.assertEqual(len(lines), 4)
+		self.assertEqual(lines[0], '105.0 3.5 A B C D')
+		answer = json.loads(lines[1])
+		self.assertEqual((answer['id'], answer['route'], answer['distance']), (1, ['A', 'E', 'D'], 120.0))
+		self.assertTrue(lines[2].startswith('ERROR'))
+		self.assertIn('cost', json.loads(lines[3])['error'])
+
+	def test_run_batch(self):
+		out = io.StringIO()
+		run_batch(self.graph, self.queries, out)
+		self.check_answers(out.getvalue().splitlines())
+
+	def test_bad_city_fields(self):
+		out = io.StringIO()
+		run_batch(self.graph, ['{"start": 5, "end": "D", "algorithm": "uniform", "cost": "time"}\n',
+			'{"start": "A", "waypoints": [["D"]], "cost": "time"}\n', 'A D uniform distance\n'], out)
+		lines = out.getvalue().splitlines()
+		self.assertIn('5', json.loads(lines[0])['error'])
+		self.assertIn("['D']", json.loads(lines[1])['error'])
+		self.assertEqual(lines[2], '105.0 3.5 A B C D')
+
+	def test_run_batch_with_cache(self):
+		cache = RouteCache(10)
+		out = io.StringIO()
+		run_batch(self.graph, ['A D uniform distance\n', 'D A uniform distance\n', 'A F uniform time\n'] * 2, out, cache)
+		lines = out.getvalue().splitlines()
+		self.assertEqual(lines[:3], lines[3:])
+		self.assertEqual(lines[1], '105.0 3.5 D C B A')
+		self.assertTrue(lines[2].startswith('ERROR No route'))
+		self.assertEqual((cache.hits, cache.misses, len(cache)), (4, 2, 2))
+
+	def test_unreachable_answer(self):
+		answer = answer_query(self.graph, {'start': 'A', 'end': 'G', 'algorithm': 'astar', 'cost': 'time'})
+		self.assertEqual(answer['error'], 'No route from A to G')
+		self.assertTrue(answer['unreachable'])
+
+	def test_server(self):
+		socket_path = os.path.join(self.data_dir, 'route.sock')
+		server = make_server(self.graph, socket_path)
+		thread = threading.Thread(target=server.serve_forever)
+		thread.start()
+		try:
+			client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			client.connect(socket_path)
+			reader = client.makefile('r')
+			client.sendall(''.join(self.queries).encode('utf-8'))
+			self.check_answers([reader.readline().rstrip('\n') for _ in range(4)])
+			client.close()
+		finally:
+			server.shutdown()
+			server.server_close()
+			thread.join()
+
+	def test_server_path_in_use(self):
+		socket_path = os.path.join(self.data_dir, 'notes.txt')
+		with open(socket_path, 'w') as f:
+			f.write('notes')
+		self.assertRaises(FileExistsError, make_server, self.graph, socket_path)
+		self.assertTrue(os.path.isfile(socket_path))
+		socket_path = os.path.join(self.data_dir, 'live.sock')
+		server = make_server(self.graph, socket_path)
+		try:
+			self.assertRaises(FileExistsError, make_server, self.graph, socket_path)
+		finally:
+			server.server_close()
+		# nobody listens on the socket file any more, so it is replaced
+		make_server(self.graph, socket_path).server_close()
+		os.unlink(socket_path)
+
+
+class PriorityQueueTest(SmallDatasetTest):
+
+	def test_indexed_heap_decrease_key(self):
+		rng = random.Random(5)
+		queue = IndexedHeap(50)
+		best = {}
+		for _ in range(200):
+			city, key = rng.randrange(50), rng.random()
+			if key < best.get(city, float('inf')):
+				best[city] = key
+				queue.push(city, key)
+		self.assertEqual(len(queue), len(best))
+		self.assertEqual(queue.peak, len(best))
+		popped = [queue.pop() for _ in range(len(best))]
+		self.assertEqual(popped, sorted((k, c) for c, k in best.items()))
+		self.assertFalse(queue)
+
+	def test_searches_agree_across_queues(self):
+		graph = grid_graph(10, seed=3)
+		rng = random.Random(6)
+		for _ in range(20):
+			s, t = rng.randrange(len(graph)), rng.randrange(len(graph))
+			heap_stats, indexed_stats = SearchStats(), SearchStats()
+			expected = graph.path_totals(UNIFORM(graph, s, t, 'time', 'heap', heap_stats), 'time')[1]
+			path = UNIFORM(graph, s, t, 'time', 'indexed', indexed_stats)
+			self.assertAlmostEqual(graph.path_totals(path, 'time')[1], expected)
+			path = ASTAR(graph, s, t, 'time', 'alt', 'indexed')
+			self.assertAlmostEqual(graph.path_totals(path, 'time')[1], expected)
+			self.assertLessEqual(indexed_stats.peak, len(graph))
+
+	def test_dial_buckets(self):
+		# grid lengths are integers, including zero-length roads
+		graph = grid_graph(12, seed=8)
+		rng = random.Random(2)
+		for _ in range(30):
+			s, t = rng.randrange(len(graph)), rng.randrange(len(graph))
+			heap_stats, dial_stats = SearchStats(), SearchStats()
+			expected = graph.path_totals(UNIFORM(graph, s, t, 'distance', 'heap', heap_stats), 'distance')[0]
+			path = UNIFORM(graph, s, t, 'distance', 'dial', dial_stats)
+			self.assertEqual(graph.path_totals(path, 'distance')[0], expected)
+			self.assertEqual(dial_stats.reopened, 0)
+			# landmark bounds on integer lengths are integers too
+			path = ASTAR(graph, s, t, 'distance', 'alt', 'dial')
+			self.assertEqual(graph.path_totals(path, 'distance')[0], expected)
+		self.assertRaises(ValueError, UNIFORM, graph, 0, len(graph) - 1, 'time', 'dial')
+		small = self.graph
+		# great-circle bounds are not whole miles
+		self.assertRaises(ValueError, ASTAR, small, small.city_id('A'), small.city_id('D'), 'distance', 'gps', 'dial')
+
+
+class DistanceMatrixTest(TestCase):
+
+	def test_one_to_many(self):
+		graph = grid_graph(8)
+		exact = one_to_all(graph, 5, 'time')[0]
+		self.assertEqual(one_to_many(graph, 5, [5, 0, 63, 20], 'time'), [exact[t] for t in [5, 0, 63, 20]])
+
+	def test_matrix_with_process_pool(self):
+		graph = grid_graph(8)
+		sources = [0, 9, 18, 27, 36, 45, 54, 63, 1, 2]
+		targets = [7, 56, 30]
+		for processes in [1, 2]:
+			matrix = distance_matrix(graph, sources, targets, 'distance', processes=processes, chunk_size=3)
+			self.assertEqual(matrix.shape, (10, 3))
+			for i, s in enumerate(sources):
+				exact = one_to_all(graph, s, 'distance')[0]
+				self.assertEqual(matrix[i].tolist(), [exact[t] for t in targets])
+
+
+class ArcFlagTest(TestCase):
+
+	def test_matches_uniform(self):
+		graph = located_grid_graph(10, seed=8)
+		rng = random.Random(5)
+		for cost_func, i in [('distance', 0), ('time', 1)]:
+			flags = load_arc_flags(graph, cost_func, regions=8)
+			self.assertEqual(flags.regions, 8)
+			self.assertLess(sum(flags.flagged_share()), 8)
+			for _ in range(100):
+				s, t = rng.randrange(len(graph)), rng.randrange(len(graph))
+				expected = graph.path_totals(UNIFORM(graph, s, t, cost_func), cost_func)[i]
+				for path in [UNIFORM(graph, s, t, cost_func, adjacency=flags.adjacency(t)),
+						ASTAR(graph, s, t, cost_func, 'alt', adjacency=flags.adjacency(t)),
+						find_route(graph, s, t, 'uniform', cost_func, arc_flags=True)]:
+					self.assertEqual((path[0], path[-1]), (s, t))
+					self.assertAlmostEqual(graph.path_totals(path, cost_func)[i], expected)
+
+
+class TourTest(SmallDatasetTest):
+
+	def test_held_karp_is_exact(self):
+		rng = random.Random(9)
+		for k in range(1, 7):
+			for end in [False, True]:
+				points = [(rng.uniform(0, 100), rng.uniform(0, 100)) for _ in range(k + (2 if end else 1))]
+				cost = [[abs(a[0] - b[0]) + abs(a[1] - b[1]) for b in points] for a in points]
+				tail = [k + 1] if end else []
+				best = min(order_cost(cost, [0] + list(p) + tail) for p in itertools.permutations(range(1, k + 1)))
+				self.assertAlmostEqual(order_cost(cost, [0] + held_karp(cost, end) + tail), best)
+				order = improve_order(cost, nearest_neighbor(cost, end), end)
+				self.assertEqual(sorted(order), list(range(1, k + 1)))
+				self.assertLessEqual(order_cost(cost, [0] + order + tail),
+					order_cost(cost, [0] + nearest_neighbor(cost, end) + tail) + 1e-9)
+
+	def test_stitched_route(self):
+		graph = grid_graph(8, seed=10)
+		rng = random.Random(11)
+		for k in [4, 20]:
+			waypoints = rng.sample(range(1, len(graph)), k)
+			order, path = plan_tour(graph, 0, waypoints, 0, 'time')
+			self.assertEqual(sorted(order), sorted(waypoints))
+			self.assertEqual((path[0], path[-1]), (0, 0))
+			stops = [0] + order + [0]
+			# legs are shortest routes, visited in order
+			expected = sum(graph.path_totals(UNIFORM(graph, a, b, 'time'), 'time')[1] for a, b in zip(stops, stops[1:])
+				if a != b)
+			self.assertAlmostEqual(graph.path_totals(path, 'time')[1], expected)
+			at = [path.index(stop) for stop in order]
+			self.assertEqual(at, sorted(at))
+
+	def test_answer_tour(self):
+		graph = self.graph
+		result = answer_query(graph, {'start': 'A', 'waypoints': ['D', 'B'], 'cost': 'distance'})
+		self.assertEqual((result['order'], result['route'], result['distance']), (['B', 'D'], list('ABCD'), 105))
+		result = answer_query(graph, {'start': 'A', 'waypoints': ['B', 'F'], 'end': 'A', 'cost': 'distance'})
+		self.assertTrue(result['unreachable'])
+
+
+class ReachabilityTest(SmallDatasetTest):
+
+	def test_matches_dijkstra(self):
+		graph = grid_graph(10, seed=12)
+		for cost_func in ['segments', 'distance', 'time']:
+			exact = one_to_all(graph, 3, cost_func)[0]
+			budget = sorted(exact)[len(graph) // 3]
+			reached = reachable_within(graph, 3, budget, cost_func)
+			self.assertEqual(sorted(city for _, city, _ in reached), [c for c in range(len(graph)) if exact[c] <= budget])
+			for g, city, source in reached:
+				self.assertAlmostEqual(g, exact[city])
+				self.assertEqual(source, 3)
+			costs = [g for g, _, _ in reached]
+			self.assertEqual(costs, sorted(costs))
+
+	def test_multiple_sources_and_early_stop(self):
+		graph = grid_graph(10, seed=13)
+		sources = [0, 55, 99]
+		exact = [one_to_all(graph, s, 'time')[0] for s in sources]
+		budget = 0.5 * max(min(row[c] for row in exact) for c in range(len(graph)))
+		stats = SearchStats()
+		reached = reachable_within(graph, sources, budget, 'time', stats)
+		for g, city, source in reached:
+			closest = min(row[city] for row in exact)
+			self.assertAlmostEqual(g, closest)
+			self.assertAlmostEqual(exact[sources.index(source)][city], closest)
+		self.assertEqual(len(reached), sum(1 for c in range(len(graph)) if min(row[c] for row in exact) <= budget))
+		# nothing past the budget is expanded
+		self.assertEqual(stats.expanded, len(reached))
+		self.assertLess(stats.expanded, len(graph))
+		self.assertEqual(reachable_within(graph, sources, 0, 'time'), [(0, s, s) for s in sources])
+
+	def test_answer_reachable(self):
+		graph = self.graph
+		result = answer_query(graph, {'start': 'A', 'budget': 100, 'cost': 'distance'})
+		self.assertEqual([city for city, _, _ in result['reachable']], ['A', 'B', 'E', 'C'])
+		result = answer_query(graph, {'start': ['A', 'F'], 'budget': 0, 'cost': 'time'})
+		self.assertEqual(result['reachable'], [['A', 0, 'A'], ['F', 0, 'F']])
+		self.assertIn('budget', answer_query(graph, {'start': 'A', 'budget': -1, 'cost': 'time'})['error'])
+		self.assertEqual(answer_query(graph, {'start': 'A', 'budget': '5', 'cost': 'time'})['error'],
+			"budget must be a number >= 0, got '5'")
+		self.assertEqual(answer_query(graph, {'start': 'X', 'budget': 5, 'cost': 'time'})['error'], "City X not found in road network")
+
+
+class HubLabelTest(SmallDatasetTest):
+
+	def test_matches_dijkstra(self):
+		graph = grid_graph(9, seed=7)
+		for cost_func in ['distance', 'time', 'segments']:
+			labels = load_hub_labels(graph, cost_func)
+			self.assertLess(labels.average_label, len(graph))
+			for s in range(len(graph)):
+				exact = one_to_all(graph, s, cost_func)[0]
+				# hub sums add the same roads in another order
+				self.assertTrue(np.allclose(labels.distances(s, range(len(graph))), exact))
+				for t in [0, s // 2, len(graph) - 1]:
+					self.assertAlmostEqual(labels.distance(s, t), exact[t])
+		matrix = distance_matrix(graph, [0, 40], [80, 3], 'distance', hub_labels=True)
+		self.assertEqual(matrix.tolist(), distance_matrix(graph, [0, 40], [80, 3], 'distance').tolist())
+
+	def test_stored_labels(self):
+		a, d, f = self.ids('A', 'D', 'F')
+		load_hub_labels(self.graph, 'distance')
+		# a fresh graph maps the stored file instead of building again
+		labels = load_hub_labels(load_graph(self.data_dir), 'distance')
+		self.assertFalse(labels.hubs.flags.writeable)
+		self.assertEqual(labels.distance(a, d), 105)
+		self.assertEqual(labels.distance(a, f), float('inf'))
+
+	def test_distance_query(self):
+		graph = self.graph
+		out = io.StringIO()
+		run_batch(graph, ['{"id": 1, "start": "A", "end": "D", "cost": "time", "hub_labels": true}\n',
+			'{"start": "A", "end": "F", "cost": "distance", "hub_labels": true}\n'], out)
+		answers = [json.loads(line) for line in out.getvalue().splitlines()]
+		self.assertEqual((answers[0]['id'], answers[0]['time']), (1, 120 / 65.0))
+		self.assertNotIn('route', answers[0])
+		self.assertTrue(answers[1]['unreachable'])
+
+
+class RouteCacheTest(TestCase):
+
+	def test_lru_eviction(self):
+		cache = RouteCache(2)
+		for end in ['B', 'C', 'D']:
+			cache.put('A', end, 'uniform', 'distance', 'gps', 1.0, 2.0, ['A', end])
+		self.assertIsNone(cache.get('A', 'B', 'uniform', 'distance'))
+		self.assertEqual(cache.get('A', 'C', 'uniform', 'distance'), (1.0, 2.0, ['A', 'C']))
+		cache.put('A', 'E', 'uniform', 'distance', 'gps', 1.0, 2.0, ['A', 'E'])
+		self.assertIsNone(cache.get('A', 'D', 'uniform', 'distance'))
+		self.assertIsNotNone(cache.get('A', 'C', 'uniform', 'distance'))
+
+	def test_symmetric_and_keyed(self):
+		cache = RouteCache(8)
+		cache.put('Z', 'A', 'astar', 'time', 'alt', 3.0, 1.5, ['Z', 'M', 'A'])
+		self.assertEqual(cache.get('A', 'Z', 'astar', 'time', 'alt'), (3.0, 1.5, ['A', 'M', 'Z']))
+		self.assertEqual(cache.get('Z', 'A', 'astar', 'time', 'alt')[2], ['Z', 'M', 'A'])
+		self.assertIsNone(cache.get('A', 'Z', 'astar', 'time', 'gps'))
+		self.assertIsNone(cache.get('A', 'Z', 'astar', 'distance', 'alt'))
+		# the heuristic does not matter for searches that do not use one
+		cache.put('A', 'Z', 'uniform', 'time', 'gps', 3.0, 1.5, ['A', 'Z'])
+		self.assertIsNotNone(cache.get('A', 'Z', 'uniform', 'time', 'alt'))
+		# searches that are not exact keep one entry per direction
+		for alg, heuristic in [('dfs', 'gps'), ('bfs', 'gps'), ('astar', 'gps')]:
+			cache.put('A', 'Z', alg, 'time', heuristic, 3.0, 1.5, ['A', 'Z'])
+			self.assertIsNone(cache.get('Z', 'A', alg, 'time', heuristic))
+			self.assertEqual(cache.get('A', 'Z', alg, 'time', heuristic)[2], ['A', 'Z'])
+
+	def test_sqlite_tier(self):
+		data_dir = tempfile.mkdtemp()
+		try:
+			path = os.path.join(data_dir, 'routes.db')
+			cache = RouteCache(4, path, 'v1')
+			cache.put('A', 'B', 'uniform', 'distance', 'gps', 1.0, 2.0, ['A', 'B'])
+			cache.put('A', 'F', 'uniform', 'distance', 'gps', None, None, None)
+			cache.close()
+			cache = RouteCache(4, path, 'v1')
+			self.assertEqual(cache.get('B', 'A', 'uniform', 'distance'), (1.0, 2.0, ['B', 'A']))
+			self.assertEqual(cache.get('A', 'F', 'uniform', 'distance'), (None, None, None))
+			cache.close()
+			# a different road network clears the disk tier
+			cache = RouteCache(4, path, 'v2')
+			self.assertIsNone(cache.get('A', 'B', 'uniform', 'distance'))
+			cache.close()
+		finally:
+			shutil.rmtree(data_dir)
+
+
+class ContractionHierarchyTest(SmallDatasetTest):
+
+	def test_matches_uniform_on_grid(self):
+		graph = grid_graph(12)
+		rng = random.Random(1)
+		for cost in ['distance', 'time']:
+			ch = load_hierarchy(graph, cost)
+			self.assertIs(load_hierarchy(graph, cost), ch)
+			for _ in range(50):
+				s, t = rng.randrange(len(graph)), rng.randrange(len(graph))
+				expected = graph.path_totals(UNIFORM(graph, s, t, cost), cost)
+				cost_ch, path = ch.query(s, t)
+				self.assertEqual((path[0], path[-1]), (s, t))
+				i = 0 if cost == 'distance' else 1
+				self.assertAlmostEqual(graph.path_totals(path, cost)[i], expected[i])
+				self.assertAlmostEqual(cost_ch, expected[i])
+
+	def test_hierarchy_persisted(self):
+		load_hierarchy(self.graph, 'time')
+		self.assertTrue(os.path.exists(os.path.join(self.data_dir, 'road-graph-ch-time.bin')))
+		graph = load_graph(self.data_dir)
+		a, d = graph.city_id('A'), graph.city_id('D')
+		self.assertEqual(CH(graph, a, d, 'time'), [a, graph.city_id('E'), d])
+
+
+class LandmarkTest(TestCase):
+
+	def test_bounds_are_admissible(self):
+		graph = grid_graph(10)
+		for strategy in ['farthest', 'avoid']:
+			alt = load_landmarks(graph, 'distance', strategy, 4)
+			self.assertEqual(len(set(alt.landmarks)), 4)
+			exact = one_to_all(graph, 7, 'distance')[0]
+			for city, bound in enumerate(alt.bounds_to(7)):
+				self.assertLessEqual(bound, exact[city] + 1e-9)
+
+	def test_alt_astar_matches_uniform_without_gps(self):
+		graph = grid_graph(10, seed=2)
+		rng = random.Random(4)
+		for cost in ['distance', 'time']:
+			i = 0 if cost == 'distance' else 1
+			for _ in range(30):
+				s, t = rng.randrange(len(graph)), rng.randrange(len(graph))
+				expected = graph.path_totals(UNIFORM(graph, s, t, cost), cost)[i]
+				for alg in [ASTAR, BIDIRECTIONAL_ASTAR]:
+					path = alg(graph, s, t, cost, 'alt')
+					self.assertAlmostEqual(graph.path_totals(path, cost)[i], expected)
+
+
+class OverlayTest(SmallDatasetTest):
+
+	def test_partition_is_nested(self):
+		graph = located_grid_graph(12, seed=6)
+		# coordinates go through the constructor, so great-circle distances are real
+		self.assertAlmostEqual(distance_count(graph, 0)[1], great_circle((39, -86), (39, -85.9)).miles, places=6)
+		fine, coarse = build_partition(graph, [8, 40])
+		self.assertLessEqual(max(np.bincount(fine)), 8)
+		self.assertLessEqual(max(np.bincount(coarse)), 40)
+		for c in set(fine.tolist()):
+			self.assertEqual(len(set(coarse[fine == c].tolist())), 1)
+
+	def test_matches_uniform(self):
+		graph = located_grid_graph(12, seed=6)
+		crp = Overlay(graph, build_partition(graph, [6, 24, 72]))
+		# a metric of its own: every road at most 40 mph
+		crp.customize('slow', capped_time(graph, 40))
+		slow = RoadGraph(graph.names, graph.offsets, graph.targets, graph.length, np.minimum(graph.speed, 40),
+			graph.highway, graph.highway_names, graph.lat, graph.lon)
+		rng = random.Random(3)
+		for cost, i, reference in [('distance', 0, graph), ('time', 1, graph), ('slow', 1, slow)]:
+			for _ in range(60):
+				s, t = rng.randrange(len(graph)), rng.randrange(len(graph))
+				expected = reference.path_totals(UNIFORM(reference, s, t, 'time' if cost == 'slow' else cost),
+					'distance' if cost == 'distance' else 'time')[i]
+				total, path = crp.query(s, t, cost)
+				self.assertEqual((path[0], path[-1]), (s, t))
+				self.assertAlmostEqual(total, expected)
+				self.assertAlmostEqual(reference.path_totals(path, 'distance' if cost == 'distance' else 'time')[i],
+					expected)
+
+	def test_stored_cliques(self):
+		graph = self.graph
+		cells = build_partition(graph, [2, 4])
+		built = Overlay(graph, cells, 'crp-test').metric('time')
+		self.assertTrue(os.path.exists(os.path.join(self.data_dir, 'road-graph-crp-test-time.bin')))
+		# a fresh process maps the stored cliques instead of searching again
+		loaded = Overlay(load_graph(self.data_dir), cells, 'crp-test')
+		loaded._cliques = None
+		self.assertEqual(loaded.metric('time'), built)
+
+
+class TreeCacheTest(TestCase):
+
+	def test_matches_uniform(self):
+		graph = grid_graph(8, seed=5)
+		trees = TreeCache()
+		rng = random.Random(2)
+		depots = [0, 17, 40]
+		for _ in range(100):
+			s, t = rng.choice(depots), rng.randrange(len(graph))
+			if rng.random() < 0.3:
+				s, t = t, s
+			stats = SearchStats()
+			path = find_route(graph, s, t, 'uniform', 'time', stats=stats, trees=trees)
+			self.assertEqual((path[0], path[-1]), (s, t))
+			self.assertAlmostEqual(graph.path_totals(path, 'time')[1],
+				graph.path_totals(UNIFORM(graph, s, t, 'time'), 'time')[1])
+		# reversed queries are answered from a depot's tree once it settled their start
+		self.assertTrue(set((d, 'time') for d in depots) <= set(trees.trees))
+		self.assertGreater(trees.hits, trees.misses)
+
+	def test_resume_and_evict(self):
+		graph = grid_graph(8, seed=5)
+		trees = TreeCache()
+		stats = SearchStats()
+		trees.route(graph, 0, 1, 'distance', stats)
+		first = stats.expanded
+		# a settled city needs no search, a farther one resumes instead of restarting
+		trees.route(graph, 0, 1, 'distance', stats)
+		self.assertEqual(stats.expanded, first)
+		trees.route(graph, 0, 63, 'distance', stats)
+		full = SearchStats()
+		UNIFORM(graph, 0, 63, 'distance', stats=full)
+		self.assertEqual(stats.expanded, full.expanded)
+		self.assertEqual((trees.hits, trees.misses), (1, 2))
+
+		trees.max_bytes = trees.nbytes
+		trees.route(graph, 5, 6, 'distance')
+		self.assertEqual(list(trees.trees), [(5, 'distance')])
+
+
+class ChainCompressionTest(SmallDatasetTest):
+
+	def test_matches_uniform(self):
+		graph = chain_graph(6, seed=3)
+		chains = ChainGraph(graph)
+		self.assertLess(chains.num_core, len(graph) // 2)
+		rng = random.Random(1)
+		zeros = [0] * (len(graph) + 1)
+		for cost, i in [('distance', 0), ('time', 1)]:
+			for _ in range(150):
+				s, t = rng.randrange(len(graph)), rng.randrange(len(graph))
+				expected = graph.path_totals(UNIFORM(graph, s, t, cost), cost)[i]
+				path = chains.search(s, t, cost, zeros)
+				self.assertEqual((path[0], path[-1]), (s, t))
+				self.assertEqual(len(set(path)), len(path))
+				self.assertAlmostEqual(graph.path_totals(path, cost)[i], expected)
+				path = find_route(graph, s, t, 'astar', cost, 'alt', compress=True)
+				self.assertAlmostEqual(graph.path_totals(path, cost)[i], expected)
+				# weighted, the same bound as without compression
+				stats = SearchStats()
+				path = find_route(graph, s, t, 'astar', cost, compress=True, stats=stats, epsilon=1.5)
+				self.assertEqual(stats.bound, 1.5 if s != t else None)
+				self.assertLessEqual(graph.path_totals(path, cost)[i], 1.5 * expected + 1e-9)
+
+	def test_same_run(self):
+		graph = self.graph
+		# A-B-C-D-E is a ring of pass-through cities, one of them becomes core
+		chains = ChainGraph(graph)
+		self.assertEqual(chains.num_core, 3)
+		b, c, d = graph.city_id('B'), graph.city_id('C'), graph.city_id('D')
+		self.assertEqual(find_route(graph, b, d, 'uniform', 'distance', compress=True), [b, c, d])
+		self.assertEqual(find_route(graph, graph.city_id('F'), graph.city_id('G'), 'uniform', 'time',
+			compress=True), [graph.city_id('F'), graph.city_id('G')])
+
+
+class WeightedAstarTest(SmallDatasetTest):
+
+	def test_bounded_suboptimality(self):
+		graph = grid_graph(15, seed=4)
+		rng = random.Random(9)
+		for _ in range(30):
+			s, t = rng.randrange(len(graph)), rng.randrange(len(graph))
+			optimal = graph.path_totals(UNIFORM(graph, s, t, 'distance'), 'distance')[0]
+			for epsilon in [1.2, 3.0]:
+				stats = SearchStats()
+				path = ASTAR(graph, s, t, 'distance', 'alt', stats=stats, epsilon=epsilon)
+				self.assertLessEqual(graph.path_totals(path, 'distance')[0], epsilon * optimal + 1e-9)
+				self.assertEqual(stats.bound, epsilon)
+			# out of time after the first round: only its bound is proven
+			path, bound = anytime_astar(graph, s, t, 'distance', 'alt', 3.0, deadline=0)
+			self.assertLessEqual(bound, 3.0)
+			self.assertLessEqual(graph.path_totals(path, 'distance')[0], bound * optimal + 1e-9)
+			# no deadline: rounds continue down to epsilon 1, which is exact
+			path, bound = anytime_astar(graph, s, t, 'distance', 'alt', 3.0, deadline=None)
+			self.assertEqual(graph.path_totals(path, 'distance')[0], optimal)
+			self.assertEqual(bound, 1.0)
+
+	def test_no_bound_for_great_circle(self):
+		graph = self.graph
+		a, d = graph.city_id('A'), graph.city_id('D')
+		stats = SearchStats()
+		path = find_route(graph, a, d, 'anytime-astar', 'time', 'gps', stats=stats)
+		self.assertEqual(path, [a, graph.city_id('E'), d])
+		self.assertIsNone(stats.bound)
+		answer = answer_query(graph, {'start': 'A', 'end': 'D', 'algorithm': 'anytime-astar', 'cost': 'distance',
+			'heuristic': 'alt', 'deadline': 1000})
+		self.assertEqual((answer['route'], answer['bound']), (['A', 'B', 'C', 'D'], 1.0))
+		# without a heuristic, bound-reporting queries use the landmark bounds
+		for query in [{'algorithm': 'anytime-astar', 'deadline': 1000}, {'algorithm': 'astar', 'epsilon': 1.5}]:
+			query.update({'start': 'A', 'end': 'D', 'cost': 'distance'})
+			self.assertIsNotNone(answer_query(graph, query)['bound'])
+			query['heuristic'] = 'gps'
+			self.assertIsNone(answer_query(graph, query)['bound'])
+		stats = SearchStats()
+		find_route(graph, a, d, 'anytime-astar', 'distance', stats=stats)
+		self.assertIsNotNone(stats.bound)
+
+
+class GraphCacheTest(TestCase):
+
+	def setUp(self):
+		self.data_dir = tempfile.mkdtemp()
+		write_small_dataset(self.data_dir)
+		self.cache_path = os.path.join(self.data_dir, CACHE_NAME)
+
+	def tearDown(self):
+		shutil.rmtree(self.data_dir)
+
+	def test_round_trip(self):
+		parsed = load_graph(self.data_dir, use_cache=False)
+		build_cache(self.data_dir)
+		cached = open_graph(self.cache_path)
+		self.assertEqual(cached.names, parsed.names)
+		self.assertEqual(cached.highway_names, parsed.highway_names)
+		for name in ['offsets', 'targets', 'length', 'speed', 'time', 'highway', 'component']:
+			self.assertEqual(getattr(cached, name).tolist(), getattr(parsed, name).tolist())
+		self.assertFalse(cached.has_gps(cached.city_id('G')))
+
+	def test_invalidated_by_source_change(self):
+		load_graph(self.data_dir)
+		self.assertTrue(cache_is_fresh(self.cache_path, self.data_dir))
+		# touching without changing content keeps the cache
+		os.utime(os.path.join(self.data_dir, 'road-segments.txt'), ns=(0, 0))
+		self.assertTrue(cache_is_fresh(self.cache_path, self.data_dir))
+		with open(os.path.join(self.data_dir, 'road-segments.txt'), 'a') as f:
+			f.write('D H 5 45 R_3\n')
+		self.assertFalse(cache_is_fresh(self.cache_path, self.data_dir))
+		self.assertIn('H', load_graph(self.data_dir).ids)
+		self.assertTrue(cache_is_fresh(self.cache_path, self.data_dir))
+
+	def test_index_built_once(self):
+		graph = load_graph(self.data_dir)
+		builds = []
+
+		def build():
+			builds.append(1)
+			time.sleep(0.05)
+			return {}, [('ones', np.ones(4))]
+		threads = [threading.Thread(target=load_index, args=(graph, 'test', build)) for _ in range(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(len(builds), 1)
+		self.assertEqual(load_index(load_graph(self.data_dir), 'test', build)[1]['ones'].tolist(), [1] * 4)
+		self.assertEqual(len(builds), 1)
+		self.assertFalse([name for name in os.listdir(self.data_dir) if name.endswith('.tmp')])
+
+
+class BenchmarkTest(TestCase):
+
+	def test_run_and_compare(self):
+		graph = grid_graph(6)
+		pairs = [(0, 35, 'corner'), (3, 20, 'middle')]
+		results = benchmark_route.run_benchmark(graph, pairs, repeat=1)
+		uniform = [r for r in results if r['algorithm'] == 'uniform' and r['cost'] == 'distance']
+		self.assertEqual(sorted(r['band'] for r in uniform), ['corner', 'middle'])
+		self.assertTrue(all(r['mean_expanded'] > 0 for r in uniform))
+		current = {'pairs': pairs, 'results': results}
+		self.assertEqual(benchmark_route.compare(current, current)[1], 0)
+		# a search that expands more nodes than the baseline is a regression, noisy time alone is not
+		worse = {'pairs': pairs, 'results': [dict(r) for r in results]}
+		for r in worse['results']:
+			r['median_ms'] *= 3
+		self.assertEqual(benchmark_route.compare(worse, current)[1], 0)
+		worse['results'][results.index(uniform[0])]['mean_expanded'] *= 2
+		self.assertEqual(benchmark_route.compare(worse, current)[1], 1)
+
+
+class RoadNetworkTest(TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		cls.graph = load_graph()
+
+	def test_all_algorithms_reach_goal(self):
+		start = self.graph.city_id('Bloomington,_Indiana')
+		end = self.graph.city_id('Chicago,_Illinois')
+		for alg in ROUTE_ALGORITHMS:
+			for cost in ['segments', 'distance', 'time']:
+				path = find_route(self.graph, start, end, alg, cost)
+				self.assertEqual(path[0], start)
+				self.assertEqual(path[-1], end)
+
+	def test_uniform_astar_optimal(self):
+		start = self.graph.city_id('Bloomington,_Indiana')
+		end = self.graph.city_id('Chicago,_Illinois')
+		for i, cost in enumerate(['distance', 'time']):
+			uniform = self.graph.path_totals(find_route(self.graph, start, end, 'uniform', cost), cost)
+			astar = self.graph.path_totals(find_route(self.graph, start, end, 'astar', cost), cost)
+			self.assertAlmostEqual(uniform[i], astar[i])
+		self.assertEqual(uniform[0], 224.0)
+
+	def test_cached_reverse_dfs(self):
+		lines = ['Bloomington,_Indiana Chicago,_Illinois dfs distance\n',
+			'Chicago,_Illinois Bloomington,_Indiana dfs distance\n']
+		fresh, cached = io.StringIO(), io.StringIO()
+		run_batch(self.graph, lines[1:], fresh)
+		run_batch(self.graph, lines, cached, RouteCache(10))
+		self.assertEqual(cached.getvalue().splitlines()[1], fresh.getvalue().strip())
+
+	def test_bidirectional_uniform_matches_uniform(self):
+		start = self.graph.city_id('Bloomington,_Indiana')
+		for name in ['Chicago,_Illinois', 'Seattle,_Washington', 'Columbus,_Ohio']:
+			end = self.graph.city_id(name)
+			for i, cost in enumerate(['distance', 'time']):
+				uniform = self.graph.path_totals(find_route(self.graph, start, end, 'uniform', cost), cost)
+				bidir = self.graph.path_totals(find_route(self.graph, start, end, 'bidirectional-uniform', cost), cost)
+				self.assertAlmostEqual(uniform[i], bidir[i])
+				for alg in ['astar', 'bidirectional-astar']:
+					path = find_route(self.graph, start, end, alg, cost, heuristic='alt')
+					self.assertAlmostEqual(uniform[i], self.graph.path_totals(path, cost)[i])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# tour.py : Multi-stop routes, a start, waypoints in any order and an optional end
+#
+# Costs between the stops come from one Dijkstra per stop (a ShortestPathTree from
+# tree_cache.py, grown until every other stop is settled) instead of one search per
+# pair, and the same trees give the legs of the final route without searching again.
+# The visiting order is exact (Held-Karp dynamic programming over subsets) for up to
+# HELD_KARP_LIMIT waypoints; above that it starts from nearest neighbor and is improved
+# by 2-opt (reverse a run of stops) and Or-opt (move a run of up to three stops) until
+# neither finds a cheaper order. Without an end the route stops at the last waypoint.
+#
+#   order, path = plan_tour(graph, start, [a, b, c], end=start, cost_func='time')
+
+import sys
+import numpy as np
+from tree_cache import ShortestPathTree
+from road_graph import load_graph
+
+INF = float('inf')
+
+HELD_KARP_LIMIT = 15
+# Or-opt moves runs of up to this many stops
+OR_OPT_RUN = 3
+
+
+# tree per stop and the stop-to-stop cost matrix, INF between components
+def stop_costs(graph, stops, cost_func, stats=None):
+	trees = [ShortestPathTree(graph, s, cost_func) for s in stops]
+	cost = np.full((len(stops), len(stops)), INF)
+	for i, tree in enumerate(trees):
+		for j, t in enumerate(stops):
+			if graph.connected(stops[i], t):
+				tree.extend(t, stats)
+				cost[i, j] = tree.g_value[t]
+	return cost, trees
+
+
+# total cost of visiting nodes in order
+def order_cost(cost, nodes):
+	return sum(cost[a][b] for a, b in zip(nodes, nodes[1:]))
+
+
+# cheapest order of nodes 1..k from node 0, finishing at node k + 1 if end is set;
+# dp[mask][j] is the cheapest route from 0 through the waypoints in mask ending at j
+def held_karp(cost, end=False):
+	k = len(cost) - (2 if end else 1)
+	if k == 0:
+		return []
+	waypoints = np.asarray(cost)[1:k + 1, 1:k + 1]
+	full = (1 << k) - 1
+	dp = np.full((1 << k, k), INF)
+	parent = np.full((1 << k, k), -1, dtype=np.int32)
+	for j in range(k):
+		dp[1 << j, j] = cost[0][j + 1]
+	bits = [1 << j for j in range(k)]
+	for mask in range(1, full + 1):
+		row = dp[mask]
+		if not np.isfinite(row).any():
+			continue
+		# cheapest way to extend by every next waypoint, from any last one in mask
+		via = row[:, None] + waypoints
+		best = via.argmin(axis=0)
+		extend = via[best, np.arange(k)]
+		for j in range(k):
+			if mask & bits[j]:
+				continue
+			nxt = mask | bits[j]
+			if extend[j] < dp[nxt, j]:
+				dp[nxt, j] = extend[j]
+				parent[nxt, j] = best[j]
+	final = dp[full] + (np.asarray(cost)[1:k + 1, k + 1] if end else 0)
+	j = int(final.argmin())
+	if not np.isfinite(final[j]):
+		return None
+	order = []
+	mask = full
+	while j >= 0:
+		order.append(j + 1)
+		j, mask = int(parent[mask, j]), mask & ~bits[j]
+	order.reverse()
+	return order
+
+
+# nearest neighbor order of nodes 1..k from node 0
+def nearest_neighbor(cost, end=False):
+	k = len(cost) - (2 if end else 1)
+	left = set(range(1, k + 1))
+	order = []
+	last = 0
+	while left:
+		last = min(left, key=lambda j: (cost[last][j], j))
+		order.append(last)
+		left.remove(last)
+	return order
+
+
+# 2-opt and Or-opt over the waypoint order, first improvement, until neither finds a
+# cheaper order; the start (and the end, if set) stay in place. Costs of runs walked
+# either way come from prefix sums, so each move is priced in constant time
+def improve_order(cost, order, end=False):
+	cost = cost.tolist() if isinstance(cost, np.ndarray) else cost
+	tour = [0] + list(order) + ([len(cost) - 1] if end else [])
+	# last position a waypoint may take
+	last = len(tour) - (2 if end else 1)
+	improved = True
+	while improved:
+		improved = False
+		forward, backward = [0.0], [0.0]
+		for a, b in zip(tour, tour[1:]):
+			forward.append(forward[-1] + cost[a][b])
+			backward.append(backward[-1] + cost[b][a])
+
+		def link(i, j):
+			return cost[tour[i]][tour[j]] if j < len(tour) else 0.0
+
+		# 2-opt: reverse positions p..q
+		for p in range(1, last + 1):
+			for q in range(p + 1, last + 1):
+				old = link(p - 1, p) + forward[q] - forward[p] + link(q, q + 1)
+				new = link(p - 1, q) + backward[q] - backward[p] + link(p, q + 1)
+				if new < old - 1e-9:
+					tour[p:q + 1] = tour[p:q + 1][::-1]
+					improved = True
+					break
+			if improved:
+				break
+		if improved:
+			continue
+		# Or-opt: move positions i..e elsewhere, either way round
+		for run in range(1, OR_OPT_RUN + 1):
+			for i in range(1, last - run + 2):
+				e = i + run - 1
+				removed = link(i - 1, i) + link(e, e + 1) - (link(i - 1, e + 1) if e + 1 < len(tour) else 0.0)
+				rest = tour[:i] + tour[e + 1:]
+				for j in range(len(rest) - (1 if end else 0)):
+					if j == i - 1:
+						continue
+					a = rest[j]
+					b = rest[j + 1] if j + 1 < len(rest) else None
+					gap = cost[a][b] if b is not None else 0.0
+					for flip, first, final, inner in ((False, tour[i], tour[e], forward[e] - forward[i]),
+							(True, tour[e], tour[i], backward[e] - backward[i])):
+						added = cost[a][first] + inner + (cost[final][b] if b is not None else 0.0) - gap
+						inside = forward[e] - forward[i]
+						if added - inside < removed - 1e-9:
+							segment = tour[i:e + 1][::-1] if flip else tour[i:e + 1]
+							tour = rest[:j + 1] + segment + rest[j + 1:]
+							improved = True
+							break
+					if improved:
+						break
+				if improved:
+					break
+			if improved:
+				break
+	return tour[1:last + 1]
+
+
+# (waypoints in visiting order, full city-id route), or (None, None) if some stop
+# cannot be reached
+def plan_tour(graph, start_city, waypoints, end_city=None, cost_func='distance', stats=None):
+	stops = [start_city] + list(waypoints) + ([end_city] if end_city is not None else [])
+	end = end_city is not None
+	cost, trees = stop_costs(graph, stops, cost_func, stats)
+	if not np.isfinite(cost[0]).all():
+		return None, None
+	if len(waypoints) <= HELD_KARP_LIMIT:
+		order = held_karp(cost, end)
+	else:
+		order = improve_order(cost, nearest_neighbor(cost, end), end)
+	nodes = [0] + order + ([len(stops) - 1] if end else [])
+	path = [start_city]
+	for a, b in zip(nodes, nodes[1:]):
+		path.extend(trees[a].path_to(stops[b])[1:])
+	return [stops[j] for j in order], path
+
+
+if __name__ == '__main__':
+	# python tour.py start waypoint [waypoint ...] : round trip by distance
+	graph = load_graph()
+	cities = [graph.city_id(name) for name in sys.argv[1:]]
+	order, path = plan_tour(graph, cities[0], cities[1:], cities[0])
+	if order is None:
+		print('No route through all stops')
+	else:
+		print(' '.join(graph.names[c] for c in order))
+		print('%s miles over %d cities' % (graph.path_totals(path)[0], len(path)))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# tree_cache.py : LRU cache of UNIFORM shortest-path trees, one per source city
+#
+# A UNIFORM (Dijkstra) search from a source settles cities in cost order, and its g-values
+# and parent pointers of settled cities are final. Instead of throwing them away once the
+# target is reached, the whole search state (g-values, parents, settled flags and the
+# fringe) is kept per (source, cost function). A later query from the same source to a
+# settled city is a walk up the parent pointers; any other target resumes the search
+# from the saved fringe until it is settled. All roads are bidirectional, so a query
+# whose end city has a tree that already settled the start is answered from that tree
+# with the route reversed.
+#
+# Trees are evicted least recently used first once their estimated size exceeds
+# max_bytes; the tree just used is always kept.
+#
+#   trees = TreeCache(64 << 20)
+#   path = find_route(graph, depot, city, 'uniform', 'distance', trees=trees)
+
+import sys
+import threading
+from collections import OrderedDict
+from heapq import heappush, heappop
+
+INF = float('inf')
+DEFAULT_TREE_CACHE_MB = 64
+# estimated bytes of one fringe entry: a 3-tuple and its float key
+FRINGE_ENTRY_BYTES = 88
+
+
+class ShortestPathTree:
+	def __init__(self, graph, source, cost_func):
+		self.graph = graph
+		self.source = source
+		self.cost_func = cost_func
+		self.g_value = [INF] * len(graph)
+		self.g_value[source] = 0
+		self.parent = [-1] * len(graph)
+		self.settled = bytearray(len(graph))
+		self.fringe = [(0, source)]
+		self.num_settled = 0
+
+	# estimated memory held by the tree
+	@property
+	def nbytes(self):
+		return (sys.getsizeof(self.g_value) + sys.getsizeof(self.parent) + sys.getsizeof(self.settled)
+			+ sys.getsizeof(self.fringe) + FRINGE_ENTRY_BYTES * len(self.fringe)
+			# g-values and parents of reached cities are separate float / int objects
+			+ 56 * self.num_settled)
+
+	# resume the search until city is settled or the fringe runs out
+	def extend(self, city, stats=None):
+		offsets, targets, weights = self.graph.adjacency(self.cost_func)
+		g_value, parent, settled, fringe = self.g_value, self.parent, self.settled, self.fringe
+		pops = stale = peak = generated = 0
+		while fringe and not settled[city]:
+			if len(fringe) > peak:
+				peak = len(fringe)
+			g, u = heappop(fringe)
+			pops += 1
+			if settled[u]:
+				stale += 1
+				continue
+			settled[u] = 1
+			generated += offsets[u + 1] - offsets[u]
+			for e in range(offsets[u], offsets[u + 1]):
+				nxt = targets[e]
+				tmp = g + weights[e]
+				if tmp < g_value[nxt]:
+					g_value[nxt] = tmp
+					parent[nxt] = u
+					heappush(fringe, (tmp, nxt))
+		self.num_settled += pops - stale
+		if stats is not None:
+			stats.add(expanded=pops - stale, generated=generated, pushes=pops, peak=peak)
+
+	# source -> city route, searching further if city is not settled yet
+	def path_to(self, city, stats=None):
+		if not self.settled[city]:
+			self.extend(city, stats)
+		if not self.settled[city]:
+			return None
+		path = [city]
+		while self.parent[path[-1]] >= 0:
+			path.append(self.parent[path[-1]])
+		path.reverse()
+		return path
+
+
+class TreeCache:
+	def __init__(self, max_bytes=DEFAULT_TREE_CACHE_MB << 20):
+		self.max_bytes = max_bytes
+		self.trees = OrderedDict()
+		# trees answered from without searching / trees searched further or built
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.trees)
+
+	@property
+	def nbytes(self):
+		return sum(tree.nbytes for tree in self.trees.values())
+
+	# UNIFORM route from start_city to end_city, None if there is none
+	def route(self, graph, start_city, end_city, cost_func, stats=None):
+		with self.lock:
+			# a tree from the end city that settled the start already has the answer
+			tree = self.trees.get((end_city, cost_func))
+			if tree is not None and tree.graph is graph and tree.settled[start_city]:
+				self.hits += 1
+				self.trees.move_to_end((end_city, cost_func))
+				return tree.path_to(start_city)[::-1]
+			key = (start_city, cost_func)
+			tree = self.trees.get(key)
+			if tree is None or tree.graph is not graph:
+				tree = ShortestPathTree(graph, start_city, cost_func)
+				self.trees[key] = tree
+			self.trees.move_to_end(key)
+			if tree.settled[end_city]:
+				self.hits += 1
+			else:
+				self.misses += 1
+			path = tree.path_to(end_city, stats)
+			self._evict()
+			return path
+
+	def _evict(self):
+		total = self.nbytes
+		while len(self.trees) > 1 and total > self.max_bytes:
+			_, tree = self.trees.popitem(last=False)
+			total -= tree.nbytes